@@ -11,3 +11,20 @@ if len(sys.argv) > 1 and 'celeryconfig_test' in sys.argv[1]:
     DATABASE_NAME = TEST_DATABASE_NAME
 
 RUN_PROFILER = False
+
+# number of threads to run independent calculations with
+CALCULATION_POOL_SIZE = 4
+
+# bytes of memory to use for caching dataset DataFrames in each process
+DFRAME_CACHE_MAX_BYTES = 256 * 1024 ** 2
+
+# days to keep deleted and replaced rows for before compacting them
+TOMBSTONE_RETENTION_DAYS = 7
+
+# rows to read at a time when streaming an import, and the number of read
+# chunks to hold while earlier chunks are being inserted
+IMPORT_CHUNK_SIZE = 50000
+IMPORT_QUEUE_SIZE = 2
+
+# bytes of a CSV file to import in each task when importing in parallel
+IMPORT_RANGE_SIZE = 64 * 1024 ** 2
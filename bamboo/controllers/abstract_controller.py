@@ -1,3 +1,5 @@
+from hashlib import md5
+
 import cherrypy
 
 from bamboo.lib.exceptions import ArgumentError
@@ -28,6 +30,7 @@ class AbstractController(object):
     DEFAULT_SUCCESS_STATUS_CODE = 200
     ERROR_STATUS_CODE = 400
     NO_CONTENT_STATUS_CODE = 204
+    NOT_MODIFIED_STATUS_CODE = 304
 
     def options(self, dataset_id=None, name=None):
         """Set Cross Origin Resource Sharing (CORS) headers.
@@ -86,7 +89,7 @@ class AbstractController(object):
                            exceptions=(),
                            success_status_code=DEFAULT_SUCCESS_STATUS_CODE,
                            error=DEFAULT_ERROR_MESSAGE,
-                           content_type=JSON):
+                           content_type=JSON, conditional=False):
         """Find dataset and call action with it and kwargs.
 
         Finds the dataset by `dataset_id` then calls function `action` and
@@ -94,6 +97,11 @@ class AbstractController(object):
         exceptions. Passes the result, error and callback to dump_or_error and
         returns the resulting string.
 
+        If `conditional` is True the response has an ETag for the dataset and
+        the request.  If the request's If-None-Match header matches the
+        current ETag, `action` is not called and an empty response with the
+        HTTP status code 304 is returned.
+
         :param dataset_id: The dataset ID to fetch.
         :param action: A function to call within a try block that takes a
             dataset any kwargs.
@@ -103,6 +111,8 @@ class AbstractController(object):
         :param success_status_code: The HTTP status code to return, default is
             DEFAULT_SUCCESS_STATUS_CODE.
         :param error: Default error string.
+        :param content_type: The content type of the response, default JSON.
+        :param conditional: Support conditional requests, default False.
         :param kwargs: A set of keyword arguments that are passed to the
             action.
 
@@ -113,6 +123,17 @@ class AbstractController(object):
 
         dataset = Dataset.find_one(dataset_id) if dataset_id else None
         result = None
+        conditional = conditional and bool(dataset)
+
+        if conditional:
+            etag = self.__etag(dataset)
+
+            if self.__not_modified(etag):
+                self.__add_cors_headers()
+                cherrypy.response.headers['ETag'] = etag
+                cherrypy.response.status = self.NOT_MODIFIED_STATUS_CODE
+
+                return ''
 
         try:
             if dataset is None or dataset.record:
@@ -122,11 +143,37 @@ class AbstractController(object):
 
         self.set_response_params(result, success_status_code, content_type)
 
+        if conditional and result is not None:
+            # the action may have stored summaries with the dataset
+            cherrypy.response.headers['ETag'] = self.__etag(dataset)
+
         return self._dump_or_error(result, error, callback)
 
     def _success(self, msg, dataset_id):
         return {self.SUCCESS: msg, Dataset.ID: dataset_id}
 
+    def __etag(self, dataset):
+        """Return an entity tag for the response to this request.
+
+        The tag is built from the data version of `dataset`, a hash of its
+        record, to include changes to metadata such as the schema and summary
+        statistics, and the requested URL.
+        """
+        request = cherrypy.request
+        digest = md5(dump_mongo_json(dataset.record))
+        digest.update(request.path_info)
+        digest.update(request.query_string)
+
+        return '"%s-%s"' % (dataset.data_version, digest.hexdigest())
+
+    def __not_modified(self, etag):
+        """Return True if the request's If-None-Match header has `etag`."""
+        if_none_match = cherrypy.request.headers.get('If-None-Match')
+
+        return if_none_match is not None and (etag in [
+            tag.strip() for tag in if_none_match.split(',')] or
+            if_none_match.strip() == '*')
+
     def __add_cors_headers(self):
         cherrypy.response.headers['Access-Control-Allow-Origin'] = '*'
         cherrypy.response.headers['Access-Control-Allow-Methods'] =\
@@ -11,7 +11,7 @@ from bamboo.core.merge import merge_dataset_ids, MergeError
 from bamboo.core.summary import ColumnTypeError
 from bamboo.lib.exceptions import ArgumentError
 from bamboo.lib.jsontools import df_to_jsondict, JSONError, safe_json_loads
-from bamboo.lib.utils import parse_int
+from bamboo.lib.utils import parse_bool, parse_int
 from bamboo.lib.query_args import QueryArgs
 from bamboo.models.dataset import Dataset
 from bamboo.models.observation import Observation
@@ -77,7 +77,8 @@ class Datasets(AbstractController):
         def action(dataset):
             return dataset.info()
 
-        return self._safe_get_and_call(dataset_id, action, callback=callback)
+        return self._safe_get_and_call(dataset_id, action, callback=callback,
+                                       conditional=True)
 
     def set_info(self, dataset_id, **kwargs):
         """Set the metadata for a dataset.
@@ -139,13 +140,17 @@ class Datasets(AbstractController):
 
             query_args = QueryArgs(query=query, select=select, limit=limit,
                                    order_by=order_by)
-            dframe = dataset.dframe(query_args)
+            no_cache = query or select
+
+            # the stored summary reads only the columns it is missing
+            dframe = dataset.dframe(query_args) if no_cache else None
 
             return dataset.summarize(dframe, groups=groups,
-                                     no_cache=query or select, flat=flat)
+                                     no_cache=no_cache, flat=flat)
 
         return self._safe_get_and_call(dataset_id, action, callback=callback,
-                                       exceptions=(ColumnTypeError,))
+                                       exceptions=(ColumnTypeError,),
+                                       conditional=True)
 
     def aggregations(self, dataset_id, callback=False):
         """Return a dict of aggregated data for the given `dataset_id`.
@@ -160,7 +165,8 @@ class Datasets(AbstractController):
         def action(dataset):
             return dataset.aggregated_datasets_dict
 
-        return self._safe_get_and_call(dataset_id, action, callback=callback)
+        return self._safe_get_and_call(dataset_id, action, callback=callback,
+                                       conditional=True)
 
     def show(self, dataset_id, query=None, select=None, distinct=None, limit=0,
              order_by=None, format=None, callback=False, count=False,
@@ -204,7 +210,8 @@ class Datasets(AbstractController):
             return self.__dataframe_as_content_type(content_type, dframe)
 
         return self._safe_get_and_call(
-            dataset_id, action, callback=callback, content_type=content_type)
+            dataset_id, action, callback=callback, content_type=content_type,
+            conditional=True)
 
     def merge(self, dataset_ids, mapping=None):
         """Merge the datasets with the dataset_ids in `datasets`.
@@ -264,6 +271,10 @@ class Datasets(AbstractController):
         :param schema: A SDF schema file (JSON)
         :param na_values: A JSON list of values to interpret as missing data.
         :param perish: Number of seconds after which to delete the dataset.
+        :param chunksize: If given, read a CSV file in chunks of this many
+            rows and save each chunk as it is read.
+        :param parallel: If True, save ranges of an uploaded CSV file in
+            parallel tasks.
 
         :returns: An error message if `url`, `csv_file`, or `scehma` are not
             provided. An error message if an improperly formatted value raises
@@ -386,7 +397,8 @@ class Datasets(AbstractController):
 
         return self._safe_get_and_call(dataset_id, action,
                                        exceptions=(TypeError,),
-                                       content_type=content_type)
+                                       content_type=content_type,
+                                       conditional=True)
 
     def set_olap_type(self, dataset_id, column, olap_type):
         """Set the OLAP Type for this `column` of dataset.
@@ -433,7 +445,8 @@ class Datasets(AbstractController):
             return self.__dataframe_as_content_type(content_type, dframe)
 
         return self._safe_get_and_call(dataset_id, action,
-                                       content_type=content_type)
+                                       content_type=content_type,
+                                       conditional=True)
 
     def row_delete(self, dataset_id, index):
         """Delete a row from dataset by index.
@@ -466,7 +479,8 @@ class Datasets(AbstractController):
                 return row.clean_record
 
         error_message = "No row exists at index %s" % index
-        return self._safe_get_and_call(dataset_id, action, error=error_message)
+        return self._safe_get_and_call(dataset_id, action, error=error_message,
+                                       conditional=True)
 
     def row_update(self, dataset_id, index, data):
         """Update a row in dataset by index.
@@ -584,11 +598,11 @@ class Datasets(AbstractController):
             return vis.build_html()
 
         return self._safe_get_and_call(
-            dataset_id, action, content_type='text/html')
+            dataset_id, action, content_type='text/html', conditional=True)
 
     def __create_or_update(self, url=None, csv_file=None, json_file=None,
                            schema=None, na_values=[], perish=0,
-                           dataset_id=None):
+                           chunksize=0, parallel=False, dataset_id=None):
         result = None
         error = 'url, csv_file or schema required'
 
@@ -605,11 +619,15 @@ class Datasets(AbstractController):
                     dataset.import_schema(schema)
 
                 na_values = safe_json_loads(na_values)
+                chunksize = parse_int(chunksize)
 
                 if url:
-                    dataset.import_from_url(url, na_values=na_values)
+                    dataset.import_from_url(url, na_values=na_values,
+                                            chunksize=chunksize)
                 elif csv_file:
-                    dataset.import_from_csv(csv_file, na_values=na_values)
+                    dataset.import_from_csv(csv_file, na_values=na_values,
+                                            chunksize=chunksize,
+                                            parallel=parse_bool(parallel))
                 elif json_file:
                     dataset.import_from_json(json_file)
 
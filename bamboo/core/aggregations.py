@@ -1,21 +1,231 @@
-from math import isnan
-
+import numpy as np
 from pandas import concat, DataFrame, Series
-from scipy.stats.stats import pearsonr
+from scipy.special import betainc
 
+from bamboo.core.frame import STATE_KEY_PREFIX
+from bamboo.lib.sketches import QuantileSketch
 from bamboo.lib.utils import minint, parse_float
 
 
+# suffix for the columns of new rows while they are merged into stored state
+NEW_SUFFIX = '_new'
+
+
+def reduce_sum(stored, new):
+    return stored.add(new, fill_value=0)
+
+
+def reduce_min(stored, new):
+    return stored.where(new.isnull() | (stored <= new), new)
+
+
+def reduce_max(stored, new):
+    return stored.where(new.isnull() | (stored >= new), new)
+
+
+def moments(dframe, groups, columns):
+    """Return the count, means and central moments of `columns`.
+
+    Rows with a null in any of `columns` are not counted.  The moments are
+    the sums of squared deviations from the mean for each column and, for two
+    columns, the sum of the products of their deviations.
+
+    :param dframe: A DataFrame with the group columns.
+    :param groups: A list of columns to group on.
+    :param columns: A dict of keys to columns aligned with `dframe`.
+
+    :returns: A DataFrame with the group columns, a ``count`` column, a
+        ``mean_KEY`` and ``m2_KEY`` column for each key and a ``comoment``
+        column for two keys, with one row per group.
+    """
+    keys = sorted(columns.keys())
+    valid = reduce(lambda x, y: x & y, [c.notnull() for c in columns.values()])
+    values = DataFrame({key: columns[key].where(valid) for key in keys})
+    values['count'] = valid.astype(float)
+
+    if groups:
+        values = dframe[groups].join(values)
+        grouped = values.groupby(groups)
+        means = grouped[keys].mean()
+        centered = values[keys] - values[groups].join(
+            means, on=groups)[keys]
+    else:
+        means = values[keys].mean()
+        centered = values[keys] - means
+
+    products = DataFrame({'m2_%s' % key: centered[key] ** 2 for key in keys})
+
+    if len(keys) == 2:
+        products['comoment'] = centered[keys[0]] * centered[keys[1]]
+
+    if groups:
+        state = values[groups].join(products).groupby(groups).sum()
+        state['count'] = grouped['count'].sum()
+    else:
+        state = DataFrame([products.sum()])
+        state['count'] = values['count'].sum()
+
+    state = state.fillna(0)
+
+    for key in keys:
+        state['mean_%s' % key] = means[key]
+
+    return state.reset_index() if groups else state
+
+
+def sample_variance(state):
+    """Return the sample variance from the moments in `state`."""
+    count = state['count']
+
+    return (state['m2_x'] / (count - 1)).where(count > 1)
+
+
+def merge_moments(stored, new, keys):
+    """Merge two sets of moments as returned by `moments`.
+
+    Uses the pairwise update of Chan et al., so that merging the moments of
+    two sets of rows gives the moments of all the rows.
+
+    :param stored: A DataFrame with the stored moments.
+    :param new: A DataFrame with the new moments, aligned with `stored`.
+    :param keys: The keys of the columns the moments are for.
+
+    :returns: A DataFrame with the merged moments.
+    """
+    stored_count = stored['count'].fillna(0)
+    new_count = new['count'].fillna(0)
+    count = stored_count + new_count
+    new_ratio = new_count / count
+    weight = (stored_count * new_count / count).fillna(0)
+
+    merged = DataFrame({'count': count}, index=stored.index)
+    deltas = {}
+
+    for key in keys:
+        mean = 'mean_%s' % key
+        m2 = 'm2_%s' % key
+        deltas[key] = new[mean].fillna(0) - stored[mean].fillna(0)
+        merged[mean] = stored[mean].fillna(0) + deltas[key] * new_ratio
+        merged[m2] = stored[m2].fillna(0) + new[m2].fillna(0) +\
+            deltas[key] ** 2 * weight
+
+    if len(keys) == 2:
+        merged['comoment'] = stored['comoment'].fillna(0) +\
+            new['comoment'].fillna(0) +\
+            deltas[keys[0]] * deltas[keys[1]] * weight
+
+    return merged
+
+
+def merge_maxima(dframe, max_name, index_name, names):
+    """Merge new maxima with their indices into stored maxima.
+
+    Where the new maximum is greater than the stored maximum, or equal to it
+    at a larger index, the new maximum and the new values of `names` are
+    taken.
+
+    :param dframe: A DataFrame with stored and new state columns.
+    :param max_name: The column with the maximum.
+    :param index_name: The column with the index of the maximum.
+    :param names: The columns to take from the newer maximum.
+
+    :returns: `dframe` with the new state columns merged.
+    """
+    stored = dframe[max_name]
+    new = dframe.pop(max_name + NEW_SUFFIX)
+    newer = (new > stored) | (stored.isnull() & new.notnull()) | (
+        (new == stored) &
+        (dframe[index_name + NEW_SUFFIX] > dframe[index_name]))
+
+    dframe[max_name] = stored.where(~newer, new)
+
+    for name in names:
+        new_values = dframe.pop(name + NEW_SUFFIX)
+        dframe[name] = dframe[name].where(~newer, new_values)
+
+    dframe[index_name] = dframe[index_name].fillna(minint()).astype(int)
+
+    return dframe
+
+
+class MomentAggregation(object):
+    """Mixin for aggregations computed from the moments of their columns.
+
+    The count, means and moments are stored with the aggregation in internal
+    columns, so that new rows can be merged in without the rows already
+    aggregated.  Subclasses define ``_statistics``, which returns a dict of
+    result columns to their values from a DataFrame of the state.
+    """
+    keys = ['x']
+    reducible = True
+
+    def agg(self):
+        return self._reduced(self._moments())
+
+    def group(self):
+        return self._reduced(self._moments())
+
+    def _merge_state(self, dframe):
+        names = self.__state_names()
+        stored = dframe[names.values()].rename(columns=self.__invert(names))
+        new = dframe[[name + NEW_SUFFIX for name in names.values()]].rename(
+            columns={name + NEW_SUFFIX: key for key, name in names.items()})
+
+        for name in names.values():
+            del dframe[name + NEW_SUFFIX]
+
+        merged = merge_moments(stored, new, self.keys)
+
+        for key, name in names.items():
+            dframe[name] = merged[key]
+
+        return dframe
+
+    def _moments(self):
+        state = moments(self.dframe, self.groups,
+                        dict(zip(self.keys, self.columns)))
+
+        return state.rename(columns=self.__state_names())
+
+    def _reduced(self, dframe):
+        names = self.__state_names()
+        state = dframe[names.values()].rename(columns=self.__invert(names))
+
+        for name, column in self._statistics(state).items():
+            dframe[name] = column
+
+        return dframe
+
+    def _state_columns(self):
+        return self.__state_names().values()
+
+    def __invert(self, names):
+        return {name: key for key, name in names.items()}
+
+    def __state_names(self):
+        keys = ['count'] + ['mean_%s' % k for k in self.keys] + [
+            'm2_%s' % k for k in self.keys]
+
+        if len(self.keys) == 2:
+            keys.append('comoment')
+
+        return {key: '%s%s_%s' % (STATE_KEY_PREFIX, self.name, key)
+                for key in keys}
+
+
 class Aggregation(object):
     """Abstract class for all aggregations.
 
     :param column: Column to aggregate.
     :param columns: List of columns to aggregate.
     :param formula_name: The string to refer to this aggregation.
+    :param reduction: A function to merge stored and new values of this
+        aggregation, if it can be updated incrementally.
     """
     column = None
     columns = None
     formula_name = None
+    reduction = None
 
     def __init__(self, name, groups, dframe):
         self.name = name
@@ -36,6 +246,56 @@ class Aggregation(object):
         result = float(self.column.__getattribute__(self.formula_name)())
         return self._value_to_dframe(result)
 
+    @property
+    def reducible(self):
+        return self.reduction is not None
+
+    def reduce(self, dframe, columns):
+        """Merge the aggregation of new rows into the stored aggregation.
+
+        The new rows are aggregated on their own and their state columns are
+        merged into the state columns of `dframe`, for the groups in the new
+        rows only.  Other columns in `dframe` are kept as they are.
+
+        :param dframe: The stored aggregation to reduce into.
+        :param columns: The columns for the new rows to aggregate.
+
+        :returns: The updated aggregation.
+        """
+        self.columns = columns
+        self.column = columns[0] if len(columns) else None
+
+        new_dframe = self.group() if self.groups else self.agg()
+        new_dframe = new_dframe[self.groups + self._state_columns()]
+
+        if self.groups:
+            dframe = dframe.merge(new_dframe, on=self.groups, how='outer',
+                                  suffixes=('', NEW_SUFFIX))
+        else:
+            dframe = dframe.reset_index(drop=True).join(
+                new_dframe, rsuffix=NEW_SUFFIX)
+
+        return self._reduced(self._merge_state(dframe))
+
+    def _merge_state(self, dframe):
+        """Merge the new state columns into the stored state columns."""
+        for name, reduction in self._reductions().items():
+            dframe[name] = reduction(dframe[name],
+                                     dframe.pop(name + NEW_SUFFIX))
+
+        return dframe
+
+    def _reduced(self, dframe):
+        """Update columns derived from the state after a reduce."""
+        return dframe
+
+    def _reductions(self):
+        """Return a dict of state columns to the function that merges them."""
+        return {self.name: self.reduction}
+
+    def _state_columns(self):
+        return self._reductions().keys()
+
     def _value_to_dframe(self, value):
         return DataFrame({self.name: Series([value])})
 
@@ -54,6 +314,7 @@ class CountAggregation(Aggregation):
     expression that signifies which rows are to be counted.
     """
     formula_name = 'count'
+    reduction = staticmethod(reduce_sum)
 
     def group(self):
         if self.column is not None:
@@ -89,6 +350,7 @@ class RatioAggregation(Aggregation):
     both valid formulas.
     """
     formula_name = 'ratio'
+    reduction = staticmethod(reduce_sum)
 
     def group(self):
         return self._group(self.columns)
@@ -110,23 +372,14 @@ class RatioAggregation(Aggregation):
 
         return self._add_calculated_column(dframe)
 
-    def reduce(self, dframe, columns):
-        """Reduce the columns and store in `dframe`.
-
-        :param dframe: The DataFrame to reduce.
-        :param columns: Columns in the DataFrame to reduce on.
-        """
-        self.columns = columns
-        self.column = columns[0]
-        new_dframe = self.agg()
-
-        for column in new_dframe.columns:
-            dframe[column] += new_dframe[column]
-
+    def _reduced(self, dframe):
         dframe[self.name] = self.__agg_dframe(dframe)
 
         return dframe
 
+    def _reductions(self):
+        return {self.__name_for_idx(i): reduce_sum for i in xrange(0, 2)}
+
     def __name_for_idx(self, idx):
         return '%s_%s' % (self.name, {
             0: 'numerator',
@@ -154,38 +407,63 @@ class RatioAggregation(Aggregation):
 class ArgMaxAggregation(Aggregation):
     """Return the index for the maximum of a column.
 
+    If the maximum is in more than one row the largest index is returned,
+    with or without groups.  The maximum is stored with its index in an
+    internal column, so that new rows can be merged in without the rows
+    already aggregated.
+
     Written as ``argmax(FORMULA)``. Where `FORMULA` is a valid formula.
     """
     formula_name = 'argmax'
+    reducible = True
+
+    def agg(self):
+        rows = DataFrame(self.__values())
+        rows[self.name] = rows.index
+        maximum = rows[self._max_name].max()
+        at_max = rows[rows[self._max_name] == maximum]
+
+        return DataFrame({
+            self.name: [at_max[self.name].max() if len(at_max) else minint()],
+            self._max_name: [maximum],
+        })
 
     def group(self):
-        """For when aggregation is called with a group parameter."""
-        self.column = self.column.apply(lambda value: parse_float(value))
-        group_dframe = self.dframe[self.groups].join(self.column)
-        indices = group_dframe.reset_index().set_index(
-            self.groups + [self.name])
+        """Find the maximum and its largest index for every group at once.
 
-        def max_index_for_row(row):
-            groups = row[self.groups]
-            value = row[self.name]
+        The maximum of each group is joined to the rows of the group and the
+        largest index of the rows with that value is taken.
+        """
+        rows = self.dframe[self.groups].join(self.__values())
+        rows[self.name] = rows.index
 
-            xsection = indices.xs(groups, level=self.groups)
+        maxima = rows[self.groups + [self._max_name]].groupby(
+            self.groups).max()
+        at_max = rows.join(maxima, on=self.groups, rsuffix=NEW_SUFFIX)
+        at_max = at_max[at_max[self._max_name] ==
+                        at_max[self._max_name + NEW_SUFFIX]]
 
-            if isnan(value):
-                return minint()
+        dframe = maxima.join(
+            at_max[self.groups + [self.name]].groupby(self.groups).max())
+        dframe[self.name] = dframe[self.name].fillna(minint()).astype(int)
 
-            max_index = xsection.get_value(value, 'index')
+        return dframe.reset_index()
 
-            if isinstance(max_index, Series):
-                max_index = max_index.max()
+    def _merge_state(self, dframe):
+        return merge_maxima(dframe, self._max_name, self.name, [self.name])
 
-            return max_index
+    def _state_columns(self):
+        return [self.name, self._max_name]
 
-        groupby_max = self._groupby().max().reset_index()
-        column = groupby_max.apply(max_index_for_row, axis=1).apply(int)
-        column.name = self.name
+    @property
+    def _max_name(self):
+        return '%s%s_max' % (STATE_KEY_PREFIX, self.name)
+
+    def __values(self):
+        values = self.column.apply(parse_float).astype(float)
+        values.name = self._max_name
 
-        return DataFrame(column).join(groupby_max[self.groups])
+        return values
 
 
 class MaxAggregation(Aggregation):
@@ -194,6 +472,7 @@ class MaxAggregation(Aggregation):
     Written as ``max(FORMULA)``. Where `FORMULA` is a valid formula.
     """
     formula_name = 'max'
+    reduction = staticmethod(reduce_max)
 
 
 class MeanAggregation(RatioAggregation, Aggregation):
@@ -207,7 +486,7 @@ class MeanAggregation(RatioAggregation, Aggregation):
     formula_name = 'mean'
 
     def group(self):
-        return self._group([self.column, Series([1] * len(self.column))])
+        return self._group([self.column, Series(1, index=self.column.index)])
 
     def agg(self):
         dframe = DataFrame(index=[0])
@@ -235,44 +514,66 @@ class MinAggregation(Aggregation):
     Written as ``min(FORMULA)``. Where `FORMULA` is a valid formula.
     """
     formula_name = 'min'
+    reduction = staticmethod(reduce_min)
 
 
 class NewestAggregation(Aggregation):
     """Return the second column's value at the newest row in the first column.
 
     Find the maximum value for the first column and return the entry at that
-    row from the second column.
+    row from the second column.  The index and value of the newest row are
+    stored in internal columns, so that new rows can be merged in without the
+    rows already aggregated.
 
     Written as ``newest(INDEX_FORMULA, VALUE_FORMULA)`` where ``INDEX_FORMULA``
     and ``VALUE_FORMULA`` are valid formulae.
     """
     formula_name = 'newest'
+    reducible = True
     value_column = 1
 
     def agg(self):
-        index, values = self.columns
-        index.name = 'index'
-        values.name = self.name
+        return self.__newest()
 
-        idframe = DataFrame(values).join(index).dropna().reset_index()
-        idx = idframe['index'].argmax()
-        result = idframe[self.name].get_value(idx)
+    def group(self):
+        return self.__newest()
 
-        return self._value_to_dframe(result)
+    def _merge_state(self, dframe):
+        return merge_maxima(dframe, self.__max_name, self.__index_name,
+                            [self.__index_name, self.name])
 
-    def group(self):
-        argmax_agg = ArgMaxAggregation(self.name, self.groups, self.dframe)
-        argmax_df = argmax_agg.eval(self.columns)
-        indices = argmax_df.pop(self.name)
+    def _state_columns(self):
+        return [self.name, self.__index_name, self.__max_name]
+
+    @property
+    def __index_name(self):
+        return '%s%s_index' % (STATE_KEY_PREFIX, self.name)
+
+    @property
+    def __max_name(self):
+        return '%s%s_max' % (STATE_KEY_PREFIX, self.name)
+
+    def __newest(self):
+        columns = self.columns
+
+        if not self.groups:
+            # rows without a value are not the newest row
+            index, values = columns
+            columns = [index.where(values.notnull()), values]
 
-        newest_col = self.columns[self.value_column][indices]
-        newest_col.index = argmax_df.index
-        newest_col.name = self.name
+        argmax = ArgMaxAggregation(self.__index_name, self.groups, self.dframe)
+        dframe = argmax.eval(columns).rename(
+            columns={argmax._max_name: self.__max_name})
 
-        return argmax_df.join(newest_col)
+        # groups without an index have a minimum index which is not a row
+        values = self.columns[self.value_column].reindex(
+            dframe[self.__index_name])
+        dframe[self.name] = values.values
+
+        return dframe
 
 
-class PearsonAggregation(Aggregation):
+class PearsonAggregation(MomentAggregation, Aggregation):
     """Calculate the Pearson correlation and associatd p-value.
 
     Calculate the Pearson correlation coefficient between two columns and the
@@ -282,46 +583,108 @@ class PearsonAggregation(Aggregation):
     ``FORMULA2`` are valid formulae.
     """
     formula_name = 'pearson'
+    keys = ['x', 'y']
+
+    def _statistics(self, state):
+        coefficient = state['comoment'] / np.sqrt(
+            state['m2_x'] * state['m2_y'])
+        coefficient = coefficient.clip(-1.0, 1.0)
+
+        # as in scipy.stats.pearsonr, from the t-distribution
+        df = state['count'] - 2
+        t_squared = coefficient ** 2 * (
+            df / ((1.0 - coefficient) * (1.0 + coefficient)))
+        pvalue = Series(betainc(0.5 * df, 0.5, df / (df + t_squared)),
+                        index=state.index)
+        pvalue[coefficient.abs() == 1.0] = 0.0
+
+        return {self.name: coefficient, self.__pvalue_name: pvalue}
+
+    @property
+    def __pvalue_name(self):
+        return '%s_pvalue' % self.name
+
+
+class QuantileAggregation(Aggregation):
+    """Estimate a quantile from a sketch of the distribution.
+
+    A sketch is stored for each group, which is exact for small groups and
+    approximate for large ones.  Sketches are merged when rows are added, so
+    that the rows already aggregated are not read again.  The sketches are
+    stored in an internal column, which is not part of the schema.
+
+    Written as ``quantile(FORMULA, Q)``. Where `FORMULA` is a valid formula
+    and `Q` is the quantile between 0 and 1, by default 0.5.
+    """
+    formula_name = 'quantile'
+    reducible = True
 
     def agg(self):
-        coor, pvalue = self.__pearsonr(self.columns)
-        pvalue_column = Series([pvalue], name=self.__pvalue_name)
-        return self._value_to_dframe(coor).join(pvalue_column)
+        sketch = QuantileSketch.from_values(self.column)
+
+        return self._reduced(
+            DataFrame({self.__sketch_name: Series([sketch.to_json()])}))
 
     def group(self):
-        def pearson(dframe):
-            columns = [dframe[name] for name in dframe.columns[-2:]]
+        groups = [self.dframe[group] for group in self.groups]
+        sketches = Series(self.column.values, index=self.dframe.index).groupby(
+            groups).agg(lambda x: QuantileSketch.from_values(x).to_json())
+        sketches.name = self.__sketch_name
 
-            return DataFrame([self.__pearsonr(columns)],
-                             columns=[self.name, self.__pvalue_name])
+        return self._reduced(DataFrame(sketches).reset_index())
 
-        groupby = self._groupby()
-        dframe = groupby.apply(pearson).reset_index()
+    def _merge_state(self, dframe):
+        name = self.__sketch_name
+        new = dframe.pop(name + NEW_SUFFIX)
+        dframe[name] = [self.__merge(stored, added) for stored, added in
+                        zip(dframe[name], new)]
 
-        # remove extra index column
-        del dframe[dframe.columns[len(self.groups)]]
         return dframe
 
-    def __pearsonr(self, columns):
-        columns = [c.dropna() for c in columns]
-        shared_index = reduce(
-            lambda x, y: x.index.intersection(y.index), columns)
-        columns = [c.ix[shared_index] for c in columns]
+    def _reduced(self, dframe):
+        q = self.__quantile()
+        dframe[self.name] = dframe[self.__sketch_name].apply(
+            lambda sketch: QuantileSketch.from_json(sketch).quantile(q))
+
+        return dframe
+
+    def _state_columns(self):
+        return [self.__sketch_name]
+
+    def __merge(self, stored, new):
+        """Merge two sketches, either of which may be missing for a group."""
+        if not isinstance(new, basestring):
+            return stored
+
+        if not isinstance(stored, basestring):
+            return new
+
+        return QuantileSketch.from_json(stored).merge(
+            QuantileSketch.from_json(new)).to_json()
+
+    def __quantile(self):
+        if len(self.columns) < 2:
+            return 0.5
+
+        q = self.columns[1].dropna()
 
-        return pearsonr(*columns)
+        return min(max(float(q.values[0]), 0.0), 1.0) if len(q) else 0.5
 
     @property
-    def __pvalue_name(self):
-        return '%s_pvalue' % self.name
+    def __sketch_name(self):
+        return '%s%s_sketch' % (STATE_KEY_PREFIX, self.name)
 
 
-class StandardDeviationAggregation(Aggregation):
+class StandardDeviationAggregation(MomentAggregation, Aggregation):
     """Calculate the standard deviation. Written as ``std(FORMULA)``.
 
     Where `FORMULA` is a valid formula.
     """
     formula_name = 'std'
 
+    def _statistics(self, state):
+        return {self.name: np.sqrt(sample_variance(state))}
+
 
 class SumAggregation(Aggregation):
     """Calculate the sum.
@@ -329,23 +692,19 @@ class SumAggregation(Aggregation):
     Written as ``sum(FORMULA)``. Where `FORMULA` is a valid formula.
     """
     formula_name = 'sum'
+    reduction = staticmethod(reduce_sum)
 
-    def reduce(self, dframe, columns):
-        self.columns = columns
-        self.column = columns[0]
-        dframe = dframe.reset_index()
-        dframe[self.name] += self.agg()[self.name]
 
-        return dframe
-
-
-class VarianceAggregation(Aggregation):
+class VarianceAggregation(MomentAggregation, Aggregation):
     """Calculate the variance. Written as ``var(FORMULA)``.
 
     Where `FORMULA` is a valid formula.
     """
     formula_name = 'var'
 
+    def _statistics(self, state):
+        return {self.name: sample_variance(state)}
+
 
 # dict of formula names to aggregation classes
 AGGREGATIONS = {
@@ -1,8 +1,18 @@
+from threading import Lock
+
 from pandas import concat
 
 from bamboo.core.aggregations import AGGREGATIONS
 from bamboo.core.frame import add_parent_column, rows_for_parent_id
-from bamboo.lib.parsing import parse_columns
+from bamboo.core.parser import Parser
+from bamboo.lib.mongo import MONGO_ID
+from bamboo.lib.parsing import parse_batch_columns
+from bamboo.lib.query_args import QueryArgs
+from bamboo.lib.utils import combine_dicts
+
+
+# guards the links from a dataset to its aggregated datasets
+AGGREGATED_DATASETS_LOCK = Lock()
 
 
 def group_join(groups, left, other):
@@ -12,6 +22,25 @@ def group_join(groups, left, other):
     return left.join(other, on=groups if len(groups) else None)
 
 
+def aggregation_dframe(dataset, formulas, groups):
+    """Fetch the columns of `dataset` needed to aggregate `formulas`.
+
+    :param formulas: A list of aggregation formulas.
+    :param groups: A list of columns to group on.
+    """
+    dependent_columns = set.union(set(), *[
+        Parser.dependent_columns(formula, dataset) for formula in formulas])
+
+    # get dframe with only the necessary columns
+    select = combine_dicts({group: 1 for group in groups},
+                           {col: 1 for col in dependent_columns})
+
+    # ensure at least one column (MONGO_ID) for the count aggregation
+    query_args = QueryArgs(select=select or {MONGO_ID: 1})
+
+    return dataset.dframe(query_args=query_args, keep_mongo_keys=not select)
+
+
 def aggregated_dataset(dataset, dframe, groups):
     """Create an aggregated dataset for this dataset.
 
@@ -25,49 +54,50 @@ def aggregated_dataset(dataset, dframe, groups):
     a_dataset = dataset.create()
     a_dataset.save_observations(dframe)
 
-    # store a link to the new dataset
-    group_str = dataset.join_groups(groups)
-    a_datasets_dict = dataset.aggregated_datasets_dict
-    a_datasets_dict[group_str] = a_dataset.dataset_id
-    dataset.update({dataset.AGGREGATED_DATASETS: a_datasets_dict})
+    # store a link to the new dataset, aggregations for other groups may be
+    # storing links concurrently
+    with AGGREGATED_DATASETS_LOCK:
+        group_str = dataset.join_groups(groups)
+        a_datasets_dict = dataset.reload().aggregated_datasets_dict
+        a_datasets_dict[group_str] = a_dataset.dataset_id
+        dataset.update({dataset.AGGREGATED_DATASETS: a_datasets_dict})
 
     return a_dataset
 
 
 class Aggregator(object):
-    """Perform a aggregations on datasets.
+    """Perform aggregations with the same groups on datasets.
 
-    Apply the `aggregation` to group columns by `groups` and the `columns`
-    of the `dframe`. Store the resulting `dframe` as a linked dataset for
-    `dataset`. If a linked dataset with the same groups already exists update
-    this dataset.  Otherwise create a new linked dataset.
+    Apply each aggregation in `aggregations` to group columns by `groups` and
+    the columns for that aggregation.  The results are joined on the groups
+    and stored as a linked dataset for `dataset` in one write.  If a linked
+    dataset with the same groups already exists update this dataset.
+    Otherwise create a new linked dataset.
     """
 
-    def __init__(self, dframe, groups, _type, name, columns):
+    def __init__(self, dframe, groups, aggregations):
         """Create an Aggregator.
 
-        :param columns: The columns to aggregate over.
         :param dframe: The DataFrame to aggregate.
         :param groups: A list of columns to group on.
-        :param _type: The aggregation to perform.
-        :param name: The name of the aggregation.
+        :param aggregations: A list of tuples with the aggregation to perform,
+            its name and the columns to aggregate over.
         """
-        self.columns = columns
         self.dframe = dframe
         self.groups = groups
-        self.name = name
-        aggregation = AGGREGATIONS.get(_type)
-        self.aggregation = aggregation(self.name, self.groups, self.dframe)
+        self.aggregations = [
+            (AGGREGATIONS.get(_type)(name, groups, dframe), columns)
+            for _type, name, columns in aggregations]
 
     def save(self, dataset):
-        """Save this aggregation.
+        """Save these aggregations.
 
-        If an aggregated dataset for this aggregations group already exists
+        If an aggregated dataset for these aggregations' groups already exists
         store in this dataset, if not create a new aggregated dataset and store
-        the aggregation in this new aggregated dataset.
+        the aggregations in this new aggregated dataset.
 
         """
-        new_dframe = self.aggregation.eval(self.columns)
+        new_dframe = self.__eval(self.aggregations)
         new_dframe = add_parent_column(new_dframe, dataset.dataset_id)
 
         a_dataset = dataset.aggregated_dataset(self.groups)
@@ -75,47 +105,88 @@ class Aggregator(object):
         if a_dataset is None:
             a_dataset = aggregated_dataset(dataset, new_dframe, self.groups)
         else:
-            a_dframe = a_dataset.dframe()
+            a_dframe = a_dataset.dframe(keep_state=True)
             new_dframe = group_join(self.groups, a_dframe, new_dframe)
             a_dataset.replace_observations(new_dframe)
 
         self.new_dframe = new_dframe
 
-    def update(self, dataset, child_dataset, formula, reducible):
-        """Attempt to reduce an update and store."""
+    def update(self, dataset, child_dataset, formulas, reducible):
+        """Attempt to reduce an update and store.
+
+        Aggregations which can merge new rows into their stored state are
+        reduced, the others are recalculated from the full dataset.  So are
+        aggregations stored without their state columns, e.g. before these
+        were added, which adds the state columns.
+        """
         parent_dataset_id = dataset.dataset_id
 
         # get dframe only including rows from this parent
         dframe = rows_for_parent_id(child_dataset.dframe(
-            keep_parent_ids=True, reload_=True), parent_dataset_id)
+            keep_parent_ids=True, reload_=True, keep_state=True),
+            parent_dataset_id)
 
         # remove rows in child from parent
         child_dataset.remove_parent_observations(parent_dataset_id)
 
-        if reducible and self.__is_reducible():
-            dframe = self.aggregation.reduce(dframe, self.columns)
-        else:
-            dframe = self.updated_dframe(dataset, formula, dframe)
+        recalculate = []
+
+        for (aggregation, columns), formula in zip(
+                self.aggregations, formulas):
+            if reducible and aggregation.reducible and\
+                    self.__has_state(aggregation, dframe):
+                dframe = aggregation.reduce(dframe, columns)
+            else:
+                recalculate.append((aggregation, formula))
+
+        if recalculate:
+            dframe = self.updated_dframe(dataset, recalculate, dframe)
 
-        new_a_dframe = concat([child_dataset.dframe(), dframe])
+        new_a_dframe = concat([child_dataset.dframe(keep_state=True), dframe])
         new_a_dframe = add_parent_column(new_a_dframe, parent_dataset_id)
         child_dataset.replace_observations(new_a_dframe)
 
         return child_dataset.dframe()
 
-    def updated_dframe(self, dataset, formula, dframe):
-        """Create a new aggregation and update return updated dframe."""
-        # build column arguments from original dframe
-        columns = parse_columns(dataset, formula, self.name, self.dframe)
-        new_dframe = self.aggregation.eval(columns)
+    def updated_dframe(self, dataset, aggregations, dframe):
+        """Recalculate aggregations and return the updated dframe.
+
+        :param aggregations: A list of tuples with an aggregation and its
+            formula.
+        :param dframe: The stored aggregations to update.
+        """
+        formulas = [formula for _, formula in aggregations]
+        names = [aggregation.name for aggregation, _ in aggregations]
+
+        # build column arguments from the full dframe
+        full_dframe = aggregation_dframe(dataset, formulas, self.groups)
+        columns = parse_batch_columns(dataset, formulas, names, full_dframe)
+        new_dframe = self.__eval([
+            (aggregation.__class__(aggregation.name, self.groups, full_dframe),
+             aggregation_columns)
+            for (aggregation, _), aggregation_columns in zip(
+                aggregations, columns)])
 
         new_columns = [x for x in new_dframe.columns if x not in self.groups]
 
-        dframe = dframe.drop(new_columns, axis=1)
+        dframe = dframe.drop(
+            [x for x in new_columns if x in dframe.columns], axis=1)
         dframe = group_join(self.groups, new_dframe, dframe)
 
         return dframe
 
-    def __is_reducible(self):
-        """If it is not grouped and a reduce is defined."""
-        return not self.groups and 'reduce' in dir(self.aggregation)
+    def __has_state(self, aggregation, dframe):
+        """Return True if `dframe` has the state columns of `aggregation`."""
+        return set(aggregation._state_columns()).issubset(dframe.columns)
+
+    def __eval(self, aggregations):
+        """Evaluate `aggregations` and join their results on the groups."""
+        results = [aggregation.eval(columns)
+                   for aggregation, columns in aggregations]
+
+        if not self.groups:
+            return concat(results, axis=1)
+
+        # groups without rows for an aggregation are missing from its result
+        return reduce(lambda left, right: left.merge(
+            right, on=self.groups, how='outer'), results)
@@ -3,22 +3,25 @@ from collections import defaultdict
 from celery.task import task
 from pandas import concat, DataFrame
 
-from bamboo.core.aggregator import Aggregator
+from bamboo.core.aggregator import aggregation_dframe, Aggregator
 from bamboo.core.frame import add_parent_column, join_dataset
 from bamboo.core.parser import Parser
+from bamboo.core.planner import CalculationPlan
+from bamboo.core.scheduler import calculation_pool, dependency_levels
 from bamboo.lib.datetools import recognize_dates
 from bamboo.lib.jsontools import df_to_jsondict
 from bamboo.lib.mongo import MONGO_ID
-from bamboo.lib.parsing import parse_columns
+from bamboo.lib.parsing import build_columns, parse_batch_columns
 from bamboo.lib.query_args import QueryArgs
-from bamboo.lib.utils import combine_dicts, flatten, to_list
+from bamboo.lib.utils import to_list
 
 
 def calculate_columns(dataset, calculations):
     """Calculate and store new columns for `calculations`.
 
-    The new columns are join t othe Calculation dframe and replace the
-    dataset's observations.
+    The calculations are run in levels ordered by their dependencies.  The
+    calculations in a level run concurrently and the new columns for a level
+    are joined to the Calculation dframe and stored in one update.
 
     .. note::
 
@@ -32,22 +35,10 @@ def calculate_columns(dataset, calculations):
     :param dataset: The dataset to calculate for.
     :param calculations: A list of calculations.
     """
-    new_cols = None
-
-    for c in calculations:
-        if c.aggregation:
-            aggregator = __create_aggregator(
-                dataset, c.formula, c.name, c.groups_as_list)
-            aggregator.save(dataset)
-        else:
-            columns = parse_columns(dataset, c.formula, c.name)
-            if new_cols is None:
-                new_cols = DataFrame(columns[0])
-            else:
-                new_cols = new_cols.join(columns[0])
-
-    if new_cols is not None:
-        dataset.update_observations(new_cols)
+    with calculation_pool() as pool:
+        for level in dependency_levels(dataset, calculations):
+            __calculate_level(dataset, level, pool)
+            dataset.reload()
 
     # propagate calculation to any merged child datasets
     [__propagate_column(x, dataset) for x in dataset.merged_datasets]
@@ -55,7 +46,8 @@ def calculate_columns(dataset, calculations):
 
 @task(default_retry_delay=5, ignore_result=True)
 def calculate_updates(dataset, new_data, new_dframe_raw=None,
-                      parent_dataset_id=None, update_id=None):
+                      parent_dataset_id=None, update_id=None,
+                      reducible=True):
     """Update dataset with `new_data`.
 
     This can result in race-conditions when:
@@ -69,6 +61,9 @@ def calculate_updates(dataset, new_data, new_dframe_raw=None,
     :param new_dframe_raw: DataFrame to update this dataset with.
     :param parent_dataset_id: If passed add ID as parent ID to column,
         default is None.
+    :param reducible: If False the new rows replace rows which were removed
+        from this dataset, so aggregations on it are recalculated instead of
+        reducing the new rows into them.  Default is True.
     """
     if not __update_is_valid(dataset, new_dframe_raw):
         dataset.remove_pending_update(update_id)
@@ -88,9 +83,9 @@ def calculate_updates(dataset, new_data, new_dframe_raw=None,
         new_dframe = add_parent_column(new_dframe, parent_dataset_id)
 
     dataset.append_observations(new_dframe)
-    dataset.clear_summary_stats()
 
-    propagate(dataset, new_dframe=new_dframe, update={'add': new_dframe_raw})
+    propagate(dataset, new_dframe=new_dframe, update={'add': new_dframe_raw},
+              reducible=reducible)
 
     dataset.update_complete(update_id)
 
@@ -139,9 +134,10 @@ def dframe_from_update(dataset, new_data):
 
 
 @task(default_retry_delay=5, ignore_result=True)
-def propagate(dataset, new_dframe=None, update=None):
+def propagate(dataset, new_dframe=None, update=None, reducible=True):
     """Propagate changes in a modified dataset."""
-    __update_aggregate_datasets(dataset, new_dframe, update=update)
+    __update_aggregate_datasets(dataset, new_dframe, update=update,
+                                reducible=reducible)
 
     if update:
         __update_merged_datasets(dataset, update)
@@ -150,10 +146,14 @@ def propagate(dataset, new_dframe=None, update=None):
 
 def __add_calculations(dataset, new_dframe):
     labels_to_slugs = dataset.schema.labels_to_slugs
-
-    for calculation in dataset.calculations(include_aggs=False):
-        function = Parser.parse_function(calculation.formula)
-        new_column = new_dframe.apply(function, axis=1, args=(dataset, ))
+    calculations = dataset.calculations(include_aggs=False)
+    plan = CalculationPlan(dataset, [c.formula for c in calculations],
+                           new_dframe.columns)
+    plan.evaluate_temporaries(new_dframe)
+
+    for calculation, functions in zip(calculations, plan.functions):
+        new_column = build_columns(dataset, new_dframe, functions,
+                                   calculation.name)[0]
         potential_name = calculation.name
 
         if potential_name not in dataset.dframe().columns:
@@ -167,13 +167,51 @@ def __add_calculations(dataset, new_dframe):
     return new_dframe
 
 
+def __calculate_level(dataset, calculations, pool):
+    """Run the independent `calculations` concurrently in `pool`.
+
+    Aggregations with the same groups update the same aggregated dataset and
+    are run together by one aggregator, which fetches their columns and
+    writes the aggregated dataset once.  Each aggregation unit loads its own
+    copy of the dataset, the main thread updates this instance's columns.
+    """
+    groups_to_aggregations = defaultdict(list)
+    column_calculations = []
+
+    for c in calculations:
+        if c.aggregation:
+            groups_to_aggregations[c.group].append(c)
+        else:
+            column_calculations.append(c)
+
+    results = [pool.apply_async(
+        __save_aggregations,
+        (dataset.find_one(dataset.dataset_id), aggregations))
+               for aggregations in groups_to_aggregations.values()]
+
+    if column_calculations:
+        columns = parse_batch_columns(
+            dataset, [c.formula for c in column_calculations],
+            [c.name for c in column_calculations], pool=pool)
+        new_cols = DataFrame(columns[0][0])
+
+        for new_columns in columns[1:]:
+            new_cols = new_cols.join(new_columns[0])
+
+        dataset.update_observations(new_cols)
+
+    # wait for the aggregations and raise any error
+    [result.get() for result in results]
+
+
 def __calculation_data(dataset):
     """Create a list of aggregate calculation information.
 
     Builds a list of calculation information from the current datasets
-    aggregated datasets and aggregate calculations.
+    aggregated datasets and aggregate calculations.  There is one entry for
+    each aggregated dataset with the formulas and names of its calculations.
     """
-    calcs_to_data = defaultdict(list)
+    calcs_to_data = []
 
     calculations = dataset.calculations(only_aggs=True)
     names_to_formulas = {c.name: c.formula for c in calculations}
@@ -181,15 +219,16 @@ def __calculation_data(dataset):
 
     for group, dataset in dataset.aggregated_datasets:
         labels_to_slugs = dataset.schema.labels_to_slugs
-        calculations_for_dataset = list(set(
+        calculations_for_dataset = sorted(set(
             labels_to_slugs.keys()).intersection(names))
 
-        for calc in calculations_for_dataset:
-            calcs_to_data[calc].append((
-                names_to_formulas[calc], labels_to_slugs[calc],  group,
-                dataset))
+        if calculations_for_dataset:
+            calcs_to_data.append((
+                [names_to_formulas[calc] for calc in calculations_for_dataset],
+                [labels_to_slugs[calc] for calc in calculations_for_dataset],
+                group, dataset))
 
-    return flatten(calcs_to_data.values())
+    return calcs_to_data
 
 
 def __update_is_valid(dataset, new_dframe):
@@ -216,22 +255,32 @@ def __update_is_valid(dataset, new_dframe):
     return True
 
 
-def __create_aggregator(dataset, formula, name, groups, dframe=None):
-    # TODO this should work with index eventually
-    columns = parse_columns(dataset, formula, name, dframe, no_index=True)
+def __create_aggregator(dataset, formulas, names, groups, dframe=None):
+    """Create an aggregator for `formulas` over `dataset` or new rows.
+
+    The columns for all of the formulas are fetched and built together.  If
+    `dframe` is passed it holds new rows and the aggregator only has the
+    rows' groups and columns.  The full dataset is fetched by the aggregator
+    if the new rows cannot be reduced into the stored aggregations.
+    """
+    if dframe is None:
+        dframe = aggregation_dframe(dataset, formulas, groups)
+        columns = parse_batch_columns(dataset, formulas, names, dframe)
+    else:
+        # keep the index of the new rows, it is their row in the dataset
+        columns = parse_batch_columns(dataset, formulas, names, dframe)
+        dframe = dframe.reindex(columns=groups)
 
-    dependent_columns = Parser.dependent_columns(formula, dataset)
-    aggregation = Parser.parse_aggregation(formula)
+    aggregations = [Parser.parse_aggregation(formula) for formula in formulas]
 
-    # get dframe with only the necessary columns
-    select = combine_dicts({group: 1 for group in groups},
-                           {col: 1 for col in dependent_columns})
+    return Aggregator(dframe, groups, zip(aggregations, names, columns))
 
-    # ensure at least one column (MONGO_ID) for the count aggregation
-    query_args = QueryArgs(select=select or {MONGO_ID: 1})
-    dframe = dataset.dframe(query_args=query_args, keep_mongo_keys=not select)
 
-    return Aggregator(dframe, groups, aggregation, name, columns)
+def __save_aggregations(dataset, calculations):
+    aggregator = __create_aggregator(
+        dataset, [c.formula for c in calculations],
+        [c.name for c in calculations], calculations[0].groups_as_list)
+    aggregator.save(dataset)
 
 
 def __ensure_ready(dataset, update_id):
@@ -309,37 +358,42 @@ def __slugify_data(new_data, labels_to_slugs):
     return slugified_data
 
 
-def __update_aggregate_datasets(dataset, new_dframe, update=None):
+def __update_aggregate_datasets(dataset, new_dframe, update=None,
+                                reducible=True):
     calcs_to_data = __calculation_data(dataset)
 
-    for formula, slug, groups, a_dataset in calcs_to_data:
-        __update_aggregate_dataset(dataset, formula, new_dframe, slug, groups,
-                                   a_dataset, update is None)
+    # only appended rows can be reduced into the stored aggregations
+    reducible = reducible and update is not None and 'add' in update
+
+    for formulas, slugs, groups, a_dataset in calcs_to_data:
+        __update_aggregate_dataset(dataset, formulas, new_dframe, slugs,
+                                   groups, a_dataset, reducible)
 
 
-def __update_aggregate_dataset(dataset, formula, new_dframe, name, groups,
+def __update_aggregate_dataset(dataset, formulas, new_dframe, names, groups,
                                a_dataset, reducible):
-    """Update the aggregated dataset built for `dataset` with `calculation`.
+    """Update the aggregated dataset built for `dataset` with `formulas`.
 
     Proceed with the following steps:
 
         - delete the rows in this dataset from the parent
-        - recalculate aggregated dataframe from aggregation
+        - recalculate aggregated dataframe from aggregations
         - update aggregated dataset with new dataframe and add parent id
         - recur on all merged datasets descending from the aggregated
           dataset
 
-    :param formula: The formula to execute.
+    :param formulas: The formulas to execute.
     :param new_dframe: The DataFrame to aggregate on.
-    :param name: The name of the aggregation.
+    :param names: The name of the aggregation for each formula.
     :param groups: A column or columns to group on.
     :type group: String, list of strings, or None.
-    :param a_dataset: The DataSet to store the aggregation in.
+    :param a_dataset: The DataSet to store the aggregations in.
     """
-    # parse aggregation and build column arguments
+    # parse aggregations and build column arguments
     aggregator = __create_aggregator(
-        dataset, formula, name, groups, dframe=new_dframe)
-    new_agg_dframe = aggregator.update(dataset, a_dataset, formula, reducible)
+        dataset, formulas, names, groups, dframe=new_dframe)
+    new_agg_dframe = aggregator.update(dataset, a_dataset, formulas,
+                                       reducible)
 
     # jsondict from new dframe
     new_data = df_to_jsondict(new_agg_dframe)
@@ -348,9 +402,11 @@ def __update_aggregate_dataset(dataset, formula, new_dframe, name, groups,
         # remove rows in child from this merged dataset
         merged_dataset.remove_parent_observations(a_dataset.dataset_id)
 
-        # calculate updates for the child
+        # calculate updates for the child, the rows replace the removed rows
+        # so they are not reduced into the child's aggregations
         calculate_updates(merged_dataset, new_data,
-                          parent_dataset_id=a_dataset.dataset_id)
+                          parent_dataset_id=a_dataset.dataset_id,
+                          reducible=False)
 
 
 def __update_joined_datasets(dataset, update):
@@ -1,4 +1,5 @@
 from cStringIO import StringIO
+from sys import getsizeof
 
 from pandas import Series
 
@@ -11,6 +12,12 @@ DATASET_ID = BAMBOO_RESERVED_KEY_PREFIX + 'dataset_id'
 INDEX = BAMBOO_RESERVED_KEY_PREFIX + 'index'
 PARENT_DATASET_ID = BAMBOO_RESERVED_KEY_PREFIX + 'parent_dataset_id'
 
+# the number of values to estimate the size of a column of objects from
+NBYTES_SAMPLE_SIZE = 100
+
+# prefix for internal columns holding the state of aggregations
+STATE_KEY_PREFIX = BAMBOO_RESERVED_KEY_PREFIX + 'state_'
+
 BAMBOO_RESERVED_KEYS = [
     DATASET_ID,
     INDEX,
@@ -42,6 +49,36 @@ def df_to_csv_string(df):
     return buffer.getvalue()
 
 
+def df_nbytes(df):
+    """Estimate the memory used by the values and index of a DataFrame.
+
+    Columns of objects count the size of the objects as well as the array of
+    references to them.  The size of the objects is estimated from an evenly
+    spaced sample of at most `NBYTES_SAMPLE_SIZE` of them.
+
+    :param df: The DataFrame to measure.
+
+    :returns: The estimated number of bytes.
+    """
+    nbytes = df.index.values.nbytes
+
+    for _, column in df.iteritems():
+        values = column.values
+        nbytes += values.nbytes
+
+        if values.dtype == object and len(values):
+            sample = values[::max(1, len(values) // NBYTES_SAMPLE_SIZE)]
+            nbytes += sum(getsizeof(value) for value in sample) * len(
+                values) // len(sample)
+
+    return nbytes
+
+
+def is_reserved_key(key):
+    """Return True if `key` is a reserved or an internal state column."""
+    return key in RESERVED_KEYS or key.startswith(STATE_KEY_PREFIX)
+
+
 def join_dataset(left, other, on):
     """Left join an `other` dataset.
 
@@ -80,14 +117,19 @@ def join_dataset(left, other, on):
     return left.join(right_dframe, on=on_lhs)
 
 
-def remove_reserved_keys(df, exclude=[]):
+def remove_reserved_keys(df, exclude=[], keep_state=False):
     """Remove reserved internal columns in this DataFrame.
 
-    :param keep_parent_ids: Keep parent column if True, default False.
+    :param exclude: A list of reserved columns to keep.
+    :param keep_state: Keep internal state columns if True, default False.
     """
     reserved_keys = __column_intersect(
         df, BAMBOO_RESERVED_KEYS).difference(set(exclude))
 
+    if not keep_state:
+        reserved_keys.update(
+            [c for c in df.columns if c.startswith(STATE_KEY_PREFIX)])
+
     return df.drop(reserved_keys, axis=1)
 
 
@@ -1,13 +1,13 @@
 # future must be first
 from __future__ import division
+from copy import copy
 import operator
 
 import numpy as np
-from scipy.stats import percentileofscore
+from pandas import Series
 
 from bamboo.lib.datetools import now, parse_date_to_unix_time,\
-    parse_str_to_unix_time, safe_parse_date_to_unix_time
-from bamboo.lib.query_args import QueryArgs
+    parse_str_to_unix_time, safe_parse_date_to_unix_time, series_to_unix_time
 from bamboo.lib.utils import parse_float
 
 
@@ -20,6 +20,75 @@ def extract_binary_children(parent):
     return children
 
 
+def copy_with(term, **attributes):
+    """Return a shallow copy of `term` with `attributes` replaced."""
+    term = copy(term)
+    term.__dict__.update(attributes)
+
+    return term
+
+
+def is_term(token):
+    return isinstance(token, (EvalTerm, EvalFunction))
+
+
+def map_terms(tokens, fn):
+    """Apply `fn` to the terms in `tokens`, leaving operators as they are."""
+    return [fn(token) if is_term(token) else token for token in tokens]
+
+
+def term_key(token):
+    """Return a hashable key for a term, operator or list of tokens."""
+    if is_term(token):
+        return token.key()
+
+    if isinstance(token, basestring):
+        return token
+
+    if hasattr(token, '__iter__'):
+        return tuple(term_key(t) for t in token)
+
+    return token
+
+
+def constant_column(value, dframe):
+    """Return a column repeating `value` for every row in `dframe`."""
+    return Series([value] * len(dframe), index=dframe.index)
+
+
+def percentile_of_scores(sorted_values, num_rows, scores):
+    """Return the percentile rank of each of `scores` in a column.
+
+    This matches ``scipy.stats.percentileofscore`` with ``kind='rank'`` but
+    finds the ranks of all scores with a binary search over the column.
+
+    :param sorted_values: The sorted non-null values of the column.
+    :param num_rows: The number of rows in the column, including nulls.
+    :param scores: The scores to rank.
+
+    :returns: An array of percentile ranks.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    left = np.searchsorted(sorted_values, scores, side='left')
+    right = np.searchsorted(sorted_values, scores, side='right')
+
+    # null scores compare false against every value
+    nulls = np.isnan(scores)
+    left[nulls] = 0
+    right[nulls] = 0
+
+    return (left + right + (right > left)) * 50.0 / num_rows
+
+
+def row_wise_column(term, dframe, dataset):
+    """Evaluate `term` one row at a time.
+
+    This is the fallback for terms that do not have a column-wise
+    implementation.
+    """
+    return dframe.apply(term.eval, axis=1, args=(dataset,))
+
+
 class EvalTerm(object):
     """Base class for evaluation."""
 
@@ -40,6 +109,24 @@ class EvalTerm(object):
     def operation(self, oper, result, val):
         return self.operations[oper](result, val)
 
+    def column(self, dframe, dataset):
+        """Evaluate this term for every row in `dframe` at once.
+
+        :param dframe: The DataFrame to evaluate this term over.
+        :param dataset: The dataset the DataFrame belongs to.
+
+        :returns: A Series with the same index as `dframe`.
+        """
+        return row_wise_column(self, dframe, dataset)
+
+    def key(self):
+        """Return a key that is equal for structurally equal terms."""
+        return (self.__class__.__name__, term_key(self.value))
+
+    def map_children(self, fn):
+        """Return a copy of this term with `fn` applied to its children."""
+        return self
+
     def get_children(self):
         return []
 
@@ -71,6 +158,21 @@ class EvalConstant(EvalTerm):
     def field(self, row):
         return row.get(self.value)
 
+    def column(self, dframe, dataset):
+        value = parse_float(self.value)
+        if value is not None:
+            return constant_column(value, dframe)
+
+        if self.value not in dframe.columns:
+            return constant_column(None, dframe)
+
+        column = dframe[self.value]
+
+        if dataset and dataset.schema.is_date_simpletype(self.value):
+            column = series_to_unix_time(column)
+
+        return column
+
     def dependent_columns(self, dataset):
         value = parse_float(self.value)
         if value is not None:
@@ -86,6 +188,33 @@ class EvalString(EvalTerm):
     def eval(self, row, dataset):
         return self.value
 
+    def column(self, dframe, dataset):
+        return constant_column(self.value, dframe)
+
+
+class EvalValue(EvalString):
+    """Class for a value computed before evaluation, e.g. a folded constant.
+    """
+    pass
+
+
+class EvalReference(EvalTerm):
+    """Class to evaluate a reference to a precomputed column.
+
+    The column is looked up by name in `values`, which must be filled before
+    the referencing term is evaluated.
+    """
+
+    def __init__(self, name, values):
+        self.value = name
+        self.values = values
+
+    def eval(self, row, dataset):
+        return self.values[self.value][row.name]
+
+    def column(self, dframe, dataset):
+        return self.values[self.value]
+
 
 class EvalSignOp(EvalTerm):
     """Class to evaluate expressions with a leading + or - sign."""
@@ -97,6 +226,16 @@ class EvalSignOp(EvalTerm):
         mult = {'+': 1, '-': -1}[self.sign]
         return mult * self.value.eval(row, dataset)
 
+    def column(self, dframe, dataset):
+        mult = {'+': 1, '-': -1}[self.sign]
+        return mult * self.value.column(dframe, dataset)
+
+    def key(self):
+        return (self.__class__.__name__, self.sign, self.value.key())
+
+    def map_children(self, fn):
+        return copy_with(self, value=fn(self.value))
+
     def get_children(self):
         return [self.value]
 
@@ -123,6 +262,23 @@ class EvalBinaryArithOp(EvalTerm):
 
         return result
 
+    def column(self, dframe, dataset):
+        result = self.value[0].column(dframe, dataset).astype(np.float64)
+        infinite = np.zeros(len(result), dtype=bool)
+
+        for oper, val in self.operator_operands(self.value[1:]):
+            val = val.column(dframe, dataset).astype(np.float64)
+            result = self.operation(oper, result, val)
+            infinite |= np.isinf(result.values)
+
+        # an infinite intermediate value makes the row NaN, as in `eval`
+        result[infinite] = np.nan
+
+        return result
+
+    def map_children(self, fn):
+        return copy_with(self, value=map_terms(self.value, fn))
+
     def get_children(self):
         return extract_binary_children(self)
 
@@ -171,6 +327,21 @@ class EvalComparisonOp(EvalTerm):
 
         return False
 
+    def column(self, dframe, dataset):
+        val1 = self.value[0].column(dframe, dataset).astype(np.float64)
+        result = constant_column(True, dframe)
+
+        for oper, val in self.operator_operands(self.value[1:]):
+            fn = EvalComparisonOp.op_map[oper]
+            val2 = val.column(dframe, dataset).astype(np.float64)
+            result &= fn(val1, val2)
+            val1 = val2
+
+        return result
+
+    def map_children(self, fn):
+        return copy_with(self, value=map_terms(self.value, fn))
+
     def get_children(self):
         return extract_binary_children(self)
 
@@ -184,6 +355,12 @@ class EvalNotOp(EvalTerm):
     def eval(self, row, dataset):
         return not self.value.eval(row, dataset)
 
+    def column(self, dframe, dataset):
+        return ~self.value.column(dframe, dataset).astype(bool)
+
+    def map_children(self, fn):
+        return copy_with(self, value=fn(self.value))
+
     def get_children(self):
         return [self.value]
 
@@ -196,6 +373,11 @@ class EvalBinaryBooleanOp(EvalTerm):
         'or': lambda p, q: p or q,
     }
 
+    column_operations = {
+        'and': operator.__and__,
+        'or': operator.__or__,
+    }
+
     def eval(self, row, dataset):
         result = np.bool_(self.value[0].eval(row, dataset))
 
@@ -205,6 +387,18 @@ class EvalBinaryBooleanOp(EvalTerm):
 
         return result
 
+    def column(self, dframe, dataset):
+        result = self.value[0].column(dframe, dataset).astype(bool)
+
+        for oper, val in self.operator_operands(self.value[1:]):
+            val = val.column(dframe, dataset).astype(bool)
+            result = self.column_operations[oper](result, val)
+
+        return result
+
+    def map_children(self, fn):
+        return copy_with(self, value=map_terms(self.value, fn))
+
     def get_children(self):
         return extract_binary_children(self)
 
@@ -231,6 +425,15 @@ class EvalInOp(EvalTerm):
 
         return val_to_test in val_list
 
+    def column(self, dframe, dataset):
+        column = self.value[0].column(dframe, dataset).map(str)
+        val_list = [val.eval(None, dataset) for val in self.value[1:]]
+
+        return column.isin(val_list)
+
+    def map_children(self, fn):
+        return copy_with(self, value=map_terms(self.value, fn))
+
     def get_children(self):
         return self.value
 
@@ -246,6 +449,22 @@ class EvalCaseOp(EvalTerm):
 
         return np.nan
 
+    def column(self, dframe, dataset):
+        result = constant_column(np.nan, dframe)
+        undecided = constant_column(True, dframe)
+
+        for token in self.value:
+            case_result = token.column(dframe, dataset)
+            decided = undecided & case_result.astype(bool)
+
+            result = case_result.where(decided, result)
+            undecided &= ~decided
+
+        return result
+
+    def map_children(self, fn):
+        return copy_with(self, value=map_terms(self.value, fn))
+
     def get_children(self):
         return self.value
 
@@ -259,6 +478,25 @@ class EvalMapOp(EvalTerm):
 
         return False
 
+    def column(self, dframe, dataset):
+        value = self.tokens[1].column(dframe, dataset)
+
+        if self.tokens[0] == 'default':
+            return value
+
+        condition = self.tokens[0].column(dframe, dataset).astype(bool)
+
+        return value.where(condition, False)
+
+    def key(self):
+        return (self.__class__.__name__, term_key(self.tokens[0]),
+                term_key(self.tokens[1]))
+
+    def map_children(self, fn):
+        tokens = map_terms(self.tokens[:2], fn)
+
+        return copy_with(self, tokens=tokens, value=tokens[0])
+
     def get_children(self):
         # special "default" key returns the next token (value)
         if self.tokens[0] == 'default':
@@ -274,6 +512,15 @@ class EvalFunction(object):
     def __init__(self, tokens):
         self.value = tokens[0][1]
 
+    def column(self, dframe, dataset):
+        return row_wise_column(self, dframe, dataset)
+
+    def key(self):
+        return (self.__class__.__name__, self.value.key())
+
+    def map_children(self, fn):
+        return copy_with(self, value=fn(self.value))
+
     def get_children(self):
         return [self.value]
 
@@ -288,6 +535,9 @@ class EvalDate(EvalFunction):
         # parse date from string
         return parse_str_to_unix_time(self.value.eval(row, dataset))
 
+    def column(self, dframe, dataset):
+        return constant_column(self.eval(None, dataset), dframe)
+
 
 class EvalToday(EvalTerm):
     """Class to produce te current date time."""
@@ -295,17 +545,28 @@ class EvalToday(EvalTerm):
     def eval(self, row, dataset):
         return parse_date_to_unix_time(now())
 
+    def column(self, dframe, dataset):
+        return constant_column(self.eval(None, dataset), dframe)
+
 
 class EvalPercentile(EvalFunction):
     """Class to evaluate percentile expressions."""
 
     def eval(self, row, dataset):
-        # parse date from string
-        col = self.value.value
-        query_args = QueryArgs(select={col: 1})
-        column = dataset.dframe(query_args=query_args)[col]
-        field = self.value.field(row)
-        return percentileofscore(column, field)
+        sorted_values, num_rows = dataset.sorted_column(self.value.value)
+
+        return percentile_of_scores(
+            sorted_values, num_rows, [self.value.field(row)])[0]
+
+    def column(self, dframe, dataset):
+        sorted_values, num_rows = dataset.sorted_column(self.value.value)
+        scores = self.value.column(dframe, dataset)
+
+        return Series(percentile_of_scores(sorted_values, num_rows, scores),
+                      index=dframe.index)
+
+    def map_children(self, fn):
+        return self
 
     def get_children(self):
         return []
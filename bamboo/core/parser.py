@@ -9,6 +9,11 @@ from bamboo.core.operations import EvalAndOp, EvalCaseOp, EvalComparisonOp,\
     EvalConstant, EvalExpOp, EvalDate, EvalInOp, EvalMapOp, EvalMultOp,\
     EvalNotOp, EvalOrOp, EvalPercentile, EvalPlusOp, EvalSignOp, EvalString,\
     EvalToday
+from bamboo.lib.cache import LRUCache
+
+
+# maximum number of parsed formulas to keep per process
+PARSE_CACHE_SIZE = 1024
 
 
 def build_caseless_or_expression(strings):
@@ -43,27 +48,26 @@ class ParseError(Exception):
 class Parser(object):
     """Class for parsing and evaluating formula.
 
+    The grammar is built once per process and shared by all parses.  Parsed
+    formulas are kept in a bounded LRU cache, keyed by the formula string.
+
     Attributes:
 
-    - aggregation: Aggregation parsed from formula.
     - aggregation_names: Possible aggregations.
-    - bnf: Cached Backus-Naur Form of formula.
-    - column_functions: Cached additional columns as aggregation parameters.
+    - bnf: Cached Backus-Naur Form of formula, shared by all instances.
     - function_names: Names of possible functions in formulas.
     - operator_names: Names of possible operators in formulas.
-    - parsed_expr: Cached parsed expression.
+    - parse_cache: Cache of formulas to parsed functions and aggregation.
     - special_names: Names of possible reserved names in formulas.
     - reserved_words: List of all possible reserved words that may be used in
       formulas.
     """
 
-    aggregation = None
     aggregation_names = AGGREGATIONS.keys()
     bnf = None
-    column_functions = None
     function_names = ['date', 'percentile', 'today']
     operator_names = ['and', 'or', 'not', 'in']
-    parsed_expr = None
+    parse_cache = LRUCache(PARSE_CACHE_SIZE)
     special_names = ['default']
 
     reserved_words = aggregation_names + function_names + operator_names +\
@@ -72,6 +76,11 @@ class Parser(object):
     def __init__(self):
         self.bnf = self.__build_bnf()
 
+    @classmethod
+    def cache_info(cls):
+        """Return hit and miss counters for the parsed formula cache."""
+        return cls.parse_cache.info
+
     @classmethod
     def dependent_columns(cls, formula, dataset):
         functions, _ = cls.parse(formula)
@@ -79,16 +88,8 @@ class Parser(object):
 
         return set.union(set(), *columns)
 
-    @property
-    def functions(self):
-        return self.column_functions if self.aggregation else self.parsed_expr
-
-    def store_aggregation(self, _, __, tokens):
-        """Cached a parsed aggregation."""
-        self.aggregation = tokens[0]
-        self.column_functions = tokens[1:]
-
-    def __build_bnf(self):
+    @classmethod
+    def __build_bnf(cls):
         """Parse formula to function based on language definition.
 
         Backus-Naur Form of formula language:
@@ -123,8 +124,8 @@ class Parser(object):
         =========   ==========
 
         """
-        if self.bnf:
-            return self.bnf
+        if cls.bnf:
+            return cls.bnf
 
         # literal operators
         exp_op = Literal('^')
@@ -139,7 +140,7 @@ class Parser(object):
         case_op = CaselessLiteral('case').suppress()
 
         # aggregation functions
-        aggregations = build_caseless_or_expression(self.aggregation_names)
+        aggregations = build_caseless_or_expression(cls.aggregation_names)
 
         # literal syntactic
         open_bracket = Literal('[').suppress()
@@ -159,7 +160,7 @@ class Parser(object):
         default = CaselessLiteral('default')
 
         reserved_words = MatchFirst(
-            [Keyword(word) for word in self.reserved_words])
+            [Keyword(word) for word in cls.reserved_words])
 
         # atoms
         integer = Word(nums)
@@ -212,11 +213,12 @@ class Parser(object):
             (percentile_func, 1, opAssoc.RIGHT, EvalPercentile),
         ])
 
-        return ((aggregations + open_paren + Optional(
-            trans_expr + ZeroOrMore(comma + trans_expr)))
-            .setParseAction(self.store_aggregation) + close_paren)\
+        cls.bnf = (aggregations + open_paren + Optional(
+            trans_expr + ZeroOrMore(comma + trans_expr)) + close_paren)\
             | trans_expr
 
+        return cls.bnf
+
     @classmethod
     def parse(cls, formula):
         """Parse formula and return evaluation function.
@@ -277,15 +279,34 @@ class Parser(object):
         :returns: A tuple with the name of the aggregation in the formula, if
            any and a list of functions built from the input string.
         """
-        parser = cls()
+        parsed = cls.parse_cache.get(formula)
+
+        if parsed is None:
+            parsed = cls.parse_cache.set(formula, cls.__parse(formula))
 
+        functions, aggregation = parsed
+
+        return [list(functions), aggregation]
+
+    @classmethod
+    def __parse(cls, formula):
+        """Parse `formula` with the shared grammar.
+
+        An aggregation is parsed to its name followed by the functions for
+        its arguments, anything else is parsed to a single function.
+
+        :returns: A tuple of the parsed functions and the aggregation name.
+        """
         try:
-            parser.parsed_expr = parser.bnf.parseString(formula, parseAll=True)
+            parsed_expr = cls.__build_bnf().parseString(formula, parseAll=True)
         except ParseException, err:
             raise ParseError('Parse Failure for string "%s": %s' % (
                              formula, err))
 
-        return [parser.functions, parser.aggregation]
+        if isinstance(parsed_expr[0], basestring):
+            return tuple(parsed_expr[1:]), parsed_expr[0]
+
+        return tuple(parsed_expr), None
 
     @classmethod
     def parse_aggregation(cls, formula):
@@ -349,18 +370,15 @@ class Parser(object):
     def __getstate__(self):
         """Get state for pickle."""
         return [
-            self.aggregation,
             self.aggregation_names,
             self.function_names,
             self.operator_names,
             self.special_names,
             self.reserved_words,
-            self.special_names,
         ]
 
     def __setstate__(self, state):
         """Set internal variables from pickled state."""
-        self.aggregation, self.aggregation_names, self.function_names,\
-            self.operator_names, self.special_names, self.reserved_words,\
-            self.special_names = state
-        self.__build_bnf()
+        self.aggregation_names, self.function_names, self.operator_names,\
+            self.special_names, self.reserved_words = state
+        self.bnf = self.__build_bnf()
@@ -0,0 +1,146 @@
+from collections import defaultdict
+
+from bamboo.core.frame import BAMBOO_RESERVED_KEY_PREFIX
+from bamboo.core.operations import EvalConstant, EvalReference, EvalString,\
+    EvalValue
+from bamboo.core.parser import get_dependent_columns, Parser
+
+
+TEMPORARY_PREFIX = BAMBOO_RESERVED_KEY_PREFIX + 'tmp_'
+
+
+def is_constant(term, dataset):
+    return isinstance(term, EvalString) or (
+        isinstance(term, EvalConstant) and not term.dependent_columns(dataset))
+
+
+def fold_constants(term, dataset):
+    """Replace the subterms of `term` that do not depend on any column.
+
+    Each constant subterm is evaluated once and replaced by its value.  The
+    parsed term is not modified, changed terms are copied.
+
+    :param term: The term to fold.
+    :param dataset: The dataset the term will be evaluated for.
+
+    :returns: The folded term.
+    """
+    term = term.map_children(lambda child: fold_constants(child, dataset))
+
+    if is_constant(term, dataset) or term.dependent_columns(dataset) or any(
+            not is_constant(c, dataset) for c in term.get_children()):
+        return term
+
+    return EvalValue([term.eval(None, dataset)])
+
+
+class CalculationPlan(object):
+    """Plan the evaluation of a batch of formulas.
+
+    Constant subterms are folded, and subterms which occur more than once
+    across the batch are evaluated once as temporary columns.  Only subterms
+    that depend solely on `columns` are shared, so a formula may depend on
+    the results of formulas earlier in the batch.
+
+    Attributes:
+
+    - functions: The planned functions for each formula, in order.
+    - temporaries: A list of temporary names and terms, in the order they
+      must be evaluated.
+    """
+
+    def __init__(self, dataset, formulas, columns):
+        """Plan `formulas` for `dataset`.
+
+        :param dataset: The dataset to evaluate the formulas for.
+        :param formulas: A list of formulas.
+        :param columns: The columns available before any formula is
+            evaluated.
+        """
+        self.dataset = dataset
+        self.values = {}
+        self.__available = set(columns)
+        self.__temporaries = []
+
+        self.functions = [
+            [fold_constants(f, dataset) for f in Parser.parse(formula)[0]]
+            for formula in formulas]
+
+        self.__share_subterms()
+
+    @property
+    def temporaries(self):
+        # a temporary only refers to temporaries created after it
+        return list(reversed(self.__temporaries))
+
+    def evaluate_temporaries(self, dframe):
+        """Evaluate the temporary columns for the rows in `dframe`.
+
+        This must be called before the planned functions are evaluated over
+        `dframe`.
+        """
+        self.values.clear()
+
+        for name, term in self.temporaries:
+            self.values[name] = term.column(dframe, self.dataset)
+
+    def __count(self, term, counts, sizes, terms):
+        size = 1 + sum([self.__count(child, counts, sizes, terms)
+                        for child in term.get_children()])
+
+        if self.__is_shareable(term):
+            key = term.key()
+            counts[key] += 1
+            sizes[key] = size
+            terms[key] = term
+
+        return size
+
+    def __is_shareable(self, term):
+        if isinstance(term, (EvalConstant, EvalReference, EvalString)):
+            return False
+
+        return set(get_dependent_columns(term, self.dataset)).issubset(
+            self.__available)
+
+    def __share_subterms(self):
+        """Replace shared subterms with references to temporaries.
+
+        Repeatedly take the largest subterm that occurs more than once and
+        replace it everywhere.  Recounting after each replacement ensures
+        that subterms of a shared term are only shared if they also occur
+        outside of it.
+        """
+        while True:
+            counts = defaultdict(int)
+            sizes = {}
+            terms = {}
+
+            for term in self.__terms():
+                self.__count(term, counts, sizes, terms)
+
+            shared = [key for key, count in counts.iteritems() if count > 1]
+
+            if not shared:
+                break
+
+            key = max(shared, key=lambda k: (sizes[k], k))
+            name = '%s%d' % (TEMPORARY_PREFIX, len(self.__temporaries))
+            reference = EvalReference(name, self.values)
+
+            def replace(term):
+                if term.key() == key:
+                    return reference
+
+                return term.map_children(replace)
+
+            self.__temporaries = [(n, t.map_children(replace)) for n, t in
+                                  self.__temporaries]
+            self.__temporaries.append((name, terms[key].map_children(replace)))
+            self.__available.add(name)
+            self.functions = [[replace(f) for f in functions]
+                              for functions in self.functions]
+
+    def __terms(self):
+        return [t for _, t in self.__temporaries] + [
+            f for functions in self.functions for f in functions]
@@ -0,0 +1,56 @@
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+from bamboo.config.settings import CALCULATION_POOL_SIZE
+from bamboo.core.parser import Parser
+
+
+def dependency_levels(dataset, calculations):
+    """Group `calculations` into levels that can be calculated concurrently.
+
+    A calculation depends on the calculations in `calculations` whose names
+    are referenced in its formula.  Every calculation is placed in a level
+    after all of the calculations it depends on, so the calculations within
+    a level are independent of each other.
+
+    :param dataset: The dataset the calculations are for.
+    :param calculations: A list of calculations.
+
+    :returns: A list of levels, each a list of calculations.
+    """
+    names = set([c.name for c in calculations])
+    remaining = [(c, names.intersection(
+        Parser.dependent_columns(c.formula, dataset)) - set([c.name]))
+        for c in calculations]
+    calculated = set()
+    levels = []
+
+    while remaining:
+        level = [c for c, dependencies in remaining
+                 if dependencies.issubset(calculated)]
+
+        if not level:
+            # the dependencies are cyclic, calculate the rest together
+            level = [c for c, _ in remaining]
+
+        levels.append(level)
+        calculated.update([c.name for c in level])
+        remaining = [(c, d) for c, d in remaining if not c in level]
+
+    return levels
+
+
+@contextmanager
+def calculation_pool(size=CALCULATION_POOL_SIZE):
+    """Yield a pool of threads to run independent calculations with.
+
+    Threads are used rather than processes because celery workers are
+    daemonic processes and may not start child processes.
+    """
+    pool = ThreadPool(size)
+
+    try:
+        yield pool
+    finally:
+        pool.close()
+        pool.join()
@@ -1,11 +1,32 @@
+from math import sqrt
+
+import numpy as np
+from pandas import DataFrame, Series
+
+from bamboo.core.aggregations import merge_moments
+from bamboo.core.frame import STATE_KEY_PREFIX
 from bamboo.lib.jsontools import series_to_jsondict
 from bamboo.lib.mongo import dict_from_mongo, dict_for_mongo
+from bamboo.lib.query_args import QueryArgs
+from bamboo.lib.sketches import QuantileSketch
 from bamboo.lib.utils import combine_dicts
 
 
 MAX_CARDINALITY_FOR_COUNT = 10000
 SUMMARY = 'summary'
 
+# keys of the mergeable summary state of a column
+COUNT = 'count'
+COUNTS = 'counts'
+M2 = 'm2'
+MAX = 'max'
+MEAN = 'mean'
+MIN = 'min'
+SKETCH = 'sketch'
+
+# the statistics in the summary of a measure, as from ``Series.describe``
+DESCRIBE_INDEX = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+
 
 class ColumnTypeError(Exception):
     """Exception when grouping on a non-dimensional column."""
@@ -34,6 +55,9 @@ def summarizable(dframe, col, groups, dataset):
     :returns: True if column, with parameters should be summarized, otherwise
         False.
     """
+    if col.startswith(STATE_KEY_PREFIX):
+        return False
+
     if dataset.is_dimension(col):
         cardinality = dframe[col].nunique() if len(groups) else\
             dataset.cardinality(col)
@@ -54,6 +78,168 @@ def summarize_df(dframe, dataset, groups=[]):
     }
 
 
+def column_state(is_dimension, data):
+    """Return the mergeable summary state of a column.
+
+    The state of a dimension is the count of each value.  The state of a
+    numeric measure is its count, mean, sum of squared deviations from the
+    mean (M2), minimum, maximum and a quantile sketch.  Other columns have no
+    state.
+
+    :param is_dimension: True if the column is a dimension.
+    :param data: The column to build the state for.
+
+    :returns: A dict of the state or None.
+    """
+    if is_dimension:
+        return {COUNTS: series_to_jsondict(data.value_counts())}
+
+    if data.dtype.kind == 'M':
+        return None
+
+    try:
+        values = data.dropna().values.astype(float)
+    except (TypeError, ValueError):
+        return None
+
+    mean = float(values.mean()) if len(values) else 0.0
+
+    return {
+        COUNT: len(values),
+        MEAN: mean,
+        M2: float(((values - mean) ** 2).sum()),
+        MIN: float(values.min()) if len(values) else None,
+        MAX: float(values.max()) if len(values) else None,
+        SKETCH: QuantileSketch.from_values(values).to_json(),
+    }
+
+
+def state_cardinality(state):
+    """Return the number of distinct values in a dimension's state."""
+    return len(state[COUNTS]) if COUNTS in state else None
+
+
+def state_count(state):
+    """Return the number of non-null values in a column's state."""
+    return sum(state[COUNTS].values()) if COUNTS in state else state[COUNT]
+
+
+def summary_from_state(state):
+    """Return the summary of a column from its summary state."""
+    if COUNTS in state:
+        return state[COUNTS]
+
+    count = state[COUNT]
+    sketch = QuantileSketch.from_json(state[SKETCH])
+    mean = state[MEAN] if count else np.nan
+    std = sqrt(state[M2] / (count - 1)) if count > 1 else np.nan
+
+    return series_to_jsondict(Series([
+        float(count), mean, std,
+        state[MIN] if count else np.nan,
+        sketch.quantile(0.25), sketch.quantile(0.5), sketch.quantile(0.75),
+        state[MAX] if count else np.nan,
+    ], index=DESCRIBE_INDEX))
+
+
+def update_column_state(state, is_dimension, data, retract=False):
+    """Fold the values in `data` into a summary state, or retract them.
+
+    :param state: The summary state of the column.
+    :param is_dimension: True if the column is a dimension.
+    :param data: The values to fold in or retract.
+    :param retract: Retract the values, default False.
+
+    :returns: The updated state, or None if it can not be updated.
+    """
+    other = column_state(is_dimension, data)
+
+    if other is None or (COUNTS in state) != (COUNTS in other):
+        return None
+
+    # states stored with sums of squares before are summarized again
+    if COUNTS not in state and M2 not in state:
+        return None
+
+    sign = -1 if retract else 1
+
+    if COUNTS in state:
+        counts = state[COUNTS]
+
+        for value, count in other[COUNTS].items():
+            counts[value] = counts.get(value, 0) + sign * count
+
+            if counts[value] < 0:
+                return None
+            elif not counts[value]:
+                del counts[value]
+
+        return state
+
+    if not other[COUNT]:
+        return state
+
+    sketch = QuantileSketch.from_json(state[SKETCH])
+
+    if retract:
+        values = data.dropna().values.astype(float)
+
+        if not sketch.remove(values) or values.min() < state[MIN] or\
+                values.max() > state[MAX]:
+            return None
+
+        # the extremes are known if they are centroids of single values
+        if values.min() == state[MIN]:
+            if len(sketch.weights) and sketch.weights[0] != 1:
+                return None
+
+            state[MIN] = float(sketch.means[0]) if len(sketch.means) else\
+                None
+
+        if values.max() == state[MAX]:
+            if len(sketch.weights) and sketch.weights[-1] != 1:
+                return None
+
+            state[MAX] = float(sketch.means[-1]) if len(sketch.means) else\
+                None
+    else:
+        sketch.merge(QuantileSketch.from_json(other[SKETCH]))
+        state[MIN] = min(other[MIN], state[MIN]) if state[COUNT] else\
+            other[MIN]
+        state[MAX] = max(other[MAX], state[MAX]) if state[COUNT] else\
+            other[MAX]
+
+    state.update(__merge_moments(state, other, sign))
+    state[SKETCH] = sketch.to_json()
+
+    return state
+
+
+def summarize_with_state(dframe, dataset):
+    """Summarize the columns of `dframe` and build their summary state.
+
+    :returns: A tuple of the summaries and the summary states of columns.
+    """
+    summaries = {}
+    states = {}
+
+    for col, data in dframe.iteritems():
+        if summarizable(dframe, col, [], dataset):
+            is_dimension = dataset.is_dimension(col)
+            state = column_state(is_dimension, data)
+
+            if state is None:
+                summary = series_to_jsondict(
+                    summarize_series(is_dimension, data))
+            else:
+                states[col] = state
+                summary = summary_from_state(state)
+
+            summaries[col] = {SUMMARY: summary}
+
+    return summaries, states
+
+
 def summarize_with_groups(dframe, groups, dataset):
     """Calculate summary statistics for group."""
     return series_to_jsondict(
@@ -73,17 +259,23 @@ def summarize(dataset, dframe, groups, no_cache, update=False):
     stats = dataset.stats
     group_stats = stats.get(group_str)
 
-    if no_cache or not group_stats or update:
+    if no_cache:
         group_stats = summarize_with_groups(dframe, groups, dataset) if\
             groups else summarize_df(dframe, dataset)
+    elif groups and (not group_stats or update):
+        if dframe is None:
+            dframe = dataset.dframe()
 
-        if not no_cache:
-            if update:
-                original_group_stats = stats.get(group_str, {})
-                group_stats = combine_dicts(original_group_stats, group_stats)
+        group_stats = summarize_with_groups(dframe, groups, dataset)
 
-            stats.update({group_str: group_stats})
-            dataset.update({dataset.STATS: dict_for_mongo(stats)})
+        if update:
+            original_group_stats = stats.get(group_str, {})
+            group_stats = combine_dicts(original_group_stats, group_stats)
+
+        stats.update({group_str: group_stats})
+        dataset.update({dataset.STATS: dict_for_mongo(stats)})
+    elif not groups:
+        group_stats = __summarize_all(dataset, dframe, update)
 
     stats_dict = dict_from_mongo(group_stats)
 
@@ -91,3 +283,117 @@ def summarize(dataset, dframe, groups, no_cache, update=False):
         stats_dict = {group_str: stats_dict}
 
     return stats_dict
+
+
+def update_summary(dataset, dframe, retract=False):
+    """Fold rows into the summary of all rows of `dataset`, or retract them.
+
+    Grouped summaries are removed, they can not be updated from the rows and
+    are summarized again when next requested.  Columns whose summary state
+    can not be updated are removed from the summary and summarized again when
+    next requested.
+
+    :param dataset: The dataset to update the summary of.
+    :param dframe: The rows to fold in or retract.
+    :param retract: Retract the rows, default False.
+    """
+    stats = dict_from_mongo(dataset.stats)
+    summaries = stats.get(dataset.ALL, {})
+    columns = [col for col in summaries.keys() if col in dframe.columns]
+    states = dataset.summary_states(columns) if columns else {}
+    dropped = []
+
+    for col in columns:
+        state = states.get(col)
+
+        if state is not None and summarizable(dframe, col, [], dataset):
+            state = update_column_state(
+                state, dataset.is_dimension(col), dframe[col], retract)
+
+        if state is None:
+            del summaries[col]
+            states.pop(col, None)
+            dropped.append(col)
+        else:
+            states[col] = state
+            summaries[col] = {SUMMARY: summary_from_state(state)}
+
+    dataset.set_summary_states(states, dropped)
+    dataset.update({dataset.STATS: dict_for_mongo({dataset.ALL: summaries})})
+
+
+def __merge_moments(state, other, sign):
+    """Return the count, mean and M2 of `state` with those of `other` merged.
+
+    The moments are retracted if `sign` is -1, by merging them with a negated
+    count and M2, which inverts the update of `merge_moments`.
+    """
+    count = state[COUNT] + sign * other[COUNT]
+
+    if not count:
+        return {COUNT: 0, MEAN: 0.0, M2: 0.0}
+
+    def moments(state, sign=1):
+        return DataFrame([{
+            'count': sign * state[COUNT],
+            'mean_x': state[MEAN],
+            'm2_x': sign * state[M2],
+        }])
+
+    merged = merge_moments(moments(state), moments(other, sign), ['x'])
+
+    return {
+        COUNT: count,
+        MEAN: float(merged['mean_x'][0]),
+        # rounding may leave M2 just below zero after values are retracted
+        M2: max(float(merged['m2_x'][0]), 0.0),
+    }
+
+
+def __summarize_all(dataset, dframe, update):
+    """Return the summary of all rows, building it for missing columns.
+
+    Columns are missing from the stored summary if it has not been built or
+    if their summary state could not be updated.  If `dframe` is None the
+    missing columns are read from the dataset.
+    """
+    stats = dict_from_mongo(dataset.stats)
+    summaries = stats.get(dataset.ALL, {})
+    schema = dataset.schema
+
+    if dframe is not None:
+        # rows which have not been saved yet are named by label
+        labels_to_slugs = {
+            column[dataset.LABEL]: slug for slug, column in schema.items()}
+        dframe = dframe.rename(columns={
+            col: labels_to_slugs[col] for col in dframe.columns
+            if col not in schema and col in labels_to_slugs})
+
+    if update or (dframe is not None and not summaries):
+        columns = dframe.columns.tolist()
+    else:
+        columns = [col for col in schema.keys() if col not in summaries and
+                   summarizable(None, col, [], dataset)]
+
+        if dframe is not None:
+            columns = [col for col in columns if col in dframe.columns]
+
+    if columns:
+        if dframe is None:
+            dframe = dataset.dframe(
+                QueryArgs(select={col: 1 for col in columns}))
+            columns = [col for col in columns if col in dframe.columns]
+
+        new_summaries, new_states = summarize_with_state(
+            dframe[columns], dataset)
+        summaries.update(new_summaries)
+
+        dataset.set_summary_states(new_states, [
+            col for col in columns if col not in new_states])
+
+        # summary states were stored with the summaries before
+        stats.pop(dataset.STATS_STATE, None)
+        stats.update({dataset.ALL: summaries})
+        dataset.update({dataset.STATS: dict_for_mongo(stats)})
+
+    return summaries
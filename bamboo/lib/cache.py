@@ -0,0 +1,107 @@
+from collections import OrderedDict
+from threading import RLock
+
+
+class LRUCache(object):
+    """A bounded, thread-safe, least recently used cache.
+
+    If `weigh` is passed the cache is also bounded by the total weight of its
+    values, e.g. their size in memory.
+
+    Attributes:
+
+    - hits: The number of lookups that found a cached value.
+    - max_size: The maximum number of entries to keep.
+    - max_weight: The maximum total weight of the entries to keep.
+    - misses: The number of lookups that did not find a cached value.
+    - weight: The total weight of the entries.
+    """
+
+    def __init__(self, max_size, max_weight=None, weigh=None):
+        """Create an LRUCache.
+
+        :param max_size: The maximum number of entries to keep.
+        :param max_weight: The maximum total weight of the entries to keep,
+            default None.
+        :param weigh: A function returning the weight of a value, default
+            None.
+        """
+        self.max_size = max_size
+        self.max_weight = max_weight
+        self.hits = 0
+        self.misses = 0
+        self.weight = 0
+        self.__weigh = weigh
+        self.__entries = OrderedDict()
+        self.__lock = RLock()
+
+    def __contains__(self, key):
+        return key in self.__entries
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @property
+    def info(self):
+        """Return the hit and miss counters and the size of the cache."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'max_size': self.max_size,
+            'max_weight': self.max_weight,
+            'size': len(self),
+            'weight': self.weight,
+        }
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.hits = self.misses = self.weight = 0
+
+    def get(self, key, default=None):
+        """Return the value for `key` and mark it as recently used."""
+        with self.__lock:
+            try:
+                entry = self.__entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self.__entries[key] = entry
+            self.hits += 1
+
+            return entry[0]
+
+    def pop(self, key, default=None):
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+
+            if entry is None:
+                return default
+
+            self.weight -= entry[1]
+
+            return entry[0]
+
+    def set(self, key, value):
+        """Store `value` for `key`, evicting least recently used entries.
+
+        A value heavier than the maximum weight is not stored.
+        """
+        weight = self.__weigh(value) if self.__weigh else 0
+
+        with self.__lock:
+            self.pop(key)
+
+            if self.max_weight is not None and weight > self.max_weight:
+                return value
+
+            self.__entries[key] = (value, weight)
+            self.weight += weight
+
+            while len(self.__entries) > self.max_size or (
+                    self.max_weight is not None and
+                    self.weight > self.max_weight):
+                self.weight -= self.__entries.popitem(last=False)[1][1]
+
+        return value
@@ -3,10 +3,27 @@ from datetime import datetime
 
 from dateutil.parser import parse as date_parse
 import numpy as np
+from pandas import isnull, Series, to_datetime
 
 from bamboo.lib.utils import is_float_nan
 
 
+# the number of distinct values of a column to parse before parsing the rest
+DATE_SAMPLE_SIZE = 100
+
+# formats tried on the sampled values before falling back to dateutil
+DATE_FORMATS = [
+    '%Y-%m-%d',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%m/%d/%Y',
+    '%m/%d/%Y %H:%M:%S',
+    '%d%b%Y',
+]
+
+
 def __parse_dates(dframe):
     for i, dtype in enumerate(dframe.dtypes):
         if dtype.type == np.object_:
@@ -28,12 +45,24 @@ def __parse_dates_schema(dframe, schema):
     """
     dframe_columns = dframe.columns.tolist()
 
-    for column, column_schema in schema.items():
-        if column in dframe_columns and schema.is_date_simpletype(column):
-            new_column = _convert_column_to_date(dframe, column)
+    return parse_date_columns(dframe, [
+        column for column in schema.keys()
+        if column in dframe_columns and schema.is_date_simpletype(column)])
 
-            if not new_column is None:
-                dframe[column] = new_column
+
+def parse_date_columns(dframe, columns):
+    """Convert `columns` of `dframe` to datetimes if they parse as dates.
+
+    :param dframe: The DataFrame to convert columns in.
+    :param columns: The columns to convert.
+
+    :returns: A DataFrame with column values convert to datetime types.
+    """
+    for column in columns:
+        new_column = _convert_column_to_date(dframe, column)
+
+        if not new_column is None:
+            dframe[column] = new_column
 
     return dframe
 
@@ -60,13 +89,84 @@ def _is_potential_date(value):
 
 
 def _convert_column_to_date(dframe, column):
-    """Inline conversion of column in dframe to date type."""
+    """Inline conversion of column in dframe to date type.
+
+    A sample of the distinct values of the column is parsed first, so that a
+    column which is not a date is rejected without parsing the rest of it.
+    If one of `DATE_FORMATS` parses every sampled value to the same date the
+    other values are converted together with it, and only values that do not
+    match it are parsed one by one.  Each distinct value is parsed once and
+    the column is mapped to the parsed dates.
+    """
+    series = dframe[column]
+
     try:
-        return dframe[column].apply(parse_date)
-    except (AttributeError, OverflowError, ValueError):
+        values = [value for value in series.unique()
+                  if _is_potential_date(value)]
+
+        if not values:
+            return
+
+        step = max(1, len(values) / DATE_SAMPLE_SIZE)
+        dates = {value: parse_date(value)
+                 for value in values[::step][:DATE_SAMPLE_SIZE]}
+        date_format = _infer_date_format(dates)
+        values = [value for value in values if value not in dates]
+
+        if date_format:
+            dates.update(_parse_dates_with_format(values, date_format))
+        else:
+            dates.update({value: parse_date(value) for value in values})
+    except (AttributeError, OverflowError, TypeError, ValueError):
         # It is already a datetime, a number that is too large to be a date, or
         # not a correctly formatted date.
-        pass
+        return
+
+    return series.map(lambda value: dates.get(value, value))
+
+
+def _infer_date_format(dates):
+    """Return a format which parses each key of `dates` to its value.
+
+    :param dates: A dict of strings to the dates they were parsed to.
+
+    :returns: A format from `DATE_FORMATS` or None.
+    """
+    for date_format in DATE_FORMATS:
+        try:
+            if all([datetime.strptime(value, date_format) == date
+                    for value, date in dates.iteritems()]):
+                return date_format
+        except ValueError:
+            pass
+
+
+def _parse_dates_with_format(values, date_format):
+    """Parse `values` with `date_format`.
+
+    The values are converted together, if any of them does not match the
+    format they are split in halves so that only the values which do not
+    match are parsed one by one.
+
+    :param values: A list of strings to parse.
+    :param date_format: The format to parse the strings with.
+
+    :returns: A list of tuples of each value and its date.
+    """
+    if not values:
+        return []
+
+    try:
+        return zip(values, to_datetime(values, errors='raise',
+                                       format=date_format))
+    except (TypeError, ValueError):
+        if len(values) == 1:
+            return [(values[0], parse_date(values[0]))]
+
+    middle = len(values) / 2
+
+    return _parse_dates_with_format(values[:middle], date_format) +\
+        _parse_dates_with_format(values[middle:], date_format)
 
 
 def now():
@@ -105,3 +205,26 @@ def safe_parse_date_to_unix_time(date):
         date = parse_date_to_unix_time(date)
 
     return date
+
+
+def series_to_unix_time(series):
+    """Convert a column of dates to seconds since the epoch.
+
+    Columns with a datetime64 dtype are converted without boxing each value,
+    other columns are converted value by value.
+
+    :param series: The Series to convert.
+
+    :returns: A Series of unix times, with NaN for missing dates.
+    """
+    if series.dtype.type != np.datetime64:
+        return series.map(safe_parse_date_to_unix_time)
+
+    missing = isnull(series)
+    seconds = series.values.view(np.int64) // 10 ** 9
+
+    if missing.any():
+        seconds = seconds.astype(np.float64)
+        seconds[missing.values] = np.nan
+
+    return Series(seconds, index=series.index, name=series.name)
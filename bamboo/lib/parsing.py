@@ -1,4 +1,7 @@
+from pandas import Series
+
 from bamboo.core.parser import Parser
+from bamboo.core.planner import CalculationPlan
 from bamboo.lib.mongo import MONGO_ID, MONGO_ID_ENCODED
 from bamboo.lib.query_args import QueryArgs
 from bamboo.lib.schema_builder import make_unique
@@ -7,38 +10,58 @@ from bamboo.lib.schema_builder import make_unique
 def parse_columns(dataset, formula, name, dframe=None, no_index=False):
     """Parse a formula and return columns resulting from its functions.
 
-    Parse a formula into a list of functions then apply those functions to
-    the Data Frame and return the resulting columns.
+    Parse a formula into a list of functions then evaluate those functions
+    column-wise over the Data Frame and return the resulting columns.
 
     :param formula: The formula to parse.
     :param name: Name of the formula.
     :param dframe: A DataFrame to apply functions to.
     :param no_index: Drop the index on result columns.
     """
-    functions = Parser.parse_functions(formula)
-    dependent_columns = Parser.dependent_columns(formula, dataset)
+    functions, _ = Parser.parse(formula)
 
-    # make select from dependent_columns
     if dframe is None:
-        select = {col: 1 for col in dependent_columns or [MONGO_ID]}
+        dframe = __fetch_dframe(
+            dataset, Parser.dependent_columns(formula, dataset))
+
+    return build_columns(dataset, dframe, functions, name, no_index)
+
+
+def parse_batch_columns(dataset, formulas, names, dframe=None, pool=None):
+    """Parse a batch of formulas and return the columns for each of them.
 
-        dframe = dataset.dframe(
-            query_args=QueryArgs(select=select),
-            keep_mongo_keys=True).set_index(MONGO_ID_ENCODED)
+    The formulas are evaluated together following a `CalculationPlan`, which
+    folds constants and evaluates subexpressions shared by the formulas once.
 
-        if not dependent_columns:
-            # constant column, use dummy
-            dframe['dummy'] = 0
+    :param formulas: The formulas to parse.
+    :param names: The name for each formula.
+    :param dframe: A DataFrame to apply functions to.
+    :param pool: An optional pool to evaluate the formulas concurrently in.
+
+    :returns: A list with the list of columns for each formula.
+    """
+    if dframe is None:
+        dependent_columns = set.union(set(), *[
+            Parser.dependent_columns(formula, dataset)
+            for formula in formulas])
+        dframe = __fetch_dframe(dataset, dependent_columns)
 
-    return __build_columns(dataset, dframe, functions, name, no_index)
+    plan = CalculationPlan(dataset, formulas, dframe.columns)
+    plan.evaluate_temporaries(dframe)
 
+    def build(args):
+        functions, name = args
+        return build_columns(dataset, dframe, functions, name)
 
-def __build_columns(dataset, dframe, functions, name, no_index):
+    return (pool.map if pool else map)(build, zip(plan.functions, names))
+
+
+def build_columns(dataset, dframe, functions, name, no_index=False):
     columns = []
 
     for function in functions:
-        column = dframe.apply(function, axis=1, args=(dataset,))
-        column.name = make_unique(name, [c.name for c in columns])
+        column = Series(function.column(dframe, dataset),
+                        name=make_unique(name, [c.name for c in columns]))
 
         if no_index:
             column = column.reset_index(drop=True)
@@ -46,3 +69,18 @@ def __build_columns(dataset, dframe, functions, name, no_index):
         columns.append(column)
 
     return columns
+
+
+def __fetch_dframe(dataset, dependent_columns):
+    # make select from dependent_columns
+    select = {col: 1 for col in dependent_columns or [MONGO_ID]}
+
+    dframe = dataset.dframe(
+        query_args=QueryArgs(select=select),
+        keep_mongo_keys=True).set_index(MONGO_ID_ENCODED)
+
+    if not dependent_columns:
+        # constant column, use dummy
+        dframe['dummy'] = 0
+
+    return dframe
@@ -1,17 +1,28 @@
+import codecs
+from cStringIO import StringIO
+from datetime import datetime
 from functools import partial
+from itertools import chain, islice
 import simplejson as json
 import os
+import shutil
 import tempfile
 
 from celery.exceptions import RetryTaskError
 from celery.task import task
+import numpy as np
 import pandas as pd
 
+from bamboo.config.settings import IMPORT_CHUNK_SIZE, IMPORT_RANGE_SIZE
 from bamboo.lib.async import call_async
-from bamboo.lib.datetools import recognize_dates
+from bamboo.lib.datetools import parse_date_columns, recognize_dates
 from bamboo.lib.schema_builder import filter_schema
 
 
+# bytes of a JSON file to read at a time when importing it
+JSON_BLOCK_SIZE = 1024 ** 2
+
+
 @task(ignore_result=True)
 def import_dataset(dataset, file_reader, delete=False):
     """For reading a URL and saving the corresponding dataset.
@@ -20,13 +31,20 @@ def import_dataset(dataset, file_reader, delete=False):
     exceptions are caught and on exception the dataset is marked as failed and
     set for deletion after 24 hours.
 
+    If `file_reader` returns an iterator of DataFrames they are saved as
+    they are read.
+
     :param dataset: The dataset to import into.
     :param file_reader: Function for reading the dataset.
     :param delete: Delete filepath_or_buffer after import, default False.
     """
     try:
         dframe = file_reader()
-        dataset.save_observations(dframe)
+
+        if isinstance(dframe, pd.DataFrame):
+            dataset.save_observations(dframe)
+        else:
+            dataset.save_observation_chunks(dframe)
     except Exception as e:
         if isinstance(e, RetryTaskError):
             raise e
@@ -35,6 +53,115 @@ def import_dataset(dataset, file_reader, delete=False):
             dataset.delete(countdown=86400)
 
 
+@task(ignore_result=True)
+def import_csv_ranges(dataset, name, na_values=[],
+                      range_size=IMPORT_RANGE_SIZE):
+    """Import a CSV file in parallel, saving a range of its lines per task.
+
+    The file is split into ranges of lines of about `range_size` bytes.  The
+    first range is saved to build the schema and encoding, then an
+    `import_csv_range` task is started for each other range, which other
+    worker processes may run.  A file with a single range is imported by
+    `import_dataset`.
+
+    Every worker must be able to read the file at `name` and each row must be
+    on a single line.  The file is deleted when the last range is saved.
+
+    :param dataset: The dataset to import into.
+    :param name: The path of the CSV file.
+    :param na_values: A list of values to read as missing data.
+    :param range_size: The number of bytes of lines in each range.
+    """
+    try:
+        header, ranges = csv_byte_ranges(name, range_size)
+
+        if len(ranges) < 2:
+            return import_dataset(dataset, partial(
+                csv_file_reader, name, na_values=na_values, delete=True))
+
+        dframe = recognize_dates(
+            _read_csv_range(name, header, ranges[0], na_values))
+        date_columns = _date_columns(dframe)
+        dataset.start_range_import(
+            dframe, len(ranges), sum([r[-1] for r in ranges]))
+    except Exception as e:
+        os.unlink(name)
+        dataset.failed(e.__str__())
+        dataset.delete(countdown=86400)
+        return
+
+    for byte_range in ranges[1:]:
+        call_async(import_csv_range, dataset, name, header, byte_range,
+                   date_columns, na_values)
+
+
+@task(ignore_result=True)
+def import_csv_range(dataset, name, header, byte_range, date_columns,
+                     na_values=[]):
+    """Save a range of lines of a CSV file imported by `import_csv_ranges`.
+
+    If the range can not be saved the dataset is marked as failed.  The last
+    range to finish deletes the file, and sets a failed dataset for deletion
+    after 24 hours.
+    """
+    sketches = None
+
+    try:
+        dframe = parse_date_columns(
+            _read_csv_range(name, header, byte_range, na_values),
+            date_columns)
+        sketches = dataset.save_range(dframe)
+    except Exception as e:
+        dataset.failed(e.__str__())
+
+    if dataset.finish_range_import(sketches):
+        os.unlink(name)
+
+        if dataset.state == dataset.STATE_FAILED:
+            dataset.delete(countdown=86400)
+
+
+def csv_byte_ranges(name, range_size=IMPORT_RANGE_SIZE):
+    """Split the lines of a CSV file into ranges of about `range_size` bytes.
+
+    Each range starts at the beginning of a line and ends after a line.  The
+    rows are counted as the non-blank lines, so that each range can be given
+    the indices of its rows before it is read.
+
+    :param name: The path of the CSV file.
+    :param range_size: The number of bytes after which to end a range.
+
+    :returns: A tuple of the header line and a list of ranges, each a tuple
+        of its start and end offsets, the index of its first row and its
+        number of rows.
+    """
+    ranges = []
+    num_rows = 0
+
+    with open(name, 'rb') as f:
+        header = f.readline()
+        start = f.tell()
+        range_rows = 0
+
+        while True:
+            line = f.readline()
+
+            if line.strip():
+                range_rows += 1
+
+            end = f.tell()
+
+            if range_rows and (not line or end - start >= range_size):
+                ranges.append((start, end, num_rows, range_rows))
+                num_rows += range_rows
+                start, range_rows = end, 0
+
+            if not line:
+                break
+
+    return header, ranges
+
+
 def csv_file_reader(name, na_values=[], delete=False):
     try:
         return recognize_dates(
@@ -44,16 +171,229 @@ def csv_file_reader(name, na_values=[], delete=False):
             os.unlink(name)
 
 
-def json_file_reader(content):
-    return recognize_dates(pd.DataFrame(json.loads(content)))
+def csv_chunk_reader(name, na_values=[], delete=False,
+                     chunksize=IMPORT_CHUNK_SIZE):
+    """Read a CSV file as DataFrames of at most `chunksize` rows.
+
+    Dates are recognized in the first chunk and the same columns are
+    converted to dates in the following chunks.
+    """
+    try:
+        reader = pd.read_csv(name, encoding='utf-8', na_values=na_values,
+                             chunksize=chunksize)
+
+        for dframe in _recognize_chunk_dates(reader):
+            yield dframe
+    finally:
+        if delete:
+            os.unlink(name)
+
+
+def json_chunk_reader(name, delete=False, chunksize=IMPORT_CHUNK_SIZE):
+    """Read a JSON file as DataFrames of at most `chunksize` records.
+
+    The file holds a JSON array of records or one record per line.  Records
+    are decoded as the file is read, see `json_records`.  Dates are
+    recognized as by `csv_chunk_reader`.
+    """
+    def chunks(f):
+        records = []
+
+        for record in json_records(f):
+            records.append(record)
+
+            if len(records) == chunksize:
+                yield pd.DataFrame(records)
+                records = []
+
+        if records:
+            yield pd.DataFrame(records)
+
+    try:
+        with open(name, 'rb') as f:
+            for dframe in _recognize_chunk_dates(chunks(f)):
+                yield dframe
+    finally:
+        if delete:
+            os.unlink(name)
+
+
+def json_records(f, block_size=JSON_BLOCK_SIZE):
+    """Yield the records of a JSON array or of newline delimited JSON.
+
+    The UTF-8 file `f` is read about `block_size` bytes at a time, and each
+    record is decoded once the block holding its end has been read.  A record
+    longer than a block is retried with reads as long as the text buffered.
+
+    A file holding a single object whose values are all arrays or all objects
+    holds its records by column, as read by `pandas.DataFrame`.  Its records
+    are yielded once the file is read.
+
+    :param f: The file to read records from.
+    :param block_size: The number of bytes to read at a time.
+
+    :raises: `ValueError` if the file is not valid JSON, or if a record is
+        not an object.
+    """
+    values = _json_values(f, block_size)
+    head = list(islice(values, 1))
+
+    if head and not head[0][0] and _is_column_object(head[0][1]):
+        head.extend(islice(values, 1))
+
+        if len(head) == 1:
+            head = [(False, record) for record in
+                    _column_records(head[0][1])]
+
+    for _, record in chain(head, values):
+        if not isinstance(record, dict):
+            raise ValueError('JSON records must be objects, not: %s' %
+                             json.dumps(record)[:100])
+
+        yield record
+
+
+def _column_records(columns):
+    """Return the records of an object of columns.
+
+    The values of the columns are arrays of the values of each record, or
+    objects of the values of records by their index.
+    """
+    if all(isinstance(values, list) for values in columns.values()):
+        if len(set([len(values) for values in columns.values()])) > 1:
+            raise ValueError('JSON columns must all be the same length')
+
+        return [dict(zip(columns.keys(), row))
+                for row in zip(*columns.values())]
+
+    if not all(isinstance(values, dict) for values in columns.values()):
+        raise ValueError('JSON columns must all be arrays or all be objects')
+
+    index = sorted(set(chain(*[values.keys() for values in
+                               columns.values()])))
+
+    return [{column: values[key] for column, values in columns.items()
+             if key in values} for key in index]
+
+
+def _is_column_object(value):
+    return isinstance(value, dict) and all(
+        isinstance(values, (list, dict)) for values in value.values())
+
+
+def _json_values(f, block_size):
+    """Yield each value of a JSON array or of newline delimited JSON.
+
+    :returns: Tuples of True if the values are in an array and a value.
+    """
+    decoder = json.JSONDecoder()
+    reader = codecs.getreader('utf-8')(f)
+    text, position = u'', 0
+    is_array = None
+    eof = False
+
+    while True:
+        # skip whitespace, and the commas and closing bracket of an array
+        while position < len(text) and (text[position].isspace() or (
+                is_array and text[position] in u',]')):
+            position += 1
+
+        if position == len(text):
+            if eof:
+                return
+
+            text, position = reader.read(block_size), 0
+            eof = not text
+
+            continue
+
+        if is_array is None:
+            is_array = text[position] == u'['
+
+            if is_array:
+                position += 1
+
+            continue
+
+        try:
+            record, end = decoder.raw_decode(text, position)
+        except ValueError:
+            if eof:
+                raise
+
+            end = len(text)
+
+        # a value ending with the text read may continue in the next block
+        if end == len(text) and not eof:
+            block = reader.read(max(block_size, len(text) - position))
+            eof = not block
+            text, position = text[position:] + block, 0
+
+            continue
+
+        yield is_array, record
+        position = end
+
+
+def _recognize_chunk_dates(dframes):
+    """Recognize dates in the first DataFrame and convert the same columns to
+    dates in the others."""
+    date_columns = None
+
+    for dframe in dframes:
+        if date_columns is None:
+            dframe = recognize_dates(dframe)
+            date_columns = _date_columns(dframe)
+        else:
+            dframe = parse_date_columns(dframe, date_columns)
+
+        yield dframe
+
+
+def _is_date_column(column):
+    return column.dtype.type == np.datetime64 or (
+        column.dtype.type == np.object_ and
+        any(isinstance(value, datetime) for value in column))
+
+
+def _read_csv_range(name, header, byte_range, na_values):
+    """Read a range from `csv_byte_ranges` with the header of its file."""
+    start, end, first_index, num_rows = byte_range
+
+    with open(name, 'rb') as f:
+        f.seek(start)
+        content = f.read(end - start)
+
+    dframe = pd.read_csv(StringIO(header + content), encoding='utf-8',
+                         na_values=na_values)
+
+    if len(dframe) != num_rows:
+        raise ValueError('rows of the file span multiple lines')
+
+    dframe.index = range(first_index, first_index + num_rows)
+
+    return dframe
+
+
+def _date_columns(dframe):
+    return [column for column in dframe.columns
+            if _is_date_column(dframe[column])]
+
+
+def _csv_reader(chunksize):
+    return partial(csv_chunk_reader, chunksize=chunksize) if chunksize else\
+        csv_file_reader
 
 
 class ImportableDataset(object):
-    def import_from_url(self, url, na_values=[], allow_local_file=False):
+    def import_from_url(self, url, na_values=[], allow_local_file=False,
+                        chunksize=None):
         """Load a URL, read from a CSV, add data to dataset.
 
         :param url: URL to load file from.
         :param allow_local_file: Allow URL to refer to a local file.
+        :param chunksize: If given, stream the CSV in chunks of this many
+            rows, default None.
 
         :raises: `IOError` for an unreadable file or a bad URL.
 
@@ -65,11 +405,12 @@ class ImportableDataset(object):
 
         call_async(
             import_dataset, self, partial(
-                csv_file_reader, url, na_values=na_values))
+                _csv_reader(chunksize), url, na_values=na_values))
 
         return self
 
-    def import_from_csv(self, csv_file, na_values=[]):
+    def import_from_csv(self, csv_file, na_values=[], chunksize=None,
+                        parallel=False):
         """Import data from a CSV file.
 
         .. note::
@@ -78,6 +419,10 @@ class ImportableDataset(object):
             `read_csv` function.
 
         :param csv_file: The CSV File to create a dataset from.
+        :param chunksize: If given, stream the CSV in chunks of this many
+            rows, default None.
+        :param parallel: If True, import ranges of the CSV in parallel tasks,
+            default False.
 
         :returns: The created dataset.
         """
@@ -85,23 +430,36 @@ class ImportableDataset(object):
             csv_file = csv_file.file
 
         tmpfile = tempfile.NamedTemporaryFile(delete=False)
-        tmpfile.write(csv_file.read())
+        shutil.copyfileobj(csv_file, tmpfile)
 
         # pandas needs a closed file for *read_csv*
         tmpfile.close()
 
-        call_async(import_dataset, self, partial(
-            csv_file_reader, tmpfile.name, na_values=na_values, delete=True))
+        if parallel:
+            call_async(import_csv_ranges, self, tmpfile.name,
+                       na_values=na_values)
+        else:
+            call_async(import_dataset, self, partial(
+                _csv_reader(chunksize), tmpfile.name, na_values=na_values,
+                delete=True))
 
         return self
 
     def import_from_json(self, json_file):
         """Impor data from a JSON file.
 
-        :param json_file: JSON file to import.
+        The upload is copied to a tempfile, which is read a chunk of records
+        at a time.
+
+        :param json_file: JSON file of an array of records, or of one record
+            per line, to import.
         """
-        content = json_file.file.read()
-        call_async(import_dataset, self, partial(json_file_reader, content))
+        tmpfile = tempfile.NamedTemporaryFile(delete=False)
+        shutil.copyfileobj(json_file.file, tmpfile)
+        tmpfile.close()
+
+        call_async(import_dataset, self, partial(
+            json_chunk_reader, tmpfile.name, delete=True))
 
         return self
 
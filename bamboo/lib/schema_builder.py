@@ -2,10 +2,11 @@ from datetime import datetime
 import numpy as np
 import re
 
-from bamboo.core.frame import RESERVED_KEYS
+from bamboo.core.frame import is_reserved_key
 from bamboo.core.parser import Parser
 from bamboo.lib.exceptions import ArgumentError
 from bamboo.lib.mongo import reserve_encoded
+from bamboo.lib.sketches import CardinalitySketch
 
 
 CARDINALITY = 'cardinality'
@@ -50,6 +51,9 @@ SIMPLETYPE_TO_OLAP_TYPE = {
 
 RE_ENCODED_COLUMN = re.compile(ur'(?u)\W')
 
+# the number of values of an object column to check for dates
+SCHEMA_SAMPLE_SIZE = 1000
+
 
 class Schema(dict):
     @classmethod
@@ -99,15 +103,17 @@ class Schema(dict):
 
         return col_schema and col_schema[OLAP_TYPE] == DIMENSION
 
-    def rebuild(self, dframe, overwrite=False):
+    def rebuild(self, dframe, overwrite=False, sketches=None):
         """Rebuild a schema for a dframe.
 
         :param dframe: The DataFrame whose schema to merge with the current
             schema.
         :param overwrite: If true replace schema, otherwise update.
+        :param sketches: If passed, a dict to store the cardinality sketches
+            of the columns of `dframe` in.
         """
         current_schema = self
-        new_schema = schema_from_dframe(dframe, self)
+        new_schema = schema_from_dframe(dframe, self, sketches)
 
         if current_schema and not overwrite:
             # merge new schema with existing schema
@@ -162,11 +168,19 @@ class Schema(dict):
                     labels_to_slugs[column] not in dframe.columns)))
 
 
-def schema_from_dframe(dframe, schema=None):
+def schema_from_dframe(dframe, schema=None, sketches=None):
     """Build schema from the DataFrame and a schema.
 
+    The types of a column are found from its dtype, and for object columns
+    from a sample of its values.  If `sketches` is passed the cardinality of
+    a column is counted with a `CardinalitySketch`, which is exact for
+    columns with few distinct values and approximate for the others,
+    otherwise the distinct values are counted exactly.
+
     :param dframe: The DataFrame to build a schema for.
     :param schema: Existing schema, optional.
+    :param sketches: If passed, a dict to store the cardinality sketch of
+        each column in by its slug.
 
     :returns: A dictionary schema.
     """
@@ -177,7 +191,7 @@ def schema_from_dframe(dframe, schema=None):
 
     # use existing labels for existing columns
     for name in dtypes.keys():
-        if name not in RESERVED_KEYS:
+        if not is_reserved_key(name):
             column_names.append(name)
             if schema:
                 schema_for_name = schema.get(name)
@@ -189,23 +203,24 @@ def schema_from_dframe(dframe, schema=None):
     schema = Schema()
 
     for (name, dtype) in dtypes.items():
-        if name not in RESERVED_KEYS:
+        if not is_reserved_key(name):
+            column = dframe[name]
+            type_ = _type_for_data_and_dtype(column, dtype)
             column_schema = {
                 LABEL: names_to_labels.get(name, name),
-                OLAP_TYPE: _olap_type_for_data_and_dtype(
-                    dframe[name], dtype),
-                SIMPLETYPE: _simpletype_for_data_and_dtype(
-                    dframe[name], dtype),
+                OLAP_TYPE: DTYPE_TO_OLAP_TYPE[type_],
+                SIMPLETYPE: DTYPE_TO_SIMPLETYPE[type_],
             }
 
             try:
-                column_schema[CARDINALITY] = dframe[
-                    name].nunique()
-            except AttributeError:
-                pass
-            except TypeError:
-                # E.g. dates with and without offset can not be compared and
-                # raise a type error.
+                if sketches is None:
+                    column_schema[CARDINALITY] = column.nunique()
+                else:
+                    sketch = CardinalitySketch.from_values(column.values)
+                    column_schema[CARDINALITY] = sketch.cardinality
+                    sketches[encoded_names[name]] = sketch
+            except (AttributeError, TypeError):
+                # E.g. unhashable values can not be counted.
                 pass
 
             schema[encoded_names[name]] = column_schema
@@ -257,17 +272,22 @@ def filter_schema(schema):
     return schema
 
 
-def _olap_type_for_data_and_dtype(column, dtype):
-    return _type_for_data_and_dtypes(
-        DTYPE_TO_OLAP_TYPE, column, dtype.type)
+def _type_for_data_and_dtype(column, dtype):
+    """Return the key to find the types of `column` with in the type maps.
 
+    Only object columns may hold dates of another dtype, so only their values
+    are checked, and then only a sample of at most `SCHEMA_SAMPLE_SIZE`
+    non-null values.
+    """
+    if dtype.type == np.datetime64:
+        return datetime
 
-def _simpletype_for_data_and_dtype(column, dtype):
-    return _type_for_data_and_dtypes(
-        DTYPE_TO_SIMPLETYPE, column, dtype.type)
-
+    if dtype.type == np.object_:
+        values = column.dropna().values
+        step = max(1, len(values) / SCHEMA_SAMPLE_SIZE)
 
-def _type_for_data_and_dtypes(type_map, column, dtype_type):
-    has_datetime = any([isinstance(field, datetime) for field in column])
+        if any([isinstance(value, datetime) for value in
+                values[::step][:SCHEMA_SAMPLE_SIZE]]):
+            return datetime
 
-    return type_map[datetime if has_datetime else dtype_type]
+    return dtype.type
@@ -0,0 +1,379 @@
+from base64 import b64decode, b64encode
+from math import log, pi
+
+import numpy as np
+from pandas import Series
+import simplejson as json
+
+
+# number of bits of the hashes of values in a cardinality sketch
+CARDINALITY_HASH_BITS = 60
+
+# keep the hash of every value until a cardinality sketch holds this many
+CARDINALITY_MAX_EXACT = 1000
+
+# the number of bits of a hash used to pick a HyperLogLog register
+CARDINALITY_PRECISION = 12
+
+# number of text values hashed at once, which bounds the memory used
+HASH_BLOCK_SIZE = 2 ** 14
+
+# number of centroids a compressed quantile sketch is scaled to
+QUANTILE_COMPRESSION = 200
+
+# keep every value until a quantile sketch holds this many centroids
+QUANTILE_MAX_CENTROIDS = 1000
+
+
+def hash_values(values):
+    """Return the hashes of the distinct non-null `values`.
+
+    Numbers hash the same whatever their type, so ``1`` and ``1.0`` are one
+    value.  Other values are hashed by their UTF-8 text, a block of values at
+    a time with numpy.
+
+    :param values: An array like of values.
+
+    :returns: A sorted array of unsigned integer hashes.
+    """
+    values = np.asarray(values)
+
+    if values.dtype.kind == 'M':
+        values = values.view(np.int64)
+        values = values[values != np.iinfo(np.int64).min].astype(float)
+    elif values.dtype.kind in 'biuf':
+        values = values.astype(float)
+    else:
+        numbers, texts = [], []
+
+        for value in Series(values).dropna().unique():
+            if isinstance(value, (bool, int, long, float, np.number)):
+                numbers.append(value)
+            elif isinstance(value, unicode):
+                texts.append(value.encode('utf-8'))
+            else:
+                texts.append(str(value))
+
+        return np.union1d(hash_values(np.array(numbers, dtype=float)),
+                          __hash_texts(texts))
+
+    return __mix(np.unique(values[~np.isnan(values)]))
+
+
+def __hash_texts(texts):
+    """Hash the byte strings `texts` eight bytes at a time.
+
+    The bytes of a block of texts are padded to a multiple of eight and read
+    as 64 bit words, which are folded into the hashes one column of words at
+    a time.
+    """
+    hashes = [np.array([], dtype=np.uint64)]
+
+    for start in xrange(0, len(texts), HASH_BLOCK_SIZE):
+        block = np.array(texts[start:start + HASH_BLOCK_SIZE], dtype=np.str_)
+        width = max(-(-block.itemsize // 8) * 8, 8)
+        words = block.astype('S%d' % width).view('<u8').reshape(
+            len(block), width // 8).astype(np.uint64)
+        block_hashes = np.empty(len(block), dtype=np.uint64)
+        block_hashes.fill(0xcbf29ce484222325)
+
+        for column in words.T:
+            block_hashes = __splitmix(block_hashes ^ column)
+
+        hashes.append(block_hashes >> np.uint64(64 - CARDINALITY_HASH_BITS))
+
+    return np.unique(np.concatenate(hashes))
+
+
+def __mix(values):
+    """Hash the bits of the float `values` with the splitmix64 finalizer."""
+    # signed zeros are one value
+    values = values + 0.0
+
+    return np.unique(__splitmix(values.view(np.uint64)) >> np.uint64(
+        64 - CARDINALITY_HASH_BITS))
+
+
+def __splitmix(hashes):
+    """Mix the bits of the unsigned 64 bit `hashes`."""
+    hashes = (hashes ^ (hashes >> np.uint64(30))) * np.uint64(
+        0xbf58476d1ce4e5b9)
+    hashes = (hashes ^ (hashes >> np.uint64(27))) * np.uint64(
+        0x94d049bb133111eb)
+
+    return hashes ^ (hashes >> np.uint64(31))
+
+
+class CardinalitySketch(object):
+    """A mergeable sketch of a set of values to count distinct values from.
+
+    Until the sketch holds more than `max_exact` values the hash of every
+    value is kept, so the cardinality of small sets is exact.  Then the
+    hashes are replaced with the registers of a HyperLogLog, whose relative
+    error is about ``1.04 / sqrt(2 ** precision)``.
+
+    Attributes:
+
+    - hashes: The sorted hashes of the values, or None.
+    - max_exact: The number of hashes to keep.
+    - precision: The number of bits of a hash used to pick a register.
+    - registers: The HyperLogLog registers, or None.
+    """
+
+    def __init__(self, hashes=None, registers=None,
+                 precision=CARDINALITY_PRECISION,
+                 max_exact=CARDINALITY_MAX_EXACT):
+        self.max_exact = max_exact
+        self.precision = precision
+        self.registers = registers
+        self.hashes = None
+
+        if registers is None:
+            self.hashes = np.array(
+                hashes if hashes is not None else [], dtype=np.uint64)
+
+    @classmethod
+    def from_json(cls, json_str):
+        data = json.loads(json_str)
+        registers = data.get('registers')
+
+        if registers is not None:
+            registers = np.fromstring(b64decode(registers), dtype=np.uint8)
+
+        return cls(data.get('hashes'), registers, data['precision'])
+
+    @classmethod
+    def from_values(cls, values):
+        sketch = cls()
+        sketch.update(values)
+
+        return sketch
+
+    @property
+    def cardinality(self):
+        """Return the number of distinct values, estimated if not exact."""
+        if self.registers is None:
+            return len(self.hashes)
+
+        num_registers = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / num_registers)
+        estimate = alpha * num_registers ** 2 / np.sum(
+            2.0 ** -self.registers.astype(float))
+        zeros = np.sum(self.registers == 0)
+
+        # small cardinalities are better estimated by linear counting
+        if estimate <= 2.5 * num_registers and zeros:
+            estimate = num_registers * log(float(num_registers) / zeros)
+
+        return int(round(estimate))
+
+    def merge(self, other):
+        """Merge the values counted by `other` into this sketch."""
+        if other.registers is None:
+            return self.__add(other.hashes)
+
+        self.__to_registers()
+        self.registers = np.maximum(self.registers, other.registers)
+
+        return self
+
+    def to_json(self):
+        if self.registers is None:
+            return json.dumps({
+                'precision': self.precision,
+                'hashes': self.hashes.tolist(),
+            })
+
+        return json.dumps({
+            'precision': self.precision,
+            'registers': b64encode(self.registers.tostring()),
+        })
+
+    def update(self, values):
+        """Add the distinct non-null `values` to this sketch."""
+        return self.__add(hash_values(values))
+
+    def __add(self, hashes):
+        if self.registers is None:
+            self.hashes = np.union1d(self.hashes, hashes).astype(np.uint64)
+
+            if len(self.hashes) > self.max_exact:
+                self.__to_registers()
+        else:
+            self.__add_to_registers(hashes)
+
+        return self
+
+    def __add_to_registers(self, hashes):
+        """Set each register to the largest rank of the hashes it picks.
+
+        The rank of a hash is the position of the first set bit after the
+        bits used to pick its register.
+        """
+        if not len(hashes):
+            return
+
+        bits = CARDINALITY_HASH_BITS - self.precision
+        indices = (hashes >> np.uint64(bits)).astype(np.int64)
+        remainders = (hashes & np.uint64((1 << bits) - 1)).astype(float)
+        lengths = np.zeros(len(hashes))
+        nonzero = remainders > 0
+        lengths[nonzero] = np.floor(np.log2(remainders[nonzero])) + 1
+        ranks = (bits - lengths + 1).astype(np.uint8)
+
+        # the largest rank for each register
+        order = np.lexsort((ranks, indices))
+        indices, ranks = indices[order], ranks[order]
+        last = np.append(indices[1:] != indices[:-1], True)
+        indices, ranks = indices[last], ranks[last]
+
+        self.registers[indices] = np.maximum(self.registers[indices], ranks)
+
+    def __to_registers(self):
+        if self.registers is None:
+            self.registers = np.zeros(2 ** self.precision, dtype=np.uint8)
+            self.__add_to_registers(self.hashes)
+            self.hashes = None
+
+
+class QuantileSketch(object):
+    """A mergeable sketch of a distribution to estimate quantiles from.
+
+    This is a merging t-digest.  Values are kept in weighted centroids which
+    are small near the tails of the distribution and larger near its median.
+    Until the sketch holds more than `max_centroids` centroids every value
+    is kept, so the quantiles of small data are exact.
+
+    Attributes:
+
+    - compression: The number of centroids a sketch is compressed to.
+    - max_centroids: The number of centroids to compress at.
+    - means: The sorted means of the centroids.
+    - weights: The weights of the centroids.
+    """
+
+    def __init__(self, means=None, weights=None,
+                 compression=QUANTILE_COMPRESSION,
+                 max_centroids=QUANTILE_MAX_CENTROIDS):
+        self.compression = compression
+        self.max_centroids = max_centroids
+        self.means = np.array(means if means is not None else [], dtype=float)
+        self.weights = np.array(
+            weights if weights is not None else [], dtype=float)
+
+    @classmethod
+    def from_json(cls, json_str):
+        data = json.loads(json_str)
+        means, weights = zip(*data['centroids']) if data['centroids'] else (
+            [], [])
+
+        return cls(means, weights, data['compression'])
+
+    @classmethod
+    def from_values(cls, values):
+        sketch = cls()
+        sketch.update(values)
+
+        return sketch
+
+    @property
+    def count(self):
+        return self.weights.sum()
+
+    def merge(self, other):
+        """Merge the centroids of `other` into this sketch."""
+        self.__add(other.means, other.weights)
+
+        return self
+
+    def quantile(self, q):
+        """Estimate the `q` quantile, with `q` between 0 and 1.
+
+        Interpolates linearly between the centres of the centroids, which
+        for single values is the same as ``pandas.Series.quantile``.
+        """
+        if not len(self.means):
+            return np.nan
+
+        # the rank of each centroid's centre, starting at 0
+        positions = self.weights.cumsum() - (self.weights + 1) / 2
+
+        return np.interp((self.count - 1) * q, positions, self.means)
+
+    def remove(self, values):
+        """Remove the non-null `values`, added before, from this sketch.
+
+        Each value is taken from the centroid with the nearest mean.  This is
+        exact while every value is kept and approximate after the sketch has
+        been compressed.
+
+        :returns: False if the sketch holds fewer values, True otherwise.
+        """
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+
+        if len(values) > self.count:
+            return False
+
+        for value in values:
+            i = min(max(self.means.searchsorted(value), 1), len(self.means))
+
+            if i == len(self.means) or (
+                    value - self.means[i - 1] <= self.means[i] - value):
+                i -= 1
+
+            weight = self.weights[i]
+
+            if weight > 1:
+                self.means[i] = (self.means[i] * weight - value) / (weight - 1)
+                self.weights[i] = weight - 1
+            else:
+                self.means = np.delete(self.means, i)
+                self.weights = np.delete(self.weights, i)
+
+        order = self.means.argsort(kind='mergesort')
+        self.means, self.weights = self.means[order], self.weights[order]
+
+        return True
+
+    def to_json(self):
+        return json.dumps({
+            'compression': self.compression,
+            'centroids': zip(self.means.tolist(), self.weights.tolist()),
+        })
+
+    def update(self, values):
+        """Add the non-null `values` to this sketch."""
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        self.__add(values, np.ones(len(values)))
+
+        return self
+
+    def __add(self, means, weights):
+        means = np.concatenate([self.means, means])
+        weights = np.concatenate([self.weights, weights])
+        order = means.argsort(kind='mergesort')
+        self.means, self.weights = means[order], weights[order]
+
+        if len(self.means) > self.max_centroids:
+            self.__compress()
+
+    def __compress(self):
+        """Merge neighbouring centroids using the t-digest scale function.
+
+        Each centroid is assigned to a bucket by the scaled quantile of its
+        centre, and the centroids in a bucket are merged.  The scale is
+        steep at the tails, so buckets there hold fewer values.
+        """
+        cumulative = self.weights.cumsum()
+        quantiles = (cumulative - self.weights / 2) / cumulative[-1]
+        scaled = self.compression / pi * np.arcsin(2 * quantiles - 1)
+        buckets = np.floor(scaled - scaled.min()).astype(int)
+
+        weights = np.bincount(buckets, weights=self.weights)
+        totals = np.bincount(buckets, weights=self.means * self.weights)
+        used = weights > 0
+
+        self.means = totals[used] / weights[used]
+        self.weights = weights[used]
@@ -27,6 +27,17 @@ def minint():
     return -maxint - 1
 
 
+def parse_bool(value):
+    """Return True if `value` is True or a string meaning true, e.g. 'true'.
+
+    Request parameters arrive as strings, so 'false' and '0' are False.
+    """
+    if isinstance(value, basestring):
+        return value.strip().lower() in ['1', 'true', 'yes', 'on']
+
+    return bool(value)
+
+
 def parse_float(value, default=None):
     return _parse_type(np.float64, value, default)
 
@@ -21,6 +21,7 @@ class AbstractModel(object):
 
     DB_READ_BATCH_SIZE = 1000
     DB_SAVE_BATCH_SIZE = 2000
+    DB_UPDATE_BATCH_SIZE = 1000
     ERROR_MESSAGE = 'error_message'
     GROUP_DELIMITER = ','  # delimiter when passing multiple groups as a string
     MIN_BATCH_SIZE = 50
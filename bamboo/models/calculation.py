@@ -16,7 +16,7 @@ from bamboo.models.abstract_model import AbstractModel
 class CalculateTask(Task):
     def after_return(self, status, retval, task_id, args, kwargs, einfo=None):
         if status == 'FAILURE':
-            calculations = args[0]
+            calculations = Calculation.find_unfinished(args[0], task_id)
 
             for calculation in calculations:
                 calculation.failed(traceback.format_exc())
@@ -42,13 +42,25 @@ class UniqueCalculationError(Exception):
 def calculate_task(calculations, dataset):
     """Background task to run a calculation.
 
-    Set calculation to failed and raise if an exception occurs.
+    Run `calculations` along with all other pending calculations for the
+    dataset, so that independent calculations run concurrently instead of
+    waiting for each other's tasks.  Each calculation is claimed before it is
+    run and calculations claimed by another task are skipped.  If there are no
+    pending calculations left to claim do nothing.
+
+    Set claimed calculations to failed and raise if an exception occurs.
 
     :param calculation: Calculation to run.
     :param dataset: Dataset to run calculation on.
     """
-    # block until other calculations for this dataset are finished
-    calculations[0].restart_if_has_pending(dataset, calculations[1:])
+    # block until calculations claimed by other tasks are finished
+    Calculation.restart_if_has_running(dataset)
+
+    calculations = Calculation.claim_pending(
+        dataset, calculate_task.request.id)
+
+    if not calculations:
+        return
 
     calculate_columns(dataset.reload(), calculations)
 
@@ -110,6 +122,8 @@ class Calculation(AbstractModel):
     FORMULA = 'formula'
     GROUP = 'group'
     NAME = 'name'
+    STATE_RUNNING = 'running'
+    TASK_ID = 'task_id'
 
     @property
     def aggregation(self):
@@ -143,6 +157,10 @@ class Calculation(AbstractModel):
     def groups_as_list(self):
         return self.split_groups(self.group)
 
+    @property
+    def is_running(self):
+        return self.state == self.STATE_RUNNING
+
     @property
     def name(self):
         return self.record[self.NAME]
@@ -154,6 +172,36 @@ class Calculation(AbstractModel):
 
         return calculation
 
+    @classmethod
+    def claim_pending(cls, dataset, task_id):
+        """Claim the pending calculations for `dataset` for a task.
+
+        Each calculation is atomically moved from the pending to the running
+        state, calculations that another task has already claimed are skipped.
+
+        :param dataset: The dataset to claim calculations for.
+        :param task_id: The ID of the task claiming the calculations.
+
+        :returns: A list of the claimed calculations.
+        """
+        claimed = []
+
+        for calculation in cls.find(dataset):
+            if not calculation.is_pending:
+                continue
+
+            record = cls.collection.find_and_modify(
+                {'_id': calculation.record['_id'],
+                 cls.STATE: cls.STATE_PENDING},
+                {'$set': {cls.STATE: cls.STATE_RUNNING,
+                          cls.TASK_ID: task_id}},
+                new=True)
+
+            if record:
+                claimed.append(cls(record))
+
+        return claimed
+
     @classmethod
     def create_from_list_or_dict(cls, dataset, calculations):
         calculations = to_list(calculations)
@@ -202,6 +250,23 @@ class Calculation(AbstractModel):
         query_args = QueryArgs(query=query, order_by='name')
         return super(cls, cls).find(query_args)
 
+    @classmethod
+    def find_unfinished(cls, calculations, task_id):
+        """Return the calculations a task has left unfinished.
+
+        These are `calculations` that are still pending and the calculations
+        the task claimed that are still running.
+
+        :param calculations: The calculations the task was started for.
+        :param task_id: The ID of the task.
+        """
+        ids = [c.record['_id'] for c in calculations]
+        query = {'$or': [
+            {'_id': {'$in': ids}, cls.STATE: cls.STATE_PENDING},
+            {cls.TASK_ID: task_id, cls.STATE: cls.STATE_RUNNING}]}
+
+        return super(cls, cls).find(QueryArgs(query=query))
+
     @classmethod
     def find_one(cls, dataset_id, name, group=None):
         query = {DATASET_ID: dataset_id, cls.NAME: name}
@@ -265,12 +330,10 @@ class Calculation(AbstractModel):
             calculation = self.find_one(self.dataset_id, name)
             calculation.remove_dependent_calculation(self.name)
 
-    def restart_if_has_pending(self, dataset, current_calcs=[]):
-        current_names = sorted([self.name] + [c.name for c in current_calcs])
-        unfinished = [c for c in dataset.calculations() if c.is_pending]
-        unfinished_names = [c.name for c in unfinished[:len(current_names)]]
-
-        if len(unfinished) and current_names != sorted(unfinished_names):
+    @classmethod
+    def restart_if_has_running(cls, dataset):
+        """Retry the calculate task if `dataset` has running calculations."""
+        if any([c.is_running for c in cls.find(dataset)]):
             raise calculate_task.retry()
 
     def save(self, dataset, formula, name, group_str=None):
@@ -281,8 +344,9 @@ class Calculation(AbstractModel):
         calculation for them under `name`. Finally, create a background task
         to compute the calculation.
 
-        Calculations are initially saved in a **pending** state, after the
-        calculation has finished processing it will be in a **ready** state.
+        Calculations are initially saved in a **pending** state, while a task
+        is processing the calculation it will be in a **running** state, and
+        after it has finished processing it will be in a **ready** state.
 
         :param dataset: The DataSet to save.
         :param formula: The formula to save.
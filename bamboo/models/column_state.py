@@ -0,0 +1,117 @@
+from copy import deepcopy
+
+from bamboo.core.frame import DATASET_ID
+from bamboo.lib.mongo import dict_for_mongo, dict_from_mongo
+from bamboo.models.abstract_model import AbstractModel
+
+
+class ColumnState(AbstractModel):
+    """Mergeable state kept for the columns of a dataset.
+
+    States, e.g. the summary state of a column with its quantile sketch, can
+    be large, so they are not stored in the dataset record.  There is one
+    document for each dataset, kind of state and column.  The keys of states
+    which are dicts are encoded for MongoDB.
+    """
+
+    __collectionname__ = 'column_states'
+
+    COLUMN = 'column'
+    KIND = 'kind'
+    VALUE = 'value'
+    VERSION = 'version'
+
+    @classmethod
+    def delete_all(cls, dataset, kind=None, columns=None):
+        """Delete the states for `dataset`.
+
+        :param dataset: The dataset to delete states for.
+        :param kind: If passed only delete states of this kind.
+        :param columns: If passed only delete states for these columns.
+        """
+        cls.collection.remove(cls.__query(dataset, kind, columns))
+
+    @classmethod
+    def find_all(cls, dataset, kind, columns=None):
+        """Return the states of `kind` for `dataset`.
+
+        :param dataset: The dataset to find states for.
+        :param kind: The kind of state to find.
+        :param columns: If passed only find states for these columns.
+
+        :returns: A dict of columns to their states.
+        """
+        cursor = cls.collection.find(cls.__query(dataset, kind, columns),
+                                     {cls.COLUMN: 1, cls.VALUE: 1})
+
+        return {record[cls.COLUMN]: dict_from_mongo(record)[cls.VALUE]
+                for record in cursor}
+
+    @classmethod
+    def merge_all(cls, dataset, kind, states, merge):
+        """Merge `states` of `kind` into the states stored for `dataset`.
+
+        A stored state is only replaced if its version has not changed since
+        it was read, otherwise it is read and merged again, so that states
+        may be merged concurrently.  States which are not stored are skipped.
+
+        :param dataset: The dataset to merge states for.
+        :param kind: The kind of the states.
+        :param states: A dict of columns to their states.
+        :param merge: A function of a stored state and a state which returns
+            their merged state.
+        """
+        for column, value in states.items():
+            spec = {DATASET_ID: dataset.dataset_id, cls.KIND: kind,
+                    cls.COLUMN: column}
+
+            while True:
+                record = cls.collection.find_one(
+                    spec, {cls.VALUE: 1, cls.VERSION: 1})
+
+                if record is None:
+                    break
+
+                version = record.get(cls.VERSION)
+                merged = merge(dict_from_mongo(record)[cls.VALUE], value)
+                result = cls.collection.update(
+                    dict(spec, **{cls.VERSION: version}),
+                    {'$set': dict_for_mongo({cls.VALUE: deepcopy(merged)}),
+                     '$inc': {cls.VERSION: 1}})
+
+                if result['n']:
+                    break
+
+    @classmethod
+    def save_all(cls, dataset, kind, states):
+        """Store `states` of `kind` for `dataset` in one bulk request.
+
+        :param dataset: The dataset to store states for.
+        :param kind: The kind of the states.
+        :param states: A dict of columns to their states.
+        """
+        if not states:
+            return
+
+        bulk = cls.collection.initialize_unordered_bulk_op()
+
+        for column, value in states.items():
+            spec = {DATASET_ID: dataset.dataset_id, cls.KIND: kind,
+                    cls.COLUMN: column}
+            record = dict_for_mongo({cls.VALUE: deepcopy(value)})
+            record.update(spec)
+            bulk.find(spec).upsert().replace_one(record)
+
+        bulk.execute()
+
+    @classmethod
+    def __query(cls, dataset, kind, columns):
+        query = {DATASET_ID: dataset.dataset_id}
+
+        if kind is not None:
+            query[cls.KIND] = kind
+
+        if columns is not None:
+            query[cls.COLUMN] = {'$in': list(columns)}
+
+        return query
@@ -1,29 +1,70 @@
+from datetime import timedelta
+from Queue import Queue
 import re
+from threading import Thread
 import uuid
 from time import gmtime, strftime
 
 from celery.task import task
+import numpy as np
 from pandas import DataFrame, rolling_window
 
+from bamboo.config.settings import DFRAME_CACHE_MAX_BYTES,\
+    IMPORT_QUEUE_SIZE, TOMBSTONE_RETENTION_DAYS
 from bamboo.core.calculator import calculate_updates, dframe_from_update,\
     propagate
 from bamboo.core.frame import BAMBOO_RESERVED_KEY_PREFIX,\
-    DATASET_ID, INDEX, join_dataset, PARENT_DATASET_ID, remove_reserved_keys
-from bamboo.core.summary import summarize
+    DATASET_ID, df_nbytes, INDEX, is_reserved_key, join_dataset,\
+    PARENT_DATASET_ID, remove_reserved_keys
+from bamboo.core.summary import state_cardinality, state_count, summarize,\
+    update_summary
 from bamboo.lib.async import call_async
+from bamboo.lib.cache import LRUCache
+from bamboo.lib.datetools import now
 from bamboo.lib.exceptions import ArgumentError
 from bamboo.lib.mongo import df_mongo_decode
 from bamboo.lib.readers import ImportableDataset
 from bamboo.lib.query_args import QueryArgs
-from bamboo.lib.schema_builder import Schema
+from bamboo.lib.schema_builder import CARDINALITY, Schema
+from bamboo.lib.sketches import CardinalitySketch
 from bamboo.lib.utils import combine_dicts, to_list
 from bamboo.models.abstract_model import AbstractModel
 from bamboo.models.calculation import Calculation
+from bamboo.models.column_state import ColumnState
 from bamboo.models.observation import Observation
 
 # The format pandas encodes multicolumns in.
 strip_pattern = re.compile("\(u'|', u'|'\)")
 
+# the number of DataFrames to cache, the cache is also bounded by memory
+DFRAME_CACHE_SIZE = 1000
+
+# cache of dataset records, data versions and projections to DataFrames
+DFRAME_CACHE = LRUCache(DFRAME_CACHE_SIZE, max_weight=DFRAME_CACHE_MAX_BYTES,
+                        weigh=df_nbytes)
+
+
+@task(ignore_result=True)
+def compact_task(retention_days=TOMBSTONE_RETENTION_DAYS, archive=True):
+    """Background task to remove rows deleted more than `retention_days` ago.
+
+    :param retention_days: The number of days to keep deleted rows for.
+    :param archive: If True, archive the removed rows, default True.
+
+    :returns: A dict of dataset IDs to the number of rows removed from them.
+    """
+    deleted_before = now() - timedelta(days=retention_days)
+    num_removed = {}
+
+    for dataset_id in Dataset.collection.distinct(DATASET_ID):
+        dataset = Dataset.find_one(dataset_id)
+
+        if dataset:
+            num_removed[dataset_id] = Observation.compact(
+                dataset, deleted_before, archive=archive)
+
+    return num_removed
+
 
 @task(ignore_result=True)
 def delete_task(dataset, query=None):
@@ -34,6 +75,16 @@ def delete_task(dataset, query=None):
         super(dataset.__class__, dataset).delete(
             {DATASET_ID: dataset.dataset_id})
         Observation.delete_encoding(dataset)
+        ColumnState.delete_all(dataset)
+
+
+@task(ignore_result=True)
+def rebuild_schema_task(dataset):
+    """Background task to rebuild the schema of dataset from its rows."""
+    dataset.reload()
+
+    if dataset.record:
+        dataset.build_schema(dataset.dframe(), overwrite=True)
 
 
 class Dataset(AbstractModel, ImportableDataset):
@@ -43,13 +94,20 @@ class Dataset(AbstractModel, ImportableDataset):
     # caching keys
     STATS = '_stats'
     ALL = '_all'
+    STATS_STATE = '_state'  # summary states stored with the stats before
+    SUMMARY_STATE = 'summary'  # the kind of column state for summaries
+    CARDINALITY_SKETCH = 'cardinality'  # the kind of column state for sketches
 
     # metadata
     AGGREGATED_DATASETS = BAMBOO_RESERVED_KEY_PREFIX + 'linked_datasets'
     ATTRIBUTION = 'attribution'
+    # sketches stored in the dataset record before
+    CARDINALITY_SKETCHES = BAMBOO_RESERVED_KEY_PREFIX + 'cardinality_sketches'
     CREATED_AT = 'created_at'
+    DATA_VERSION = 'data_version'
     DESCRIPTION = 'description'
     ID = 'id'
+    IMPORT_RANGES = BAMBOO_RESERVED_KEY_PREFIX + 'import_ranges'
     JOINED_DATASETS = 'joined_datasets'
     LABEL = 'label'
     LICENSE = 'license'
@@ -64,6 +122,7 @@ class Dataset(AbstractModel, ImportableDataset):
     def __init__(self, record=None):
         super(Dataset, self).__init__(record)
         self.__dframe = None
+        self.__sorted_columns = {}
 
     @property
     def aggregated_datasets(self):
@@ -82,6 +141,10 @@ class Dataset(AbstractModel, ImportableDataset):
     def columns(self):
         return self.schema.keys() if self.num_rows else []
 
+    @property
+    def data_version(self):
+        return self.record.get(self.DATA_VERSION, 0)
+
     @property
     def dataset_id(self):
         return self.record[DATASET_ID]
@@ -238,13 +301,20 @@ class Dataset(AbstractModel, ImportableDataset):
         return self.find_one(_id) if _id else None
 
     def append_observations(self, dframe):
-        Observation.append(dframe, self)
-        self.update({self.NUM_ROWS: self.num_rows + len(dframe)})
+        """Append the rows in `dframe` to this dataset.
 
-        # to update cardinalities here we need to refetch the full DataFrame.
-        dframe = self.dframe(keep_parent_ids=True)
-        self.build_schema(dframe)
-        self.update_stats(dframe)
+        The schema is merged with the schema of the new rows and the new rows
+        are folded into the summary statistics, existing rows are not read.
+        The number of rows is incremented atomically, so that rows deleted at
+        the same time are still counted as deleted.
+
+        :param dframe: The DataFrame of rows to append.
+        """
+        Observation.append(dframe, self)
+        self.__increment(self.NUM_ROWS, len(dframe))
+        self.update({self.STATE: self.STATE_READY})
+        self.merge_schema(dframe)
+        update_summary(self, dframe)
 
     def build_schema(self, dframe, overwrite=False, set_num_columns=True):
         """Build schema for a dataset.
@@ -263,9 +333,15 @@ class Dataset(AbstractModel, ImportableDataset):
         :param overwrite: If true replace schema, otherwise update.
         :param set_num_columns: If True also set the number of columns.
         """
-        new_schema = self.schema.rebuild(dframe, overwrite)
+        sketches = {}
+        new_schema = self.schema.rebuild(dframe, overwrite, sketches)
+
+        if overwrite:
+            ColumnState.delete_all(self, self.CARDINALITY_SKETCH)
+
         self.set_schema(new_schema,
                         set_num_columns=(set_num_columns or overwrite))
+        self.set_cardinality_sketches(sketches)
 
     def calculations(self, include_aggs=True, only_aggs=False):
         """Return the calculations for this dataset.
@@ -278,8 +354,21 @@ class Dataset(AbstractModel, ImportableDataset):
     def cardinality(self, col):
         return self.schema.cardinality(col)
 
+    def cardinality_sketches(self, columns=None):
+        """Return the sketches of the distinct values of columns.
+
+        :param columns: If passed only return the sketches of these columns.
+
+        :returns: A dict of columns to their `CardinalitySketch`.
+        """
+        return {
+            column: CardinalitySketch.from_json(sketch) for column, sketch in
+            ColumnState.find_all(
+                self, self.CARDINALITY_SKETCH, columns).items()}
+
     def clear_cache(self):
         self.__dframe = None
+        self.__sorted_columns = {}
 
         return self
 
@@ -304,10 +393,14 @@ class Dataset(AbstractModel, ImportableDataset):
 
                 if stats_for_field:
                     stats_for_field.pop(column, None)
+
+                if not group:
+                    ColumnState.delete_all(self, self.SUMMARY_STATE, [column])
             elif group:
                 stats.pop(group, None)
             else:
                 stats = {}
+                ColumnState.delete_all(self, self.SUMMARY_STATE)
 
             self.update({self.STATS: stats})
 
@@ -348,26 +441,39 @@ class Dataset(AbstractModel, ImportableDataset):
         Observation.delete_columns(self, columns)
         new_schema = self.schema
 
-        [new_schema.pop(c) for c in columns]
+        for column in columns:
+            new_schema.pop(column)
 
         self.set_schema(new_schema, set_num_columns=True)
+        self.__drop_sketches(columns)
 
         return columns
 
     def delete_observation(self, index):
         """Delete observation at index.
 
+        The number of rows, the summary statistics and the cardinalities of
+        dimensions are updated from the deleted row, the other rows are not
+        read.  The schema is rebuilt in the background only if a column may
+        have no values left.
+
         :params index: The index of an observation to delete.
         """
-        Observation.delete(self, index)
+        record = Observation.delete(self, index)
+
+        if record:
+            row = DataFrame([record])
+            self.__increment(self.NUM_ROWS, -1)
+            update_summary(self, row, retract=True)
+
+            if self.__update_cardinalities(row) or not self.num_rows:
+                call_async(rebuild_schema_task, self)
 
-        dframe = self.dframe()
-        self.update({self.NUM_ROWS: len(dframe)})
-        self.build_schema(dframe, overwrite=True)
         call_async(propagate, self, update={'delete': index})
 
     def dframe(self, query_args=None, keep_parent_ids=False, padded=False,
-               index=False, reload_=False, keep_mongo_keys=False):
+               index=False, reload_=False, keep_mongo_keys=False,
+               keep_state=False):
         """Fetch the dframe for this dataset.
 
         :param query_args: An optional QueryArgs to hold the query arguments.
@@ -377,42 +483,107 @@ class Dataset(AbstractModel, ImportableDataset):
         :param index: Return the index with dframe, default False.
         :param reload_: Force refresh of data, default False.
         :param keep_mongo_keys: Used for updating documents, default False.
+        :param keep_state: Do not remove the internal state columns of
+            aggregations, default False.
 
         :returns: Return DataFrame with contents based on query parameters
             passed to MongoDB. DataFrame will not have parent ids if
             `keep_parent_ids` is False.
         """
         # bypass cache if we need specific version
-        cacheable = not (query_args or keep_parent_ids or padded)
+        cacheable = not (query_args or keep_parent_ids or padded or
+                         keep_state)
 
         # use cached copy if we have already fetched it
         if cacheable and not reload_ and self.__is_cached:
             return self.__dframe
 
+        cache_key = self.__dframe_cache_key(
+            query_args, keep_parent_ids, padded, index, keep_mongo_keys,
+            keep_state)
+
+        # use a copy cached by any request for this version of the data
+        if cache_key and not reload_:
+            dframe = DFRAME_CACHE.get(cache_key)
+
+            if dframe is not None:
+                dframe = dframe.copy()
+
+                if cacheable:
+                    self.__dframe = dframe
+
+                return dframe
+
         query_args = query_args or QueryArgs()
         observations = self.observations(query_args, as_cursor=True)
 
         if query_args.distinct:
             return DataFrame(observations)
 
-        dframe = Observation.batch_read_dframe_from_cursor(
-            self, observations, query_args.distinct, query_args.limit)
+        dframe = Observation.batch_read_dframe_from_cursor(self, observations)
 
         dframe = df_mongo_decode(dframe, keep_mongo_keys=keep_mongo_keys)
 
         excluded = [keep_parent_ids and PARENT_DATASET_ID, index and INDEX]
-        dframe = remove_reserved_keys(dframe, filter(bool, excluded))
+        dframe = remove_reserved_keys(dframe, filter(bool, excluded),
+                                      keep_state)
 
         if index:
             dframe.rename(columns={INDEX: 'index'}, inplace=True)
 
         dframe = self.__maybe_pad(dframe, padded)
 
+        if cache_key:
+            DFRAME_CACHE.set(cache_key, dframe.copy())
+
         if cacheable:
             self.__dframe = dframe
 
         return dframe
 
+    def finish_range_import(self, sketches=None):
+        """Count a range of rows imported in parallel as finished.
+
+        The sketches of the range are merged into those stored for this
+        dataset from the first range, then the range is counted.  When the
+        last range finishes the cardinalities of the columns are set from the
+        merged sketches, the summary is built from the saved rows and the
+        dataset is ready, unless the import has failed.
+
+        :param sketches: A dict of columns to sketches from `save_range`, or
+            None if the range was not saved.
+
+        :returns: True if this was the last range to finish.
+        """
+        def merge(stored, sketch):
+            return CardinalitySketch.from_json(stored).merge(
+                CardinalitySketch.from_json(sketch)).to_json()
+
+        if sketches:
+            ColumnState.merge_all(self, self.CARDINALITY_SKETCH, {
+                column: sketch.to_json() for column, sketch in
+                sketches.items()}, merge)
+
+        self.__increment(self.IMPORT_RANGES, -1)
+
+        if self.record[self.IMPORT_RANGES] > 0:
+            return False
+
+        self.reload()
+
+        if self.state != self.STATE_FAILED:
+            schema = self.schema
+
+            for column, sketch in self.cardinality_sketches().items():
+                if column in schema:
+                    schema[column][CARDINALITY] = sketch.cardinality
+
+            self.set_schema(schema)
+            self.summarize(None)
+            self.ready()
+
+        return True
+
     def has_pending_updates(self, update_id):
         """Check if this dataset has pending updates.
 
@@ -431,6 +602,14 @@ class Dataset(AbstractModel, ImportableDataset):
         return pending_updates[0] != update_id and len(
             set(pending_updates) - set([update_id]))
 
+    def increment_data_version(self):
+        """Increment the version of the rows stored for this dataset.
+
+        DataFrames cached for the previous version are no longer read.
+        """
+        self.__increment(self.DATA_VERSION)
+        self.clear_cache()
+
     def info(self, update=None):
         """Return or update meta-data for this dataset.
 
@@ -492,6 +671,52 @@ class Dataset(AbstractModel, ImportableDataset):
 
         return merged_dataset
 
+    def merge_schema(self, dframe):
+        """Merge the schema of rows appended to this dataset.
+
+        Columns already in the schema keep their types.  The cardinality of
+        each column is updated from a stored sketch of its distinct values,
+        so the existing rows are not read.  Columns of
+        datasets stored without sketches are read once to build them.
+
+        :param dframe: The DataFrame of appended rows.
+        """
+        schema = self.schema
+        dframe = dframe.rename(columns=schema.rename_map_for_dframe(dframe))
+        new_columns = [column for column in dframe.columns if column not in
+                       schema and not is_reserved_key(column)]
+
+        built_sketches = {}
+
+        if new_columns:
+            schema = schema.rebuild(dframe[new_columns],
+                                    sketches=built_sketches)
+
+        columns = [column for column in dframe.columns if column in schema]
+        sketches = self.cardinality_sketches(columns)
+        unsketched = [column for column in columns if column not in
+                      sketches and column not in new_columns]
+        new_sketches = {}
+
+        if unsketched:
+            query_args = QueryArgs(select={column: 1 for column in unsketched})
+            new_sketches = self.__sketch_columns(
+                self.dframe(query_args=query_args), schema)
+
+        for column in columns:
+            sketch = built_sketches.get(column)
+
+            if sketch is None:
+                sketch = new_sketches.get(column) or sketches.get(
+                    column, CardinalitySketch())
+                sketch.update(dframe[column].values)
+
+            sketches[column] = sketch
+            schema[column][CARDINALITY] = sketch.cardinality
+
+        self.set_schema(schema)
+        self.set_cardinality_sketches(sketches)
+
     def observations(self, query_args=None, as_cursor=False):
         """Return observations for this dataset.
 
@@ -520,12 +745,24 @@ class Dataset(AbstractModel, ImportableDataset):
     def remove_parent_observations(self, parent_id):
         """Remove obervations for this dataset with the passed `parent_id`.
 
+        The removed rows are read first, subtracted from the number of rows
+        and retracted from the summary statistics.  The cardinality sketches
+        of their columns are dropped, so that they are rebuilt without the
+        removed rows when rows are next merged.
+
         :param parent_id: Remove observations with this ID as their parent
             dataset ID.
         """
+        query_args = QueryArgs(query={PARENT_DATASET_ID: parent_id})
+        rows = self.dframe(query_args=query_args, keep_parent_ids=True)
         Observation.delete_all(self, {PARENT_DATASET_ID: parent_id})
-        # clear the cached dframe
-        self.__dframe = None
+
+        if len(rows):
+            self.__increment(self.NUM_ROWS, -len(rows))
+            self.__drop_sketches(rows.columns)
+            update_summary(self, rows, retract=True)
+
+        self.clear_cache()
 
     def remove_pending_update(self, update_id):
         self.collection.update(
@@ -593,12 +830,59 @@ class Dataset(AbstractModel, ImportableDataset):
             DATASET_ID: dataset_id,
             self.AGGREGATED_DATASETS: {},
             self.CREATED_AT: strftime("%Y-%m-%d %H:%M:%S", gmtime()),
+            self.DATA_VERSION: 0,
             self.STATE: self.STATE_PENDING,
             self.PENDING_UPDATES: [],
         }
 
         return super(self.__class__, self).save(record)
 
+    def save_observation_chunks(self, chunks):
+        """Save rows from an iterator of DataFrames for this dataset.
+
+        The schema is built from the first chunk and merged with each
+        following chunk, and each chunk is folded into the summary.  Chunks
+        are inserted by a background thread while the next chunk is read,
+        with at most `IMPORT_QUEUE_SIZE` chunks waiting to be inserted.  The
+        number of rows and the state are set once all chunks are inserted.
+
+        :param chunks: An iterator of DataFrames to save rows from.
+        """
+        queue = Queue(IMPORT_QUEUE_SIZE)
+        errors = []
+        inserter = Thread(target=self.__insert_chunks, args=(queue, errors))
+        inserter.start()
+        num_rows = 0
+
+        try:
+            for dframe in chunks:
+                if errors:
+                    break
+
+                dframe.index = range(num_rows, num_rows + len(dframe))
+
+                if num_rows:
+                    self.merge_schema(dframe)
+                    update_summary(self, dframe.rename(
+                        columns=self.schema.labels_to_slugs))
+                else:
+                    self.build_schema(dframe)
+                    self.summarize(dframe)
+
+                queue.put(dframe)
+                num_rows += len(dframe)
+        finally:
+            queue.put(None)
+            inserter.join()
+
+        if errors:
+            raise errors[0]
+
+        self.update({
+            self.NUM_ROWS: num_rows,
+            self.STATE: self.STATE_READY,
+        })
+
     def save_observations(self, dframe):
         """Save rows in `dframe` for this dataset.
 
@@ -606,6 +890,33 @@ class Dataset(AbstractModel, ImportableDataset):
         """
         return Observation.save(dframe, self)
 
+    def save_range(self, dframe):
+        """Save the rows of a range of a file imported in parallel.
+
+        :param dframe: The DataFrame of rows in the range.
+
+        :returns: A dict of columns to sketches of their distinct values in
+            the range, to merge with `finish_range_import`.
+        """
+        Observation.append(dframe, self)
+
+        return self.__sketch_columns(dframe, self.schema)
+
+    def set_cardinality_sketches(self, sketches):
+        """Store the sketches of the distinct values of columns.
+
+        Sketches stored in the dataset record before are removed.
+
+        :param sketches: A dict of columns to their `CardinalitySketch`.
+        """
+        ColumnState.save_all(self, self.CARDINALITY_SKETCH, {
+            column: sketch.to_json() for column, sketch in sketches.items()})
+
+        if self.CARDINALITY_SKETCHES in self.record:
+            self.collection.update({'_id': self.record['_id']},
+                                   {'$unset': {self.CARDINALITY_SKETCHES: 1}})
+            self.record.pop(self.CARDINALITY_SKETCHES)
+
     def set_olap_type(self, column, olap_type):
         """Set the OLAP Type for this `column` of dataset.
 
@@ -625,7 +936,11 @@ class Dataset(AbstractModel, ImportableDataset):
         self.summarize(self.dframe(), update=True)
 
     def set_schema(self, schema, set_num_columns=True):
-        """Set the schema from an existing one."""
+        """Set the schema from an existing one.
+
+        :param schema: The schema to store.
+        :param set_num_columns: If True also set the number of columns.
+        """
         update_dict = {self.SCHEMA: schema}
 
         if set_num_columns:
@@ -633,6 +948,58 @@ class Dataset(AbstractModel, ImportableDataset):
 
         self.update(update_dict)
 
+    def set_summary_states(self, states, dropped=[]):
+        """Store summary states and drop the states of `dropped` columns.
+
+        :param states: A dict of columns to their summary states.
+        :param dropped: A list of columns to drop the summary states of.
+        """
+        if dropped:
+            ColumnState.delete_all(self, self.SUMMARY_STATE, dropped)
+
+        ColumnState.save_all(self, self.SUMMARY_STATE, states)
+
+    def sorted_column(self, col):
+        """Return the sorted non-null values of `col` and its number of rows.
+
+        The result is cached until the dataset cache is cleared, so that
+        calculations in the same batch fetch and sort the column once.
+
+        :param col: The column to sort.
+
+        :returns: A tuple of a sorted array and the length of the column.
+        """
+        if col not in self.__sorted_columns:
+            if self.__is_cached and col in self.__dframe.columns:
+                column = self.__dframe[col]
+            else:
+                query_args = QueryArgs(select={col: 1})
+                column = self.dframe(query_args=query_args)[col]
+
+            self.__sorted_columns[col] = (
+                np.sort(column.dropna().values), len(column))
+
+        return self.__sorted_columns[col]
+
+    def start_range_import(self, dframe, num_ranges, num_rows):
+        """Save the first of `num_ranges` ranges of rows imported in parallel.
+
+        The schema, encoding and cardinality sketches are built from the rows
+        of the first range, so that the other ranges can be saved and merge
+        their sketches concurrently.
+
+        :param dframe: The DataFrame of rows in the first range.
+        :param num_ranges: The number of ranges being imported.
+        :param num_rows: The number of rows in all ranges.
+        """
+        self.build_schema(dframe)
+        self.update({
+            self.IMPORT_RANGES: num_ranges,
+            self.NUM_ROWS: num_rows,
+        })
+        Observation.append(dframe, self)
+        self.finish_range_import()
+
     def summarize(self, dframe, groups=[], no_cache=False, update=False,
                   flat=False):
         """Build and return a summary of the data in this dataset.
@@ -640,7 +1007,8 @@ class Dataset(AbstractModel, ImportableDataset):
         Return a summary of dframe grouped by `groups`, or the overall
         summary if no groups are specified.
 
-        :param dframe: dframe to summarize
+        :param dframe: dframe to summarize, if None the columns to summarize
+            are read from this dataset.
         :param groups: A list of columns to group on.
         :param no_cache: Do not fetch a cached summary.
         :param flat: Return a flattened list of groups.
@@ -670,6 +1038,15 @@ class Dataset(AbstractModel, ImportableDataset):
 
         return summary
 
+    def summary_states(self, columns=None):
+        """Return the summary states of the columns of this dataset.
+
+        :param columns: If passed only return the states of these columns.
+
+        :returns: A dict of columns to their summary states.
+        """
+        return ColumnState.find_all(self, self.SUMMARY_STATE, columns)
+
     def update(self, record):
         """Update dataset `dataset` with `record`."""
         record[self.UPDATED_AT] = strftime("%Y-%m-%d %H:%M:%S", gmtime())
@@ -678,7 +1055,11 @@ class Dataset(AbstractModel, ImportableDataset):
     def update_observation(self, index, data):
         # check that update is valid
         dframe_from_update(self, [data])
+        row = self.__row_dframe(index)
         Observation.update(self, index, data)
+
+        update_summary(self, row, retract=True)
+        update_summary(self, self.__row_dframe(index))
         call_async(propagate, self, update={'edit': [index, data]})
 
     def update_observations(self, dframe):
@@ -708,6 +1089,131 @@ class Dataset(AbstractModel, ImportableDataset):
     def __add_linked_data(self, link_key, existing_data, new_data):
         self.update({link_key: existing_data + [new_data]})
 
+    def __dframe_cache_key(self, query_args, keep_parent_ids, padded, index,
+                           keep_mongo_keys, keep_state):
+        """Return the key to cache a dframe for these arguments with.
+
+        Only projections of all the rows are cached, for other arguments None
+        is returned.
+        """
+        if padded or query_args and (query_args.query or query_args.distinct
+                                     or query_args.limit or
+                                     query_args.order_by):
+            return None
+
+        # rows may have been written since this record was read, use the
+        # stored version of the rows
+        record = self.collection.find_one(
+            {'_id': self.record['_id']}, {self.DATA_VERSION: 1})
+
+        if record is None:
+            return None
+
+        data_version = record.get(self.DATA_VERSION, 0)
+        select = query_args and query_args.select
+
+        # the record ID differs if a dataset is recreated with the same ID
+        return (self.dataset_id, self.record['_id'], data_version,
+                select and tuple(sorted(select.items())), keep_parent_ids,
+                index, keep_mongo_keys, keep_state)
+
+    def __drop_sketches(self, columns):
+        """Drop the cardinality sketches of `columns`.
+
+        Columns without a sketch are read to build one when rows are next
+        merged into the schema.
+        """
+        ColumnState.delete_all(self, self.CARDINALITY_SKETCH, columns)
+
+    def __increment(self, key, amount=1):
+        """Atomically add `amount` to the number stored for `key`."""
+        record = self.collection.find_and_modify(
+            {'_id': self.record['_id']}, {'$inc': {key: amount}},
+            fields={key: 1}, new=True)
+
+        if record:
+            self.record[key] = record[key]
+
+    def __update_cardinalities(self, row):
+        """Update cardinalities from the summary state after deleting `row`.
+
+        The cardinality sketches of columns which lost a distinct value are
+        dropped, so that they are rebuilt without it when rows are next
+        merged.  Columns without a summary state keep their cardinality and
+        sketch, which are an upper bound until the schema is rebuilt.
+
+        :param row: A DataFrame of the deleted row.
+
+        :returns: True if a column of `row` may have no values left.
+        """
+        schema = self.schema
+        states = self.summary_states(row.columns)
+        emptied = False
+        dropped = []
+
+        for column in row.columns:
+            state = states.get(column)
+
+            if state is None or column not in schema or\
+                    not row[column].notnull().any():
+                continue
+
+            cardinality = state_cardinality(state)
+
+            if cardinality is not None:
+                if cardinality != schema[column].get(CARDINALITY):
+                    dropped.append(column)
+
+                schema[column][CARDINALITY] = cardinality
+
+            emptied = emptied or not state_count(state)
+
+        self.set_schema(schema, set_num_columns=False)
+
+        if dropped:
+            self.__drop_sketches(dropped)
+
+        return emptied
+
+    def __row_dframe(self, index):
+        """Return the row at `index` as a DataFrame, empty if missing."""
+        record = Observation.find_one(self, index).record
+
+        return DataFrame([record] if record else [])
+
+    def __sketch_columns(self, dframe, schema):
+        """Return sketches of the distinct values of the columns of `dframe`.
+
+        :param dframe: The DataFrame with every row of its columns.
+        :param schema: The schema to find the slugs of the columns in.
+
+        :returns: A dict of slugs to sketches.
+        """
+        rename_map = schema.rename_map_for_dframe(dframe)
+
+        return {
+            rename_map.get(column, column): CardinalitySketch.from_values(
+                values.values) for column, values in dframe.iteritems()
+            if rename_map.get(column, column) in schema}
+
+    def __insert_chunks(self, queue, errors):
+        """Insert chunks from `queue` until None is received.
+
+        After an error the remaining chunks are discarded and the error is
+        added to `errors`.
+        """
+        while True:
+            dframe = queue.get()
+
+            if dframe is None:
+                break
+
+            if not errors:
+                try:
+                    Observation.append(dframe, self)
+                except Exception as e:
+                    errors.append(e)
+
     def __maybe_pad(self, dframe, pad):
         if pad:
             if len(dframe.columns):
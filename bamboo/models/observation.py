@@ -1,9 +1,16 @@
+from itertools import izip
 from math import ceil
-from pandas import concat, DataFrame
+import uuid
+
+from bson.objectid import ObjectId
+import numpy as np
+from pandas import DataFrame
 from pymongo.errors import AutoReconnect
 
 from bamboo.core.frame import add_id_column, DATASET_ID, INDEX
+from bamboo.lib.cache import LRUCache
 from bamboo.lib.datetools import now, parse_timestamp_query
+from bamboo.lib.exceptions import ArgumentError
 from bamboo.lib.mongo import MONGO_ID, MONGO_ID_ENCODED
 from bamboo.lib.parsing import parse_columns
 from bamboo.lib.query_args import QueryArgs
@@ -11,6 +18,13 @@ from bamboo.lib.utils import combine_dicts, invert_dict, replace_keys
 from bamboo.models.abstract_model import AbstractModel
 
 
+# the number of datasets to cache the encoding of
+ENCODING_CACHE_SIZE = 1000
+
+# cache of dataset IDs to their encoding version, encoding and decoding
+ENCODING_CACHE = LRUCache(ENCODING_CACHE_SIZE)
+
+
 def add_index(df):
     """Add an encoded index to this DataFrame."""
     if not INDEX in df.columns:
@@ -62,10 +76,51 @@ def update_calculations(record, dataset):
 class Observation(AbstractModel):
 
     __collectionname__ = 'observations'
+    __archivename__ = 'observations_archive'
 
     DELETED_AT = '-1'  # use a short code for key
     ENCODING = 'enc'
     ENCODING_DATASET_ID = '%s_%s' % (DATASET_ID, ENCODING)
+    ENCODING_VERSION = 'encoding_version'  # stored with the dataset
+
+    @classmethod
+    def compact(cls, dataset, deleted_before, archive=True):
+        """Remove the rows of `dataset` deleted before `deleted_before`.
+
+        Rows are fetched and removed in batches of `DB_UPDATE_BATCH_SIZE`.  If
+        `archive` is True each batch is first upserted into the archive
+        collection, so an interrupted compaction can be run again.
+
+        :param dataset: The dataset to compact rows for.
+        :param deleted_before: A datetime, rows deleted before are removed.
+        :param archive: If True, archive the removed rows, default True.
+
+        :returns: The number of rows removed.
+        """
+        # live rows have a deleted at of 0, comparing to a string only
+        # matches the timestamps of deleted rows
+        query = cls.encode({
+            DATASET_ID: dataset.dataset_id,
+            cls.DELETED_AT: {'$lt': deleted_before.isoformat()}},
+            dataset=dataset)
+        select = None if archive else {MONGO_ID: 1}
+        num_removed = 0
+
+        while True:
+            records = list(cls.collection.find(
+                query, select, limit=cls.DB_UPDATE_BATCH_SIZE))
+
+            if not records:
+                break
+
+            if archive:
+                cls.__archive(records)
+
+            cls.collection.remove(
+                {MONGO_ID: {'$in': [record[MONGO_ID] for record in records]}})
+            num_removed += len(records)
+
+        return num_removed
 
     @classmethod
     def delete(cls, dataset, index):
@@ -73,11 +128,19 @@ class Observation(AbstractModel):
 
         :param dataset: The dataset to delete the observation from.
         :param index: The index of the observation to delete.
+
+        :returns: The decoded record of the deleted observation, or None if
+            there is no observation at `index`.
         """
-        query = {INDEX: index, DATASET_ID: dataset.dataset_id}
+        query = {INDEX: index, DATASET_ID: dataset.dataset_id,
+                 cls.DELETED_AT: 0}
         query = cls.encode(query, dataset=dataset)
 
-        cls.__soft_delete(query)
+        record = cls.collection.find_and_modify(
+            query, {'$set': {cls.DELETED_AT: now().isoformat()}})
+        dataset.increment_data_version()
+
+        return record and cls.encode(record, encoding=cls.decoding(dataset))
 
     @classmethod
     def delete_all(cls, dataset, query=None):
@@ -91,6 +154,7 @@ class Observation(AbstractModel):
         query = cls.encode(query, dataset=dataset)
 
         super(cls, cls()).delete(query)
+        dataset.increment_data_version()
 
     @classmethod
     def delete_columns(cls, dataset, columns):
@@ -104,24 +168,27 @@ class Observation(AbstractModel):
             cls.encode({DATASET_ID: dataset.dataset_id}, encoding=encoding),
             cls.encode({c: 1 for c in columns}, encoding=encoding))
 
+        cls.__update_encoding_version(dataset)
+        dataset.increment_data_version()
+
     @classmethod
     def delete_encoding(cls, dataset):
         query = {cls.ENCODING_DATASET_ID: dataset.dataset_id}
 
         super(cls, cls()).delete(query)
+        ENCODING_CACHE.pop(dataset.dataset_id)
 
     @classmethod
     def encoding(cls, dataset, encoded_dframe=None):
-        record = super(cls, cls).find_one({
-            cls.ENCODING_DATASET_ID: dataset.dataset_id}).record
+        encoding = cls.__cached_encoding(dataset)[0]
 
-        if record is None and encoded_dframe is not None:
+        if encoding is None and encoded_dframe is not None:
             encoding = cls.__make_encoding(encoded_dframe)
             cls.__store_encoding(dataset, encoding)
 
             return cls.encoding(dataset)
 
-        return record[cls.ENCODING] if record else None
+        return encoding
 
     @classmethod
     def encode(cls, dict_, dataset=None, encoding=None):
@@ -132,7 +199,7 @@ class Observation(AbstractModel):
 
     @classmethod
     def decoding(cls, dataset):
-        return invert_dict(cls.encoding(dataset))
+        return cls.__cached_encoding(dataset)[1]
 
     @classmethod
     def find(cls, dataset, query_args=None, as_cursor=False,
@@ -178,6 +245,7 @@ class Observation(AbstractModel):
 
         cls.__batch_update(encoded_dframe, encoding)
         cls.__store_encoding(dataset, encoding)
+        dataset.increment_data_version()
         dataset.update_stats(df, update=True)
 
     @classmethod
@@ -206,7 +274,7 @@ class Observation(AbstractModel):
         encoding = cls.encoding(dataset, encoded_dframe)
 
         cls.__batch_save(encoded_dframe, encoding)
-        dataset.clear_summary_stats()
+        dataset.increment_data_version()
 
     @classmethod
     def save(cls, dframe, dataset):
@@ -231,6 +299,7 @@ class Observation(AbstractModel):
         encoding = cls.encoding(dataset, encoded_dframe)
 
         cls.__batch_save(encoded_dframe, encoding)
+        dataset.increment_data_version()
 
     @classmethod
     def update(cls, dataset, index, record):
@@ -243,51 +312,115 @@ class Observation(AbstractModel):
         :param dex: The index of the row to update.
         :param record: The dictionary to update the row with.
         """
-        previous_record = cls.find_one(dataset, index).record
-        previous_record.pop(MONGO_ID)
-        record = combine_dicts(previous_record, record)
-        record = update_calculations(record, dataset)
+        cls.update_rows(dataset, [(index, record)])
 
-        record = cls.encode(record, dataset=dataset)
+    @classmethod
+    def update_rows(cls, dataset, updates):
+        """Update dataset rows by index.
 
-        cls.delete(dataset, index)
+        Each record dictionary will update, not replace, the data in the row
+        at its index.  The rows are fetched in one query, then for each batch
+        the rows are soft deleted and the updated rows inserted in one bulk
+        request.  The updated rows are given their IDs up front and upserted,
+        so that a batch which is sent again does not insert them twice.
 
-        super(cls, cls()).save(record)
+        :param dataset: The dataset to update rows for.
+        :param updates: A list of tuples of the index of a row and the
+            dictionary to update the row with.
+
+        :raises: `ArgumentError` if there is no row at an index, in which case
+            no rows are updated.
+        """
+        def command(edits, encoding):
+            bulk = cls.collection.initialize_unordered_bulk_op()
+            deleted_at = now().isoformat()
+
+            for previous_id, record in edits:
+                bulk.find({MONGO_ID: previous_id, cls.DELETED_AT: 0}).\
+                    update_one({'$set': {cls.DELETED_AT: deleted_at}})
+                bulk.find({MONGO_ID: record[MONGO_ID]}).upsert().replace_one(
+                    record)
+
+            bulk.execute()
+
+        encoding = cls.encoding(dataset)
+        decoding = invert_dict(encoding)
+        query = cls.encode({
+            INDEX: {'$in': [index for index, _ in updates]},
+            DATASET_ID: dataset.dataset_id,
+            cls.DELETED_AT: 0}, encoding=encoding)
+        index_key = encoding.get(INDEX, INDEX)
+        previous_records = {
+            record[index_key]: record for record in cls.collection.find(query)}
+        missing = [index for index, _ in updates
+                   if index not in previous_records]
+
+        if missing:
+            raise ArgumentError('No row exists at index %s' % ', '.join(
+                str(index) for index in missing))
+
+        edits = []
+
+        for index, record in updates:
+            previous_record = previous_records[index]
+            previous_id = previous_record.pop(MONGO_ID)
+            record = combine_dicts(
+                replace_keys(previous_record, decoding), record)
+            record = update_calculations(record, dataset)
+            record = replace_keys(record, encoding)
+            record[MONGO_ID] = ObjectId()
+            edits.append((previous_id, record))
+
+        cls.__batch_command_wrapper(command, edits, encoding,
+                                    cls.DB_UPDATE_BATCH_SIZE)
+        dataset.increment_data_version()
 
     @classmethod
-    def batch_read_dframe_from_cursor(cls, dataset, observations, distinct,
-                                      limit):
-        """Read a DataFrame from a MongoDB Cursor in batches."""
-        dframes = []
-        batch = 0
-        decoding = cls.decoding(dataset)
+    def batch_read_dframe_from_cursor(cls, dataset, observations):
+        """Read a DataFrame from a MongoDB Cursor.
 
-        while True:
-            start = batch * cls.DB_READ_BATCH_SIZE
-            end = start + cls.DB_READ_BATCH_SIZE
+        The cursor is iterated once, fetching records from MongoDB in batches
+        of `DB_READ_BATCH_SIZE`.  The values for each key are appended to a
+        list for that key, padded with NaN for records without the key, and
+        the keys are decoded once per column.
+        """
+        columns = {}
+        num_rows = 0
 
-            if limit > 0 and end > limit:
-                end = limit
+        for record in observations.batch_size(cls.DB_READ_BATCH_SIZE):
+            for key, value in record.iteritems():
+                values = columns.get(key)
 
-            # if there is a limit this may occur, and we are done
-            if start >= end:
-                break
+                if values is None:
+                    values = columns[key] = [np.nan] * num_rows
 
-            current_observations = [
-                replace_keys(ob, decoding) for ob in observations[start:end]]
+                values.append(value)
 
-            # if the batches exhausted the data
-            if not len(current_observations):
-                break
+            num_rows += 1
 
-            dframes.append(DataFrame(current_observations))
+            if len(record) < len(columns):
+                for values in columns.itervalues():
+                    if len(values) < num_rows:
+                        values.append(np.nan)
 
-            if not distinct:
-                observations.rewind()
+        if not num_rows:
+            return DataFrame()
 
-            batch += 1
+        decoding = cls.decoding(dataset)
 
-        return concat(dframes) if len(dframes) else DataFrame()
+        return DataFrame({decoding.get(key, key): values
+                          for key, values in columns.iteritems()})
+
+    @classmethod
+    def __archive(cls, records):
+        bulk = cls.set_collection(
+            cls.__archivename__).initialize_unordered_bulk_op()
+
+        for record in records:
+            bulk.find({MONGO_ID: record[MONGO_ID]}).upsert().replace_one(
+                record)
+
+        bulk.execute()
 
     @classmethod
     def __batch_save(cls, dframe, encoding):
@@ -295,8 +428,8 @@ class Observation(AbstractModel):
 
         :param dframe: A DataFrame to save in the current model.
         """
-        def command(records, encoding):
-            cls.collection.insert(records)
+        def command(dframe, encoding):
+            cls.collection.insert(cls.__encode_records(dframe, encoding))
 
         batch_size = cls.DB_SAVE_BATCH_SIZE
 
@@ -304,60 +437,75 @@ class Observation(AbstractModel):
 
     @classmethod
     def __batch_update(cls, dframe, encoding):
-        """Update records in batches to avoid document size maximum setting.
+        """Update records in batches with one bulk request for each batch.
 
         DataFrame must have column with record (object) ids.
 
         :param dfarme: The DataFrame to update.
         """
-        def command(records, encoding):
+        def command(dframe, encoding):
             # Encode the reserved key to access the row ID.
             mongo_id_key = encoding.get(MONGO_ID_ENCODED, MONGO_ID_ENCODED)
+            bulk = cls.collection.initialize_unordered_bulk_op()
 
-            # MongoDB has no batch updates.
-            for record in records:
-                spec = {MONGO_ID: record[mongo_id_key]}
-                del record[mongo_id_key]
-                doc = {'$set': record}
-                cls.collection.update(spec, doc)
+            for record in cls.__encode_records(dframe, encoding):
+                spec = {MONGO_ID: record.pop(mongo_id_key)}
+                bulk.find(spec).update_one({'$set': record})
+
+            bulk.execute()
 
         cls.__batch_command_wrapper(command, dframe, encoding,
-                                    cls.DB_SAVE_BATCH_SIZE)
+                                    cls.DB_UPDATE_BATCH_SIZE)
 
     @classmethod
-    def __batch_command_wrapper(cls, command, df, encoding, batch_size):
+    def __batch_command_wrapper(cls, command, data, encoding, batch_size):
         try:
-            cls.__batch_command(command, df, encoding, batch_size)
+            cls.__batch_command(command, data, encoding, batch_size)
         except AutoReconnect:
             batch_size /= 2
 
             # If batch size drop is less than MIN_BATCH_SIZE, assume the
             # records are too large or there is another error and fail.
             if batch_size >= cls.MIN_BATCH_SIZE:
-                cls.__batch_command_wrapper(command, df, encoding, batch_size)
+                cls.__batch_command_wrapper(
+                    command, data, encoding, batch_size)
 
     @classmethod
-    def __batch_command(cls, command, dframe, encoding, batch_size):
-        batches = int(ceil(float(len(dframe)) / batch_size))
+    def __batch_command(cls, command, data, encoding, batch_size):
+        """Run `command` on slices of at most `batch_size` rows of `data`.
+
+        :param data: A DataFrame or a list to slice.
+        """
+        batches = int(ceil(float(len(data)) / batch_size))
 
         for batch in xrange(0, batches):
             start = batch * batch_size
             end = start + batch_size
-            current_dframe = dframe[start:end]
-            records = cls.__encode_records(current_dframe, encoding)
-            command(records, encoding)
+            command(data[start:end], encoding)
 
     @classmethod
     def __encode_records(cls, dframe, encoding):
-        return [cls.__encode_record(row.to_dict(), encoding)
-                for (_, row) in dframe.iterrows()]
+        """Build the documents to store for the rows of `dframe`.
+
+        The columns are renamed to their encoded keys once and the values are
+        converted to Python objects a column at a time, with null dates
+        stored as None.  Each document is then zipped from a row of values.
+        """
+        dframe = dframe.rename(columns=encoding)
+        keys = dframe.columns.tolist() + [cls.DELETED_AT]
+        columns = [cls.__encode_column(dframe[key]) for key in dframe.columns]
+        columns.append([0] * len(dframe))
+
+        return [dict(izip(keys, row)) for row in izip(*columns)]
 
     @classmethod
-    def __encode_record(cls, row, encoding):
-        encoded = replace_keys(row, encoding)
-        encoded[cls.DELETED_AT] = 0
+    def __encode_column(cls, column):
+        values = column.astype(object).values
 
-        return encoded
+        if column.dtype.kind == 'M':
+            values[column.isnull().values] = None
+
+        return values
 
     @classmethod
     def __make_encoding(cls, dframe, start=0):
@@ -365,11 +513,6 @@ class Observation(AbstractModel):
         columns = [DATASET_ID] + sorted(dframe.columns - [DATASET_ID])
         return {v: str(start + i) for (i, v) in enumerate(columns)}
 
-    @classmethod
-    def __soft_delete(cls, query):
-        cls.collection.update(query,
-                              {'$set': {cls.DELETED_AT: now().isoformat()}})
-
     @classmethod
     def __store_encoding(cls, dataset, encoding):
         """Store encoded columns with dataset.
@@ -381,3 +524,47 @@ class Observation(AbstractModel):
                   cls.ENCODING: encoding}
         super(cls, cls()).delete({cls.ENCODING_DATASET_ID: dataset.dataset_id})
         super(cls, cls()).save(record)
+        cls.__update_encoding_version(dataset)
+
+    @classmethod
+    def __cached_encoding(cls, dataset):
+        """Return the encoding and decoding for `dataset`.
+
+        They are cached for the encoding version stored with the dataset.  A
+        missing encoding is not cached, as it may be stored by another
+        process without this dataset being reloaded, nor is an encoding for
+        a dataset without a version.
+        """
+        version = cls.__encoding_version(dataset)
+        cached = ENCODING_CACHE.get(dataset.dataset_id)
+
+        if version and cached and cached[0] == version:
+            return cached[1:]
+
+        record = super(cls, cls).find_one({
+            cls.ENCODING_DATASET_ID: dataset.dataset_id}).record
+
+        if record is None:
+            return None, {}
+
+        encoding = record[cls.ENCODING]
+        decoding = invert_dict(encoding)
+
+        if version:
+            ENCODING_CACHE.set(dataset.dataset_id,
+                               (version, encoding, decoding))
+
+        return encoding, decoding
+
+    @classmethod
+    def __encoding_version(cls, dataset):
+        return (dataset.record or {}).get(cls.ENCODING_VERSION)
+
+    @classmethod
+    def __update_encoding_version(cls, dataset):
+        """Stamp `dataset` with a new encoding version.
+
+        Encodings cached for the previous version are no longer used.
+        """
+        ENCODING_CACHE.pop(dataset.dataset_id)
+        dataset.update({cls.ENCODING_VERSION: uuid.uuid4().hex})
@@ -5,7 +5,7 @@ import simplejson as json
 from bamboo.controllers.abstract_controller import AbstractController
 from bamboo.controllers.calculations import Calculations
 from bamboo.controllers.datasets import Datasets
-from bamboo.core.frame import DATASET_ID
+from bamboo.core.frame import DATASET_ID, STATE_KEY_PREFIX
 from bamboo.models.calculation import Calculation
 from bamboo.models.dataset import Dataset
 from bamboo.tests.decorators import requires_async
@@ -499,6 +499,59 @@ class TestCalculations(TestBase):
         self.assertEqual(agg_df.get_value(0, 'wp_newest'), 'D')
         self.assertEqual(current_num_rows, previous_num_rows + 2)
 
+    def test_update_after_newest_without_state_columns(self):
+        dataset_id = self._post_file('wp_data.csv')
+        self.controller.create(dataset_id, 'newest(submit_date,wp_id)',
+                               'wp_newest')
+        agg_dataset = Dataset.find_one(dataset_id).aggregated_dataset('')
+
+        # aggregations stored before the state columns were added
+        agg_dframe = agg_dataset.dframe(keep_parent_ids=True, keep_state=True)
+        agg_dataset.replace_observations(agg_dframe.drop(
+            [STATE_KEY_PREFIX + 'wp_newest_index',
+             STATE_KEY_PREFIX + 'wp_newest_max'], axis=1))
+
+        update = {
+            'submit_date': '2013-01-05',
+            'wp_id': 'D',
+            'functional': 'no',
+        }
+        self.__post_update(dataset_id, update)
+
+        agg_dframe = Dataset.find_one(dataset_id).aggregated_dataset(
+            '').dframe(keep_state=True)
+
+        self.assertEqual(agg_dframe.get_value(0, 'wp_newest'), 'D')
+        self.assertTrue(STATE_KEY_PREFIX + 'wp_newest_max' in
+                        agg_dframe.columns)
+
+    def test_update_after_agg_without_state_columns(self):
+        dataset_id = self._post_file()
+        group = 'food_type'
+        self.controller.create(dataset_id, 'std(amount)', 'std_amount',
+                               group=group)
+        agg_dataset = Dataset.find_one(dataset_id).aggregated_dataset(group)
+
+        # aggregations stored before the state columns were added
+        agg_dframe = agg_dataset.dframe(keep_parent_ids=True, keep_state=True)
+        state_columns = [column for column in agg_dframe.columns
+                         if column.startswith(STATE_KEY_PREFIX)]
+        self.assertTrue(state_columns)
+        agg_dataset.replace_observations(
+            agg_dframe.drop(state_columns, axis=1))
+
+        self.__post_update(dataset_id, {'food_type': 'lunch', 'amount': 10})
+
+        dataset = Dataset.find_one(dataset_id)
+        expected = dataset.dframe().groupby(group)['amount'].std().dropna()
+        agg_dframe = dataset.aggregated_dataset(group).dframe(
+            keep_state=True).set_index(group)
+
+        self.assertTrue(set(state_columns).issubset(agg_dframe.columns))
+
+        for food_type, value in expected.iteritems():
+            self.assertAlmostEqual(value, agg_dframe['std_amount'][food_type])
+
     @requires_async
     def test_update_after_agg_group(self):
         dataset_id = self._post_file('wp_data.csv')
@@ -540,7 +593,8 @@ class TestCalculations(TestBase):
             dataset = Dataset.find_one(dataset_id)
 
             if dataset.aggregated_dataset(group) and all(
-                    [not c.is_pending for c in dataset.calculations()]):
+                    [not (c.is_pending or c.is_running)
+                     for c in dataset.calculations()]):
                 break
             sleep(self.SLEEP_DELAY)
 
@@ -619,7 +673,8 @@ class TestCalculations(TestBase):
         while True:
             dataset = Dataset.find_one(dataset_id)
             calcs_not_pending = [
-                c.state != c.STATE_PENDING for c in dataset.calculations()]
+                not (c.is_pending or c.is_running)
+                for c in dataset.calculations()]
 
             if not len(dataset.pending_updates) and all(calcs_not_pending):
                 break
@@ -4,10 +4,12 @@ from tempfile import NamedTemporaryFile
 from time import mktime, sleep
 from urllib2 import URLError
 
+import cherrypy
 from mock import patch
 import simplejson as json
 
 from bamboo.controllers.datasets import Datasets
+from bamboo.core.frame import INDEX
 from bamboo.lib.datetools import now
 from bamboo.lib.jsontools import df_to_jsondict
 from bamboo.lib.query_args import QueryArgs
@@ -74,6 +76,35 @@ class TestDatasets(TestAbstractDatasets):
         results = self._test_summary_built(result)
         self._test_summary_no_group(results)
 
+    def test_create_from_csv_chunked(self):
+        result = self.__upload_mocked_file(chunksize=5)
+        dataset = Dataset.find_one(result[Dataset.ID])
+        dframe = dataset.dframe(index=True)
+        expected = self.get_data(self._file_name)
+
+        self.assertEqual(Dataset.STATE_READY, dataset.state)
+        self.assertEqual(dataset.num_rows, len(expected))
+        self.assertEqual(sorted(dframe[INDEX].tolist()),
+                         range(len(expected)))
+        self.assertTrue(all(isinstance(d, datetime) for d in
+                            dframe.submit_date))
+        self.assertEqual(dataset.schema['rating'][CARDINALITY],
+                         expected.rating.nunique())
+
+        results = self._test_summary_built(result)
+        self._test_summary_no_group(results)
+
+    def test_create_from_csv_parallel_false(self):
+        with patch('bamboo.lib.readers.import_csv_ranges') as mock:
+            self.__upload_mocked_file(parallel='false')
+
+        self.assertFalse(mock.called)
+
+        with patch('bamboo.lib.readers.import_csv_ranges') as mock:
+            self.__upload_mocked_file(parallel='true')
+
+        self.assertTrue(mock.called)
+
     def test_create_from_csv_unicode(self):
         dframe_length = 1
         dframe_data = [{u'\u03c7': u'\u03b1', u'\u03c8': u'\u03b2'}]
@@ -253,6 +284,31 @@ class TestDatasets(TestAbstractDatasets):
         self.assertTrue(isinstance(results[0], dict))
         self.assertEqual(len(results), self.NUM_ROWS)
 
+    def test_show_not_modified(self):
+        dataset_id = self._post_file()
+        self.controller.show(dataset_id)
+        etag = cherrypy.response.headers['ETag']
+
+        try:
+            cherrypy.request.headers['If-None-Match'] = etag
+
+            with patch.object(Dataset, 'dframe') as mock:
+                result = self.controller.show(dataset_id)
+
+            self.assertEqual(result, '')
+            self.assertFalse(mock.called)
+            self.assertEqual(cherrypy.response.status,
+                             self.controller.NOT_MODIFIED_STATUS_CODE)
+
+            # deleting a row changes the data version
+            self.controller.row_delete(dataset_id, 0)
+            results = json.loads(self.controller.show(dataset_id))
+
+            self.assertEqual(len(results), self.NUM_ROWS - 1)
+            self.assertNotEqual(cherrypy.response.headers['ETag'], etag)
+        finally:
+            cherrypy.request.headers.pop('If-None-Match', None)
+
     def test_show_csv(self):
         dataset_id = self._post_file()
         results = self.controller.show(dataset_id, format='csv')
@@ -147,6 +147,17 @@ class TestDatasetsEdit(TestAbstractDatasets):
         all_observations = Observation.find(dataset, include_deleted=True)
         self.assertEqual(self.NUM_ROWS + 1, len(all_observations))
 
+    def test_edit_row_missing_index(self):
+        dataset_id = self._post_file()
+        update = {'amount': 10}
+
+        result = json.loads(self.controller.row_update(
+            dataset_id, self.NUM_ROWS, json.dumps(update)))
+
+        self.assertTrue(Datasets.ERROR in result)
+        self.assertEqual(self.NUM_ROWS, len(Observation.find(
+            Dataset.find_one(dataset_id), include_deleted=True)))
+
     def test_edit_row_with_calculation(self):
         amount_before = 9
         amount_after = 10
@@ -234,3 +234,23 @@ class TestDatasetsSummary(TestAbstractDatasets):
 
         results = self._test_summary_results(results)
         self.assertEqual(len(results[query_column].keys()), 1)
+
+    def test_summary_after_update_and_delete(self):
+        dataset_id = self._post_file()
+        self.controller.summary(
+            dataset_id, select=self.controller.SELECT_ALL_FOR_SUMMARY)
+
+        self._put_row_updates(dataset_id)
+        self.controller.row_delete(dataset_id, 0)
+
+        results = self._test_summary_results(self.controller.summary(
+            dataset_id, select=self.controller.SELECT_ALL_FOR_SUMMARY))
+        dframe = Dataset.find_one(dataset_id).dframe()
+        amount = results['amount'][SUMMARY]
+
+        self.assertEqual(amount['count'], dframe['amount'].count())
+        self.assertAlmostEqual(amount['mean'], dframe['amount'].mean())
+        self.assertAlmostEqual(amount['std'], dframe['amount'].std())
+        self.assertAlmostEqual(amount['50%'], dframe['amount'].median())
+        self.assertEqual(results['rating'][SUMMARY],
+                         dict(dframe['rating'].value_counts().iteritems()))
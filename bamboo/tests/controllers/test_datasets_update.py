@@ -109,3 +109,47 @@ class TestDatasetsUpdate(TestAbstractDatasetsUpdate):
         self._verify_dataset(
             self.merged_dataset2_id,
             'updates/update_agg2/merged_dataset2.pkl')
+
+    def test_datasets_update_aggregation_of_merged(self):
+        self.calculations.create(self.merged_dataset2_id, 'count()', 'rows')
+        result = json.loads(
+            self.controller.aggregations(self.merged_dataset2_id))
+        aggregated_dataset2_id = result['']
+
+        # the rows from the aggregated parent are replaced on each update
+        for _ in xrange(2):
+            self._put_row_updates(self.dataset2_id)
+            merged_dframe = Dataset.find_one(self.merged_dataset2_id).dframe()
+            a_dframe = Dataset.find_one(aggregated_dataset2_id).dframe()
+
+            self.assertEqual(len(merged_dframe), a_dframe['rows'][0])
+
+    def test_datasets_update_merged_num_rows(self):
+        # the rows from the aggregated parent are replaced on each update
+        for _ in xrange(2):
+            self._put_row_updates(self.dataset2_id)
+            merged_dataset = Dataset.find_one(self.merged_dataset2_id)
+
+            self.assertEqual(merged_dataset.num_rows,
+                             len(merged_dataset.dframe()))
+
+    def test_datasets_update_merged_summary(self):
+        Dataset.find_one(self.merged_dataset2_id).summarize(None)
+
+        # the rows from the aggregated parent are replaced on each update
+        for _ in xrange(2):
+            self._put_row_updates(self.dataset2_id)
+
+        merged_dataset = Dataset.find_one(self.merged_dataset2_id)
+        summary = merged_dataset.summarize(None)
+        expected = merged_dataset.summarize(
+            merged_dataset.dframe(), no_cache=True)
+
+        for column, column_summary in expected.items():
+            stats = column_summary['summary']
+            result = summary[column]['summary']
+
+            if merged_dataset.is_dimension(column):
+                self.assertEqual(result, stats)
+            else:
+                self.assertEqual(result['count'], stats['count'])
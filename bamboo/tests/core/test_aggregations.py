@@ -2,8 +2,15 @@ from collections import defaultdict
 import pickle
 
 import numpy as np
+from pandas import DataFrame, Series
 
+from bamboo.core.aggregations import AGGREGATIONS
+from bamboo.core.calculator import calculate_columns
+from bamboo.core.frame import STATE_KEY_PREFIX
+from bamboo.models.calculation import Calculation
+from bamboo.models.dataset import Dataset
 from bamboo.tests.core.test_calculator import TestCalculator
+from bamboo.tests.test_base import TestBase
 
 
 AGG_CALCS_TO_DEPS = {
@@ -147,3 +154,152 @@ class TestAggregations(TestCalculator):
     def test_aggregation_with_multigroup(self):
         self.group = 'food_type,rating'
         self._test_aggregation()
+
+    def test_aggregations_with_same_group(self):
+        self.group = 'food_type'
+        formulas = ['max(amount)', 'ratio(amount, gps_latitude)',
+                    'sum(amount)']
+        calculations = []
+
+        for idx, formula in enumerate(formulas):
+            calculation = Calculation()
+            calculation.save(self.dataset, formula, 'test-%s' % idx,
+                             self.group)
+            calculations.append(calculation)
+
+        calculate_columns(self.dataset, calculations)
+
+        linked_dset = self.dataset.aggregated_dataset(self.group)
+        linked_dframe = linked_dset.dframe()
+        labels_to_slugs = linked_dset.schema.labels_to_slugs
+
+        for idx, formula in enumerate(formulas):
+            name = labels_to_slugs['test-%s' % idx]
+            results = self.GROUP_TO_RESULTS[self.group][formula]
+
+            for _, row in linked_dframe.iterrows():
+                self.assertAlmostEqual(
+                    row[name], results[row[self.group]], self.places)
+
+    def test_quantile_state_is_internal(self):
+        self.group = 'food_type'
+        calculation = Calculation()
+        calculation.save(self.dataset, 'quantile(amount)', 'test-0',
+                         self.group)
+        calculate_columns(self.dataset, [calculation])
+
+        linked_dset = self.dataset.aggregated_dataset(self.group)
+        columns = linked_dset.dframe().columns
+        state_columns = [column for column in
+                         linked_dset.dframe(keep_state=True).columns
+                         if column not in columns]
+
+        self.assertEqual(len(state_columns), 1)
+        self.assertFalse(state_columns[0] in linked_dset.schema)
+        self.assertFalse(
+            state_columns[0] in linked_dset.stats.get(Dataset.ALL, {}))
+
+
+class TestAggregationReduce(TestBase):
+
+    def setUp(self):
+        TestBase.setUp(self)
+        self.dframe = DataFrame({
+            'food_type': ['lunch', 'dinner', 'lunch', 'snack', 'dinner'],
+            'amount': [1.0, 2.0, 3.0, 4.0, np.nan],
+        })
+
+    def _columns(self, dframe, formula_name):
+        def column(values):
+            return Series(values, index=dframe.index, name='result')
+
+        values = dframe['amount'].values
+
+        if formula_name == 'count':
+            values = values > 1
+
+        columns = [column(values)]
+
+        if formula_name == 'newest':
+            columns.append(column(dframe['food_type'].values))
+        elif formula_name == 'pearson':
+            columns.append(column(dframe['gps_alt'].values))
+        elif formula_name == 'quantile':
+            columns.append(column([0.25] * len(dframe)))
+
+        return columns
+
+    def _reduce(self, formula_name, groups, places=None):
+        aggregation = AGGREGATIONS[formula_name]
+        stored_dframe = self.dframe[:3]
+        new_dframe = self.dframe[3:]
+
+        stored = aggregation('result', groups, stored_dframe).eval(
+            self._columns(stored_dframe, formula_name))
+        reduced = aggregation('result', groups, new_dframe).reduce(
+            stored, self._columns(new_dframe, formula_name))
+        expected = aggregation('result', groups, self.dframe).eval(
+            self._columns(self.dframe, formula_name))
+
+        if groups:
+            reduced = reduced.set_index(groups).sort_index()
+            expected = expected.set_index(groups).sort_index()
+
+        if places is None:
+            self.assertEqual(reduced['result'].tolist(),
+                             expected['result'].tolist())
+        else:
+            for result, value in zip(reduced['result'], expected['result']):
+                self.assertAlmostEqual(result, value, places)
+
+    def test_reduce(self):
+        for formula_name in ['argmax', 'count', 'max', 'mean', 'min',
+                             'newest', 'sum']:
+            self._reduce(formula_name, [])
+
+    def test_reduce_with_group(self):
+        for formula_name in ['argmax', 'count', 'max', 'mean', 'min',
+                             'newest', 'sum']:
+            self._reduce(formula_name, ['food_type'])
+
+    def test_argmax_with_group(self):
+        self.dframe['amount'] = [1.0, 2.0, 1.0, 4.0, 2.0]
+        dframe = AGGREGATIONS['argmax']('result', ['food_type'], self.dframe)\
+            .eval(self._columns(self.dframe, 'argmax')).set_index('food_type')
+
+        # ties take the largest index
+        self.assertEqual(dframe['result'].to_dict(),
+                         {'dinner': 4, 'lunch': 2, 'snack': 3})
+
+    def test_argmax_ties(self):
+        self.dframe['amount'] = [1.0, 4.0, 1.0, 4.0, 2.0]
+        dframe = AGGREGATIONS['argmax']('result', [], self.dframe).eval(
+            self._columns(self.dframe, 'argmax'))
+
+        # ties take the largest index without a group too
+        self.assertEqual(dframe['result'][0], 3)
+        self.assertTrue(isinstance(dframe['result'][0], (int, np.integer)))
+
+    def test_newest_skips_null_values(self):
+        self.dframe['amount'] = [1.0, 2.0, 3.0, 4.0, 5.0]
+        self.dframe['food_type'] = ['lunch', 'dinner', 'lunch', None, None]
+        dframe = AGGREGATIONS['newest']('result', [], self.dframe).eval(
+            self._columns(self.dframe, 'newest'))
+
+        self.assertEqual(dframe['result'][0], 'lunch')
+        self.assertEqual(dframe[STATE_KEY_PREFIX + 'result_index'][0], 2)
+
+    def test_reduce_moments(self):
+        self.dframe = DataFrame({
+            'food_type': ['lunch', 'dinner'] * 10,
+            'amount': np.arange(20.0) ** 1.5,
+            'gps_alt': np.sin(np.arange(20.0)),
+        })
+
+        for formula_name in ['pearson', 'std', 'var']:
+            for groups in [[], ['food_type']]:
+                self._reduce(formula_name, groups, places=9)
+
+    def test_reduce_quantile(self):
+        for groups in [[], ['food_type']]:
+            self._reduce('quantile', groups, places=9)
@@ -0,0 +1,69 @@
+import numpy as np
+from scipy.stats import percentileofscore
+
+from bamboo.core.operations import percentile_of_scores, row_wise_column
+from bamboo.core.parser import Parser
+from bamboo.lib.datetools import recognize_dates
+from bamboo.models.dataset import Dataset
+from bamboo.tests.core.test_calculations import CALCS_TO_DEPS, DYNAMIC
+from bamboo.tests.test_base import TestBase
+
+
+class TestOperations(TestBase):
+
+    def setUp(self):
+        TestBase.setUp(self)
+        self.dataset = Dataset()
+        self.dataset.save(
+            self.test_dataset_ids['good_eats_with_calculations.csv'])
+        dframe = recognize_dates(
+            self.get_data('good_eats_with_calculations.csv'))
+        self.dataset.save_observations(dframe)
+        self.dframe = self.dataset.dframe()
+
+    def _assert_columns_equal(self, column, expected, formula):
+        self.assertEqual(len(column), len(expected))
+
+        for value, expected_value in zip(column, expected):
+            msg = '%s != %s, formula: %s' % (value, expected_value, formula)
+
+            try:
+                value = np.float64(value)
+                expected_value = np.float64(expected_value)
+            except ValueError:
+                self.assertEqual(value, expected_value, msg)
+                continue
+
+            if np.isnan(value) and np.isnan(expected_value):
+                continue
+
+            self.assertAlmostEqual(value, expected_value, 5, msg)
+
+    def test_column_matches_row_wise_eval(self):
+        for formula in CALCS_TO_DEPS.keys():
+            if formula in DYNAMIC:
+                continue
+
+            function = Parser.parse(formula)[0][0]
+            column = function.column(self.dframe, self.dataset)
+            expected = row_wise_column(function, self.dframe, self.dataset)
+
+            self.assertTrue(column.index.equals(self.dframe.index))
+            self._assert_columns_equal(column, expected, formula)
+
+    def test_column_for_constant(self):
+        function = Parser.parse('-9 + 5')[0][0]
+        column = function.column(self.dframe, self.dataset)
+
+        self.assertEqual(len(column), len(self.dframe))
+        self.assertTrue(all(column == -4))
+
+    def test_percentile_of_scores(self):
+        values = [3.0, 1.0, 2.0, 2.0, np.nan, 5.0]
+        scores = [0.0, 1.0, 2.0, 4.0, 5.0, 6.0]
+        sorted_values = np.sort([v for v in values if not np.isnan(v)])
+
+        result = percentile_of_scores(sorted_values, len(values), scores)
+
+        for score, value in zip(scores, result):
+            self.assertAlmostEqual(percentileofscore(values, score), value)
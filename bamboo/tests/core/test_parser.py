@@ -49,3 +49,21 @@ class TestParser(TestBase):
 
         for bad_formula in bad_formulas:
             self.assertRaises(ParseError, Parser.parse, bad_formula)
+
+    def test_parse_uses_cache(self):
+        formula = 'amount + 2'
+        Parser.parse(formula)
+        hits = Parser.cache_info()['hits']
+
+        functions, aggregation = Parser.parse(formula)
+
+        self.assertEqual(Parser.cache_info()['hits'], hits + 1)
+        self.assertEqual(aggregation, None)
+        self.assertEqual(functions[0].eval(self.row, self.dataset), 3)
+
+    def test_parse_aggregation_uses_cache(self):
+        for _ in xrange(2):
+            functions, aggregation = Parser.parse('sum(amount)')
+
+            self.assertEqual(aggregation, 'sum')
+            self.assertEqual(len(functions), 1)
@@ -0,0 +1,63 @@
+from bamboo.core.operations import EvalReference, EvalValue
+from bamboo.core.parser import Parser
+from bamboo.core.planner import CalculationPlan, fold_constants
+from bamboo.lib.datetools import recognize_dates
+from bamboo.lib.parsing import build_columns
+from bamboo.models.dataset import Dataset
+from bamboo.tests.test_base import TestBase
+
+
+class TestPlanner(TestBase):
+
+    def setUp(self):
+        TestBase.setUp(self)
+        self.dataset = Dataset()
+        self.dataset.save(self.test_dataset_ids['good_eats.csv'])
+        self.dataset.save_observations(
+            recognize_dates(self.get_data('good_eats.csv')))
+        self.dframe = self.dataset.dframe()
+
+    def test_fold_constants(self):
+        function = Parser.parse('date("09-04-2012") - submit_date')[0][0]
+        folded = fold_constants(function, self.dataset)
+
+        self.assertTrue(isinstance(folded.value[0], EvalValue))
+        self.assertEqual(folded.value[2].key(), function.value[2].key())
+
+        # the parsed function is unchanged
+        self.assertFalse(isinstance(function.value[0], EvalValue))
+
+    def test_fold_constant_formula(self):
+        function = Parser.parse('-9 + 5')[0][0]
+        folded = fold_constants(function, self.dataset)
+
+        self.assertTrue(isinstance(folded, EvalValue))
+        self.assertEqual(folded.value, -4)
+
+    def test_shared_subterms(self):
+        formulas = [
+            'amount + gps_alt',
+            '(amount + gps_alt) * gps_precision',
+            '(amount + gps_alt) ^ 2 + 100',
+        ]
+        plan = CalculationPlan(self.dataset, formulas, self.dframe.columns)
+
+        self.assertEqual(len(plan.temporaries), 1)
+        self.assertTrue(isinstance(plan.functions[0][0], EvalReference))
+
+        plan.evaluate_temporaries(self.dframe)
+
+        for formula, functions in zip(formulas, plan.functions):
+            column = build_columns(
+                self.dataset, self.dframe, functions, 'planned')[0]
+            expected = build_columns(
+                self.dataset, self.dframe, Parser.parse(formula)[0],
+                'parsed')[0]
+
+            self.assertTrue(all((column - expected).abs().fillna(0) < 1e-9))
+
+    def test_subterms_of_batch_columns_are_not_shared(self):
+        formulas = ['amount + rating_plus', 'amount + rating_plus']
+        plan = CalculationPlan(self.dataset, formulas, self.dframe.columns)
+
+        self.assertEqual(plan.temporaries, [])
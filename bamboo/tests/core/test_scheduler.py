@@ -0,0 +1,38 @@
+from bamboo.core.scheduler import calculation_pool, dependency_levels
+from bamboo.models.calculation import Calculation
+from bamboo.models.dataset import Dataset
+from bamboo.tests.test_base import TestBase
+
+
+class TestScheduler(TestBase):
+
+    def setUp(self):
+        TestBase.setUp(self)
+        self.dataset = Dataset()
+        self.dataset.save(self.test_dataset_ids['good_eats.csv'])
+
+    def _calculation(self, formula, name):
+        return Calculation({Calculation.FORMULA: formula,
+                            Calculation.NAME: name})
+
+    def test_dependency_levels(self):
+        first = self._calculation('amount + 1', 'first')
+        second = self._calculation('first * 2', 'second')
+        other = self._calculation('gps_alt', 'other')
+        third = self._calculation('second - first', 'third')
+
+        levels = dependency_levels(self.dataset, [third, second, first, other])
+
+        self.assertEqual(levels, [[first, other], [second], [third]])
+
+    def test_dependency_levels_with_cycle(self):
+        first = self._calculation('second + 1', 'first')
+        second = self._calculation('first + 1', 'second')
+
+        levels = dependency_levels(self.dataset, [first, second])
+
+        self.assertEqual(levels, [[first, second]])
+
+    def test_calculation_pool(self):
+        with calculation_pool(2) as pool:
+            self.assertEqual(pool.map(abs, [-1, -2, 3]), [1, 2, 3])
@@ -0,0 +1,43 @@
+from pandas import Series
+
+from bamboo.core.summary import column_state, summary_from_state,\
+    update_column_state
+from bamboo.tests.test_base import TestBase
+
+
+class TestSummary(TestBase):
+
+    def setUp(self):
+        TestBase.setUp(self)
+        # timestamps, whose squares lose the digits of their deviations
+        self.values = Series([1357000000.0 + i for i in [1, 2, 4, 8, 16]])
+
+    def _assert_summary(self, state, values):
+        summary = summary_from_state(state)
+
+        self.assertEqual(summary['count'], values.count())
+        self.assertAlmostEqual(summary['mean'], values.mean(), 4)
+        self.assertAlmostEqual(summary['std'], values.std(), 6)
+
+    def test_summary_from_state(self):
+        self._assert_summary(column_state(False, self.values), self.values)
+
+    def test_update_column_state(self):
+        state = column_state(False, self.values[:3])
+        state = update_column_state(state, False, self.values[3:])
+
+        self._assert_summary(state, self.values)
+
+        state = update_column_state(state, False, self.values[1:3],
+                                    retract=True)
+
+        self._assert_summary(state, self.values.drop([1, 2]))
+
+    def test_update_column_state_with_sums(self):
+        state = column_state(False, self.values)
+        state = {key: value for key, value in state.items()
+                 if key not in ['mean', 'm2']}
+        state.update({'sum': 0.0, 'sum_squares': 0.0})
+
+        self.assertEqual(
+            update_column_state(state, False, self.values[:1]), None)
@@ -0,0 +1,33 @@
+from bamboo.lib.cache import LRUCache
+from bamboo.tests.test_base import TestBase
+
+
+class TestLRUCache(TestBase):
+
+    def test_evict_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_evict_by_weight(self):
+        cache = LRUCache(10, max_weight=10, weigh=len)
+        cache.set('a', 'x' * 4)
+        cache.set('b', 'x' * 4)
+        cache.set('c', 'x' * 4)
+
+        self.assertFalse('a' in cache)
+        self.assertEqual(cache.weight, 8)
+
+        cache.pop('b')
+        self.assertEqual(cache.weight, 4)
+
+        # values heavier than the cache are not stored
+        cache.set('d', 'x' * 11)
+        self.assertFalse('d' in cache)
+        self.assertEqual(cache.weight, 4)
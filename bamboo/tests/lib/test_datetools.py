@@ -1,6 +1,8 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from bamboo.lib.datetools import recognize_dates
+from pandas import DataFrame
+
+from bamboo.lib.datetools import DATE_SAMPLE_SIZE, recognize_dates
 from bamboo.lib.schema_builder import DATETIME, SIMPLETYPE, Schema
 from bamboo.tests.test_base import TestBase
 
@@ -34,3 +36,31 @@ class TestDatetools(TestBase):
 
         for field in df_with_dates['submit_date']:
             self.assertTrue(isinstance(field, datetime))
+
+    def test_recognize_dates_outside_sample(self):
+        start = datetime(2012, 1, 1)
+        dates = [start + timedelta(days=i)
+                 for i in xrange(DATE_SAMPLE_SIZE * 3)]
+        strings = [d.strftime('%m/%d/%Y') for d in dates]
+        dframe = DataFrame({
+            'dates': strings,
+            'mixed': strings[:-1] + ['not a date'],
+        })
+        df_with_dates = recognize_dates(dframe)
+
+        self.assertEqual(df_with_dates['dates'].tolist(), dates)
+
+        for field in df_with_dates['mixed']:
+            self.assertTrue(isinstance(field, basestring))
+
+    def test_recognize_dates_not_matching_format(self):
+        start = datetime(2012, 1, 1)
+        dates = [start + timedelta(days=i)
+                 for i in xrange(DATE_SAMPLE_SIZE * 3)]
+        strings = [d.strftime('%m/%d/%Y') for d in dates[:-1]]
+        dframe = DataFrame({
+            'dates': strings + [dates[-1].strftime('%Y/%m/%d')],
+        })
+        df_with_dates = recognize_dates(dframe)
+
+        self.assertEqual(df_with_dates['dates'].tolist(), dates)
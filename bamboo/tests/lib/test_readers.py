@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+from cStringIO import StringIO
+from datetime import datetime
+from tempfile import NamedTemporaryFile
+
+import simplejson as json
+
+from bamboo.lib.readers import json_chunk_reader, json_records
+from bamboo.tests.test_base import TestBase
+
+
+class TestReaders(TestBase):
+
+    def setUp(self):
+        TestBase.setUp(self)
+        self.records = [
+            {u'name': u'α' * 10, u'amount': 1.5},
+            {u'name': u'b', u'amount': 2, u'tags': [1, {u'x': u']'}]},
+            {u'name': u'c', u'amount': None},
+        ]
+
+    def test_json_records_array(self):
+        content = json.dumps(self.records, indent=4, ensure_ascii=False)
+
+        for block_size in [1, 7, 1024]:
+            records = json_records(StringIO(content.encode('utf-8')),
+                                   block_size=block_size)
+
+            self.assertEqual(list(records), self.records)
+
+    def test_json_records_lines(self):
+        content = '\n'.join([json.dumps(r) for r in self.records]) + '\n'
+
+        for block_size in [1, 7, 1024]:
+            records = json_records(StringIO(content), block_size=block_size)
+
+            self.assertEqual(list(records), self.records)
+
+    def test_json_records_empty(self):
+        self.assertEqual(list(json_records(StringIO(' [ ] '))), [])
+        self.assertEqual(list(json_records(StringIO(''))), [])
+
+    def test_json_records_invalid(self):
+        records = json_records(StringIO('[{"a": 1}, {"a": '), block_size=4)
+
+        self.assertEqual(records.next(), {'a': 1})
+        self.assertRaises(ValueError, records.next)
+
+    def test_json_records_columns(self):
+        content = json.dumps({u'name': [u'a', u'b'], u'amount': [1, None]})
+
+        self.assertEqual(list(json_records(StringIO(content), block_size=4)),
+                         [{u'name': u'a', u'amount': 1},
+                          {u'name': u'b', u'amount': None}])
+
+        content = json.dumps({u'name': {u'1': u'b', u'0': u'a'},
+                              u'amount': {u'0': 1}})
+
+        self.assertEqual(list(json_records(StringIO(content))),
+                         [{u'name': u'a', u'amount': 1}, {u'name': u'b'}])
+
+        # more than one object holds records by line
+        content = '{"tags": [1]}\n{"tags": [2]}'
+
+        self.assertEqual(list(json_records(StringIO(content))),
+                         [{u'tags': [1]}, {u'tags': [2]}])
+
+        for content in ['{"a": [1, 2], "b": [1]}', '{"a": [1], "b": {}}']:
+            records = json_records(StringIO(content))
+
+            self.assertRaises(ValueError, list, records)
+
+    def test_json_records_not_objects(self):
+        for content in ['[1, 2, 3]', '[[1, 2]]', '5']:
+            records = json_records(StringIO(content))
+
+            self.assertRaises(ValueError, list, records)
+
+        records = json_records(StringIO('{"a": 1}5'))
+
+        self.assertEqual(records.next(), {'a': 1})
+        self.assertRaises(ValueError, records.next)
+
+    def test_json_chunk_reader(self):
+        with open(self._fixture_path_prefix('good_eats.json')) as f:
+            num_records = len(json.load(f))
+
+        tmpfile = NamedTemporaryFile(delete=False)
+        tmpfile.write(open(self._fixture_path_prefix('good_eats.json')).read())
+        tmpfile.close()
+
+        dframes = list(json_chunk_reader(tmpfile.name, chunksize=5))
+
+        self.assertEqual([len(dframe) for dframe in dframes][:-1],
+                         [5] * (len(dframes) - 1))
+        self.assertEqual(sum([len(dframe) for dframe in dframes]),
+                         num_records)
+
+        for dframe in dframes:
+            self.assertTrue(all(isinstance(d, datetime) for d in
+                                dframe.submit_date))
@@ -1,7 +1,10 @@
-from numpy import isnan
+from numpy import arange, isnan
+from pandas import DataFrame
 
 from bamboo.core.frame import RESERVED_KEYS
-from bamboo.lib.schema_builder import CARDINALITY, Schema, schema_from_dframe
+from bamboo.lib.datetools import recognize_dates
+from bamboo.lib.schema_builder import CARDINALITY, DATETIME, INTEGER,\
+    SIMPLETYPE, STRING, Schema, schema_from_dframe
 from bamboo.tests.test_base import TestBase
 
 
@@ -65,3 +68,34 @@ class TestSchema(TestBase):
 
         for key in RESERVED_KEYS:
             self.assertFalse(key in schema)
+
+    def test_schema_from_dframe_sketches(self):
+        sketches = {}
+        schema = schema_from_dframe(self.dframe, sketches=sketches)
+
+        self.assertEqual(sorted(sketches.keys()), sorted(schema.keys()))
+
+        for column, sketch in sketches.items():
+            self.assertEqual(sketch.cardinality, schema[column][CARDINALITY])
+
+        self.assertEqual(schema['rating'][CARDINALITY],
+                         self.dframe['rating'].nunique())
+
+    def test_schema_from_dframe_large(self):
+        num_rows = 50000
+        dframe = DataFrame({
+            'ints': arange(num_rows),
+            'strings': ['s%d' % (i % 10) for i in xrange(num_rows)],
+        })
+        schema = schema_from_dframe(dframe)
+
+        self.assertEqual(schema['ints'][SIMPLETYPE], INTEGER)
+        self.assertEqual(schema['strings'][SIMPLETYPE], STRING)
+        self.assertEqual(schema['strings'][CARDINALITY], 10)
+        self.assertTrue(abs(schema['ints'][CARDINALITY] - num_rows) <
+                        num_rows * 0.05)
+
+    def test_schema_from_dframe_dates(self):
+        schema = schema_from_dframe(recognize_dates(self.dframe))
+
+        self.assertEqual(schema['submit_date'][SIMPLETYPE], DATETIME)
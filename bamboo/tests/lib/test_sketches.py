@@ -0,0 +1,109 @@
+import numpy as np
+from pandas import Series
+
+from bamboo.lib.sketches import CardinalitySketch, QuantileSketch
+from bamboo.tests.test_base import TestBase
+
+
+class TestCardinalitySketch(TestBase):
+
+    def test_exact_cardinality(self):
+        values = Series(['a', 'b', None, 'a', 1, 1.0, np.nan, 2])
+        sketch = CardinalitySketch.from_values(values.values)
+
+        self.assertEqual(sketch.cardinality, 4)
+        self.assertEqual(sketch.update(Series([2, 3]).values).cardinality, 5)
+
+    def test_text_cardinality(self):
+        values = Series(['a', u'a', u'\xe9', u'\xe9'.encode('utf-8'), '',
+                         'x' * 20 + 'a', 'x' * 20 + 'b'])
+        sketch = CardinalitySketch.from_values(values.values)
+
+        self.assertEqual(sketch.cardinality, 5)
+
+        values = Series(['s%d' % i for i in xrange(50000)], dtype=object)
+        sketch = CardinalitySketch.from_values(values.values)
+
+        self.assertTrue(abs(sketch.cardinality - 50000) < 2500)
+
+    def test_approximate_cardinality(self):
+        sketch = CardinalitySketch.from_values(np.arange(50000))
+
+        self.assertTrue(sketch.hashes is None)
+        self.assertTrue(abs(sketch.cardinality - 50000) < 2500)
+
+    def test_merge(self):
+        sketch = CardinalitySketch.from_values(np.arange(600))
+        sketch.merge(CardinalitySketch.from_values(np.arange(300, 900)))
+
+        self.assertEqual(sketch.cardinality, 900)
+
+        sketch.merge(CardinalitySketch.from_values(np.arange(20000)))
+        self.assertTrue(abs(sketch.cardinality - 20000) < 1000)
+
+    def test_json(self):
+        for num_values in [100, 5000]:
+            sketch = CardinalitySketch.from_values(np.arange(num_values))
+            loaded = CardinalitySketch.from_json(sketch.to_json())
+
+            self.assertEqual(loaded.cardinality, sketch.cardinality)
+
+
+class TestQuantileSketch(TestBase):
+
+    def setUp(self):
+        TestBase.setUp(self)
+        self.values = np.random.RandomState(0).normal(size=20000)
+
+    def test_exact_quantiles(self):
+        values = Series([3.0, 1.0, np.nan, 7.0, 2.0, 12.0])
+        sketch = QuantileSketch.from_values(values)
+
+        self.assertEqual(sketch.count, 5)
+
+        for q in [0.0, 0.1, 0.5, 0.75, 1.0]:
+            self.assertAlmostEqual(sketch.quantile(q), values.quantile(q))
+
+    def test_empty(self):
+        self.assertTrue(np.isnan(QuantileSketch().quantile(0.5)))
+
+    def test_approximate_quantiles(self):
+        sketch = QuantileSketch.from_values(self.values)
+
+        self.assertTrue(len(sketch.means) <= sketch.max_centroids)
+        self.assertEqual(sketch.count, len(self.values))
+
+        for q in [0.01, 0.25, 0.5, 0.75, 0.99]:
+            rank = (self.values < sketch.quantile(q)).mean()
+            self.assertTrue(abs(rank - q) < 0.005)
+
+    def test_merge(self):
+        sketch = QuantileSketch.from_values(self.values[:15000])
+        sketch.merge(QuantileSketch.from_values(self.values[15000:]))
+
+        self.assertEqual(sketch.count, len(self.values))
+        rank = (self.values < sketch.quantile(0.5)).mean()
+        self.assertTrue(abs(rank - 0.5) < 0.005)
+
+    def test_remove(self):
+        values = Series([3.0, 1.0, 7.0, 2.0, 12.0, 7.0])
+        sketch = QuantileSketch.from_values(values)
+
+        self.assertTrue(sketch.remove([7.0, 1.0]))
+        self.assertFalse(sketch.remove(np.arange(10)))
+        self.assertAlmostEqual(sketch.quantile(0.5),
+                               Series([3.0, 2.0, 12.0, 7.0]).quantile(0.5))
+
+        sketch = QuantileSketch.from_values(self.values)
+        sketch.remove(self.values[:10000])
+
+        self.assertEqual(sketch.count, 10000)
+        rank = (self.values[10000:] < sketch.quantile(0.5)).mean()
+        self.assertTrue(abs(rank - 0.5) < 0.02)
+
+    def test_json(self):
+        sketch = QuantileSketch.from_values(self.values)
+        loaded = QuantileSketch.from_json(sketch.to_json())
+
+        self.assertEqual(loaded.count, sketch.count)
+        self.assertAlmostEqual(loaded.quantile(0.3), sketch.quantile(0.3))
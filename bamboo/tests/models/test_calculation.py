@@ -138,3 +138,29 @@ class TestCalculation(TestBase):
         self.assertEqual(calculation.dependent_calculations, ['test1'])
         calculation = Calculation.find_one(self.dataset.dataset_id, 'test')
         assert_raises(DependencyError, calculation.delete, self.dataset)
+
+    def test_claim_pending(self):
+        self._save_observations()
+        calculations = [Calculation().save(self.dataset, self.formula, name)
+                        for name in ['test', 'test1']]
+
+        claimed = Calculation.claim_pending(self.dataset, 'task')
+
+        self.assertEqual(['test', 'test1'], [c.name for c in claimed])
+        self.assertTrue(all([c.is_running for c in claimed]))
+        self.assertEqual([], Calculation.claim_pending(self.dataset, 'other'))
+
+        unfinished = Calculation.find_unfinished(calculations, 'other')
+
+        self.assertEqual([], unfinished)
+
+    def test_find_unfinished(self):
+        self._save_observations()
+        calculation = Calculation().save(self.dataset, self.formula, 'test')
+        Calculation.claim_pending(self.dataset, 'task')
+        pending = Calculation().save(self.dataset, self.formula, 'test1')
+
+        unfinished = Calculation.find_unfinished([pending], 'task')
+
+        self.assertEqual(sorted([calculation.name, pending.name]),
+                         sorted([c.name for c in unfinished]))
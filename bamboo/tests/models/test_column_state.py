@@ -0,0 +1,50 @@
+from bamboo.models.column_state import ColumnState
+from bamboo.models.dataset import Dataset
+from bamboo.tests.test_base import TestBase
+
+
+class TestColumnState(TestBase):
+
+    def setUp(self):
+        TestBase.setUp(self)
+        self.dataset = Dataset.create(self.test_dataset_ids['good_eats.csv'])
+        self.states = {
+            'amount': {'count': 2, 'sum': 3.0},
+            'food_type': {'counts': {'lunch': 1, 'dinner.late': 1}},
+        }
+
+    def test_save_all(self):
+        ColumnState.save_all(self.dataset, 'summary', self.states)
+
+        self.assertEqual(ColumnState.find_all(self.dataset, 'summary'),
+                         self.states)
+        self.assertEqual(ColumnState.find_all(self.dataset, 'other'), {})
+
+        # states are replaced
+        ColumnState.save_all(self.dataset, 'summary', {'amount': {}})
+
+        self.assertEqual(ColumnState.find_all(
+            self.dataset, 'summary', ['amount']), {'amount': {}})
+
+    def test_delete_all(self):
+        ColumnState.save_all(self.dataset, 'summary', self.states)
+        ColumnState.save_all(self.dataset, 'other', self.states)
+        ColumnState.delete_all(self.dataset, 'summary', ['amount'])
+
+        self.assertEqual(ColumnState.find_all(self.dataset, 'summary').keys(),
+                         ['food_type'])
+
+        ColumnState.delete_all(self.dataset)
+
+        self.assertEqual(ColumnState.find_all(self.dataset, 'other'), {})
+
+    def test_merge_all(self):
+        ColumnState.save_all(self.dataset, 'sum', {'amount': 1})
+        ColumnState.merge_all(self.dataset, 'sum', {'amount': 2, 'other': 3},
+                              lambda stored, value: stored + value)
+        ColumnState.merge_all(self.dataset, 'sum', {'amount': 4},
+                              lambda stored, value: stored + value)
+
+        # states which are not stored are skipped
+        self.assertEqual(ColumnState.find_all(self.dataset, 'sum'),
+                         {'amount': 7})
@@ -1,12 +1,18 @@
 from datetime import datetime
+import os
+import shutil
+from tempfile import NamedTemporaryFile
 
+from mock import patch
 from pandas import DataFrame
 
+from bamboo.core.frame import INDEX
 from bamboo.tests.test_base import TestBase
-from bamboo.models.dataset import Dataset
+from bamboo.models.dataset import Dataset, DFRAME_CACHE
 from bamboo.models.observation import Observation
 from bamboo.lib.datetools import recognize_dates
 from bamboo.lib.mongo import MONGO_ID_ENCODED
+from bamboo.lib.readers import csv_byte_ranges, import_csv_ranges
 from bamboo.lib.schema_builder import OLAP_TYPE, RE_ENCODED_COLUMN, SIMPLETYPE
 
 
@@ -120,6 +126,182 @@ class TestDataset(TestBase):
         # ensure date is converted
         self.assertTrue(isinstance(dframe.submit_date[0], datetime))
 
+    def test_dframe_cache(self):
+        dataset = Dataset.create(self.test_dataset_ids['good_eats.csv'])
+        dataset.save_observations(
+            recognize_dates(self.get_data('good_eats.csv')))
+        version = dataset.data_version
+        dframe = dataset.dframe()
+
+        # a new instance reads a copy of the cached DataFrame
+        other = Dataset.find_one(dataset.dataset_id)
+        hits = DFRAME_CACHE.hits
+        cached = other.dframe()
+
+        self.assertEqual(DFRAME_CACHE.hits, hits + 1)
+        self.assertFalse(cached is dframe)
+        self.assertEqual(cached.columns.tolist(), dframe.columns.tolist())
+        self.assertEqual(len(cached), len(dframe))
+
+        other.delete_observation(0)
+
+        self.assertTrue(other.data_version > version)
+        self.assertEqual(len(Dataset.find_one(
+            dataset.dataset_id).dframe()), len(dframe) - 1)
+
+    def test_dframe_cache_stale_record(self):
+        dataset = Dataset.create(self.test_dataset_ids['good_eats.csv'])
+        dataset.save_observations(
+            recognize_dates(self.get_data('good_eats.csv')))
+        num_rows = len(dataset.dframe())
+
+        # rows deleted after this record was read are not read from the cache
+        stale = Dataset.find_one(dataset.dataset_id)
+        Dataset.find_one(dataset.dataset_id).delete_observation(0)
+
+        self.assertEqual(len(stale.dframe()), num_rows - 1)
+
+    def test_append_observations(self):
+        dataset = Dataset.create(self.test_dataset_ids['good_eats.csv'])
+        dataset.save_observations(
+            recognize_dates(self.get_data('good_eats.csv')))
+        dframe = dataset.dframe()
+        new_dframe = dframe[:2].copy()
+        new_dframe.index = [len(dframe), len(dframe) + 1]
+        new_dframe['rating'] = 'new rating'
+
+        with patch.object(Dataset, 'dframe') as mock:
+            dataset.append_observations(new_dframe)
+
+        self.assertFalse(mock.called)
+
+        dataset = Dataset.find_one(dataset.dataset_id)
+
+        self.assertEqual(dataset.num_rows, len(dframe) + 2)
+        self.assertEqual(dataset.cardinality('rating'),
+                         dframe['rating'].nunique() + 1)
+        self.assertEqual(dataset.cardinality('food_type'),
+                         dframe['food_type'].nunique())
+
+    def test_append_observations_stale_num_rows(self):
+        dataset = Dataset.create(self.test_dataset_ids['good_eats.csv'])
+        dataset.save_observations(
+            recognize_dates(self.get_data('good_eats.csv')))
+        dframe = dataset.dframe()
+        new_dframe = dframe[:2].copy()
+        new_dframe.index = [len(dframe), len(dframe) + 1]
+
+        # a row deleted after this record was read stays deleted
+        Dataset.find_one(dataset.dataset_id).delete_observation(0)
+        dataset.append_observations(new_dframe)
+
+        self.assertEqual(Dataset.find_one(dataset.dataset_id).num_rows,
+                         len(dframe) + 1)
+
+    def test_cardinality_sketches(self):
+        dataset = Dataset.create(self.test_dataset_ids['good_eats.csv'])
+        dataset.update({Dataset.CARDINALITY_SKETCHES: {'rating': '{}'}})
+        dataset.save_observations(
+            recognize_dates(self.get_data('good_eats.csv')))
+        dataset = Dataset.find_one(dataset.dataset_id)
+        sketches = dataset.cardinality_sketches()
+
+        self.assertFalse(Dataset.CARDINALITY_SKETCHES in dataset.record)
+        self.assertEqual(sorted(sketches.keys()),
+                         sorted(dataset.schema.keys()))
+        self.assertEqual(sketches['rating'].cardinality,
+                         dataset.cardinality('rating'))
+
+        dataset.delete_columns('rating')
+
+        self.assertEqual(dataset.cardinality_sketches(['rating']), {})
+
+    def test_import_csv_ranges(self):
+        tmpfile = NamedTemporaryFile(delete=False)
+        shutil.copyfileobj(
+            open(self._fixture_path_prefix('good_eats.csv')), tmpfile)
+        tmpfile.close()
+
+        expected = self.get_data('good_eats.csv')
+        header, ranges = csv_byte_ranges(tmpfile.name, 1000)
+
+        self.assertTrue(len(ranges) > 2)
+        self.assertEqual(sum([r[-1] for r in ranges]), len(expected))
+
+        dataset = Dataset.create(self.test_dataset_ids['good_eats.csv'])
+        import_csv_ranges(dataset, tmpfile.name, range_size=1000)
+        dataset = Dataset.find_one(dataset.dataset_id)
+        dframe = dataset.dframe(index=True)
+
+        self.assertTrue(dataset.is_ready)
+        self.assertFalse(os.path.exists(tmpfile.name))
+        self.assertEqual(dataset.num_rows, len(expected))
+        self.assertEqual(sorted(dframe[INDEX].tolist()),
+                         range(len(expected)))
+        self.assertTrue(all(isinstance(d, datetime) for d in
+                            dframe.submit_date))
+
+        for column in ['rating', 'food_type', 'amount']:
+            self.assertEqual(dataset.cardinality(column),
+                             expected[column].nunique())
+
+        summaries = dataset.stats[Dataset.ALL]
+
+        self.assertEqual(summaries['amount']['summary']['count'],
+                         expected['amount'].count())
+        self.assertEqual(sum(summaries['food_type']['summary'].values()),
+                         expected['food_type'].count())
+
+    def test_delete_observation(self):
+        dataset = Dataset.create(self.test_dataset_ids['good_eats.csv'])
+        dataset.save_observations(
+            recognize_dates(self.get_data('good_eats.csv')))
+        num_rows = dataset.num_rows
+
+        with patch.object(Dataset, 'dframe') as mock:
+            dataset.delete_observation(0)
+
+        self.assertFalse(mock.called)
+
+        dataset = Dataset.find_one(dataset.dataset_id)
+        dframe = dataset.dframe()
+
+        self.assertEqual(dataset.num_rows, num_rows - 1)
+        self.assertEqual(len(dframe), num_rows - 1)
+        self.assertEqual(dataset.cardinality('rating'),
+                         dframe['rating'].nunique())
+
+    def test_delete_observation_then_append(self):
+        dataset = Dataset.create(self.test_dataset_ids['good_eats.csv'])
+        dframe = recognize_dates(self.get_data('good_eats.csv'))
+        dframe.ix[0, 'rating'] = 'only rating'
+        dataset.save_observations(dframe)
+        num_rows = dataset.num_rows
+
+        dataset.delete_observation(0)
+        dataset = Dataset.find_one(dataset.dataset_id)
+        new_dframe = dataset.dframe()[:1].copy()
+        new_dframe.index = [num_rows]
+        dataset.append_observations(new_dframe)
+
+        # the deleted value is not counted again
+        dataset = Dataset.find_one(dataset.dataset_id)
+
+        self.assertEqual(dataset.cardinality('rating'),
+                         dframe['rating'].nunique() - 1)
+
+    def test_sorted_column(self):
+        dataset = Dataset.create(self.test_dataset_ids['good_eats.csv'])
+        dataset.save_observations(
+            recognize_dates(self.get_data('good_eats.csv')))
+        amounts = dataset.dframe()['amount']
+
+        sorted_values, num_rows = dataset.sorted_column('amount')
+
+        self.assertEqual(num_rows, len(amounts))
+        self.assertEqual(list(sorted_values), sorted(amounts.dropna()))
+        self.assertTrue(dataset.sorted_column('amount')[0] is sorted_values)
+
     def test_count(self):
         dataset = Dataset.create(self.test_dataset_ids['good_eats.csv'])
         dataset.save_observations(
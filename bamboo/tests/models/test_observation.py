@@ -1,8 +1,14 @@
+from datetime import datetime, timedelta
+
+from pandas import NaT
+
 from bamboo.core.frame import INDEX
+from bamboo.lib.datetools import now, recognize_dates
+from bamboo.lib.exceptions import ArgumentError
 from bamboo.lib.mongo import dump_mongo_json, MONGO_ID, MONGO_ID_ENCODED
 from bamboo.lib.query_args import QueryArgs
 from bamboo.models.dataset import Dataset
-from bamboo.models.observation import Observation
+from bamboo.models.observation import ENCODING_CACHE, Observation
 from bamboo.tests.test_base import TestBase
 
 
@@ -41,6 +47,26 @@ class TestObservation(TestBase):
         for v in encoding.values():
             self.assertTrue(isinstance(int(v), int))
 
+    def test_encoding_cache(self):
+        self.__save_records()
+        version = self.dataset.record[Observation.ENCODING_VERSION]
+        encoding = Observation.encoding(self.dataset)
+
+        self.assertEqual(ENCODING_CACHE.get(self.dataset.dataset_id),
+                         (version, encoding, Observation.decoding(
+                             self.dataset)))
+
+        Observation.delete_columns(self.dataset, ['rating'])
+
+        self.assertNotEqual(
+            self.dataset.record[Observation.ENCODING_VERSION], version)
+        self.assertFalse('rating' in Observation.encoding(self.dataset))
+
+        Observation.delete_encoding(self.dataset)
+
+        self.assertFalse(self.dataset.dataset_id in ENCODING_CACHE)
+        self.assertEqual(Observation.encoding(self.dataset), None)
+
     def test_encode_no_dataset(self):
         records = self.__save_records()
 
@@ -52,6 +78,18 @@ class TestObservation(TestBase):
         records = self.__save_records()
         self.assertEqual(len(records), 19)
 
+    def test_save_encodes_columns(self):
+        dframe = recognize_dates(self.get_data('good_eats.csv'))
+        dframe['submit_date'][0] = NaT
+        Observation.save(dframe, self.dataset)
+        records = [self.__decode(r) for r in Observation.find(
+            self.dataset, QueryArgs(select={'submit_date': 1, INDEX: 1}))]
+        dates = {r[INDEX]: r['submit_date'] for r in records}
+
+        self.assertEqual(dates[0], None)
+        self.assertTrue(all(isinstance(d, datetime) for i, d in
+                        dates.items() if i))
+
     def test_save_over_bulk(self):
         Observation.save(self.get_data('good_eats_large.csv'),
                          self.dataset)
@@ -59,6 +97,15 @@ class TestObservation(TestBase):
 
         self.assertEqual(len(records), 1001)
 
+    def test_read_dframe_over_batches(self):
+        Observation.save(self.get_data('good_eats_large.csv'),
+                         self.dataset)
+        dframe = self.dataset.dframe(index=True)
+
+        self.assertEqual(len(dframe), 1001)
+        self.assertEqual(dframe.index.tolist(), range(1001))
+        self.assertEqual(sorted(dframe['index'].tolist()), range(1001))
+
     def test_find(self):
         self.__save_records()
         rows = Observation.find(self.dataset)
@@ -115,6 +162,50 @@ class TestObservation(TestBase):
         self.assertEqual(dump_mongo_json(records[1:]),
                          dump_mongo_json(new_records))
 
+    def test_update_rows(self):
+        records = [self.__decode(r) for r in self.__save_records()]
+        indices = [records[0][INDEX], records[1][INDEX]]
+
+        Observation.update_rows(self.dataset, [
+            (indices[0], {'rating': 'delectible'}),
+            (indices[1], {'rating': 'epic_eat'})])
+
+        records = [self.__decode(r) for r in Observation.find(self.dataset)]
+        ratings = {r[INDEX]: r['rating'] for r in records}
+
+        self.assertEqual(len(records), 19)
+        self.assertEqual(ratings[indices[0]], 'delectible')
+        self.assertEqual(ratings[indices[1]], 'epic_eat')
+        self.assertEqual(len(Observation.find(
+            self.dataset, include_deleted=True)), 21)
+
+    def test_update_rows_missing_index(self):
+        records = [self.__decode(r) for r in self.__save_records()]
+
+        self.assertRaises(ArgumentError, Observation.update_rows,
+                          self.dataset, [(records[0][INDEX], {'rating': 'x'}),
+                                         (len(records), {'rating': 'x'})])
+        self.assertEqual(len(Observation.find(
+            self.dataset, include_deleted=True)), 19)
+
+    def test_compact(self):
+        records = [self.__decode(r) for r in self.__save_records()]
+        Observation.update(self.dataset, records[0][INDEX], {'rating': 'x'})
+        Observation.delete(self.dataset, records[1][INDEX])
+
+        self.assertEqual(Observation.compact(
+            self.dataset, now() - timedelta(days=1)), 0)
+        self.assertEqual(Observation.compact(
+            self.dataset, now() + timedelta(seconds=1)), 2)
+
+        archive = Observation.set_collection(Observation.__archivename__)
+
+        self.assertEqual(len(Observation.find(self.dataset)), 18)
+        self.assertEqual(len(Observation.find(
+            self.dataset, include_deleted=True)), 18)
+        self.assertEqual(archive.find({Observation.DELETED_AT: {
+            '$ne': 0}}).count(), 2)
+
     def test_delete_encoding(self):
         self.__save_records()
         encoding = Observation.encoding(self.dataset)
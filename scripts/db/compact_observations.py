@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import sys
+sys.path.append(os.getcwd())
+
+from bamboo.config.settings import TOMBSTONE_RETENTION_DAYS
+from bamboo.models.dataset import compact_task
+
+
+def compact(retention_days, archive):
+    """Remove deleted rows older than `retention_days` and print counts."""
+    num_removed = compact_task(retention_days=retention_days, archive=archive)
+
+    for dataset_id, count in sorted(num_removed.items()):
+        if count:
+            print '%s: %d' % (dataset_id, count)
+
+    print 'removed %d rows from %d datasets' % (
+        sum(num_removed.values()), len([c for c in num_removed.values() if c]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--days', type=int,
+                        default=TOMBSTONE_RETENTION_DAYS,
+                        help='The number of days to keep deleted rows for')
+    parser.add_argument('--no-archive', action='store_true',
+                        help='Purge deleted rows instead of archiving them')
+    args = parser.parse_args()
+
+    compact(args.days, not args.no_archive)
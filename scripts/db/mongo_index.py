@@ -8,6 +8,7 @@ from pymongo import ASCENDING
 
 from bamboo.config.db import Database
 from bamboo.core.frame import DATASET_ID
+from bamboo.models.column_state import ColumnState
 from bamboo.models.observation import Observation
 
 # The encoded dataset_id will be set to '0'.
@@ -26,6 +27,7 @@ def ensure_indexing():
 
     # collections
     calculations = db.calculations
+    column_states = db.column_states
     datasets = db.datasets
     observations = db.observations
 
@@ -34,6 +36,9 @@ def ensure_indexing():
     bamboo_index(observations, ENCODED_DATASET_ID)
     bamboo_index(observations, Observation.ENCODING_DATASET_ID)
     bamboo_index(calculations, DATASET_ID)
+    column_states.ensure_index([(DATASET_ID, ASCENDING),
+                                (ColumnState.KIND, ASCENDING),
+                                (ColumnState.COLUMN, ASCENDING)])
 
 
 if __name__ == '__main__':
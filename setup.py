@@ -48,7 +48,7 @@ setup(
         # for celery
         'kombu',
         'celery',
-        'pymongo',
+        'pymongo>=2.7',
 
         'cherrypy',
         'pyparsing',